@@ -0,0 +1,104 @@
+#!flask/bin/python
+"""Time a class of students logging in at once, hashing on the request threads or in worker processes.
+
+Builds a throwaway SQLite database of students, then has --students
+threads each post to /auth/login while another thread keeps requesting a
+cheap page, as other users of the site would.  For each setting of
+COURSEME_PASSWORD_PROCESSES it reports logins per second and how long the
+other requests took meanwhile.
+
+    python benchmarks/login_throughput.py [--students 30] [--processes 0,1,2,4] [--method pbkdf2:sha256:150000]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from courseme import create_app, db
+from courseme.models import User
+from courseme.util.passwords import hasher, hash_passwords
+
+
+def populate(count):
+    hashes = hash_passwords(['password%d' % i for i in range(count)], processes=None)
+    db.session.execute(User.__table__.insert(), [
+        {'email': 'student%d@example.com' % i, 'name': 'student%d' % i, 'slug': 'student%d' % i,
+         'password_hash': password_hash, 'role': 0, 'unread_messages': 0, 'session_version': 0}
+        for i, password_hash in enumerate(hashes)])
+    db.session.commit()
+
+
+def login_storm(app, students):
+    """Log every student in at once; returns (logins per second, other request latencies)"""
+    start = threading.Event()
+    done = threading.Event()
+    failures = []
+    latencies = []
+
+    def login(i):
+        client = app.test_client()
+        start.wait()
+        response = client.post('/auth/login', data={'email': 'student%d@example.com' % i,
+                                                    'password': 'password%d' % i})
+        if response.status_code != 302:
+            failures.append(i)
+
+    def browse():
+        client = app.test_client()
+        start.wait()
+        while not done.is_set():
+            began = time.time()
+            client.get('/auth/login')
+            latencies.append(time.time() - began)
+
+    threads = [threading.Thread(target=login, args=(i,)) for i in range(students)]
+    browser = threading.Thread(target=browse)
+    for thread in threads + [browser]:
+        thread.start()
+    began = time.time()
+    start.set()
+    for thread in threads:
+        thread.join()
+    elapsed = time.time() - began
+    done.set()
+    browser.join()
+    assert not failures, "%d logins failed" % len(failures)
+    return students / elapsed, sorted(latencies)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--students', type=int, default=30)
+    parser.add_argument('--processes', default='0,1,2,4')
+    parser.add_argument('--method', default='pbkdf2:sha256:150000')
+    args = parser.parse_args()
+
+    handle, path = tempfile.mkstemp(suffix='.sqlite')
+    os.close(handle)
+    app = create_app('testing')
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + path
+    app.config['WTF_CSRF_ENABLED'] = False
+    try:
+        with app.app_context():
+            hasher.configure(args.method, app.config['COURSEME_PASSWORD_SALT_LENGTH'], 0)
+            db.create_all()
+            populate(args.students)
+        print "%d students logging in at once, %s" % (args.students, args.method)
+        print "%-10s %12s %22s" % ('processes', 'logins/s', 'other requests p50/max')
+        for processes in [int(p) for p in args.processes.split(',')]:
+            hasher.configure(args.method, app.config['COURSEME_PASSWORD_SALT_LENGTH'], processes)
+            rate, latencies = login_storm(app, args.students)
+            hasher.close()
+            median = latencies[len(latencies) // 2] if latencies else 0
+            worst = latencies[-1] if latencies else 0
+            print "%-10d %12.1f %13.0f / %5.0f ms" % (processes, rate, median * 1000, worst * 1000)
+    finally:
+        os.unlink(path)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+#!flask/bin/python
+"""Time User.recent_modules_by_type for a student who has viewed thousands of modules.
+
+Builds a throwaway SQLite database of modules, some no longer live, and
+a student who has viewed --views of them, then times the feed read from the
+database and read again from the per-process cache.
+
+    python benchmarks/recent_modules.py [--views 5000] [--repeat 20]
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import timeit
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from courseme import create_app, db
+from courseme.models import User, Subject, Module, UserModule, MATERIAL_TYPES, recent_modules_cache
+
+
+def populate(count, rng):
+    subject = Subject(name='subject')
+    author = User(name='author', email='author@example.com')
+    student = User(name='student', email='student@example.com')
+    db.session.add_all([subject, author, student])
+    db.session.commit()
+
+    db.session.execute(Module.__table__.insert(), [
+        {'id': id, 'name': 'module %d' % id, 'material_type': rng.choice(MATERIAL_TYPES),
+         'live': rng.random() < 0.9, 'subject_id': subject.id, 'author_id': author.id}
+        for id in xrange(1, count + 1)])
+    start = datetime(2014, 1, 1)
+    db.session.execute(UserModule.__table__.insert(), [
+        {'user_id': student.id, 'module_id': id, 'first_viewed': start,
+         'last_viewed': start + timedelta(minutes=rng.randint(0, 500000))}
+        for id in xrange(1, count + 1)])
+    db.session.commit()
+    return student
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--views', type=int, default=5000)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    handle, path = tempfile.mkstemp(suffix='.sqlite')
+    os.close(handle)
+    app = create_app('testing')
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + path
+    try:
+        with app.app_context():
+            db.create_all()
+            student = populate(args.views, random.Random(5000))
+            print "%d modules viewed by the student" % args.views
+
+            def uncached():
+                recent_modules_cache.clear()
+                student.recent_modules_by_type(5)
+
+            cases = [
+                ('from the database', uncached),
+                ('from the cache', lambda: student.recent_modules_by_type(5)),
+            ]
+            for name, run in cases:
+                best = min(timeit.repeat(run, number=1, repeat=args.repeat))
+                print "%-20s %8.3f ms" % (name, best * 1000)
+    finally:
+        os.unlink(path)
+
+
+if __name__ == '__main__':
+    main()
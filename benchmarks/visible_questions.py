@@ -0,0 +1,115 @@
+#!flask/bin/python
+"""Time User.visible_questions against the old UNION/INTERSECT query.
+
+Builds a throwaway SQLite database with 50,000 questions spread over a few
+subjects, topics and institutions, then runs both queries for a student
+whose view is restricted by two institutions.
+
+    python benchmarks/visible_questions.py [--questions 50000] [--repeat 5]
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from courseme import create_app, db
+from courseme.models import User, Subject, Topic, Objective, Question, Institution, \
+    institution_approved_questions, question_objectives
+
+
+def compound_query(user, restricted=True, authored=True, subject=True):
+    # DJG - visible_questions as it was before the single query rewrite
+    institution_student = user.institution_student
+    if institution_student and institution_student.view_institution_only:
+        query_student = institution_student.view_institution_only.approved_questions
+    else:
+        query_student = Question.query
+    if user.view_institution_only:
+        query_select = user.view_institution_only.approved_questions
+    else:
+        query_select = Question.query
+    query_restricted = query_select.intersect(query_student) if restricted else Question.query.filter(1 == 0)
+    query_authored = user.questions_authored if authored else Question.query.filter(1 == 0)
+    query_subject = user.subject.questions if subject and user.subject else Question.query
+    return query_restricted.union(query_authored).intersect(Question.query, query_subject)
+
+
+def populate(count, rng):
+    subjects = [Subject(name='subject%d' % i) for i in range(3)]
+    db.session.add_all(subjects)
+    db.session.commit()
+    topics = [Topic(name='topic%d' % i, subject_id=subjects[i % 3].id) for i in range(12)]
+    db.session.add_all(topics)
+    db.session.commit()
+    objectives = [Objective(name='objective%d' % i, subject_id=topics[i % 12].subject_id, topic_id=topics[i % 12].id)
+                  for i in range(120)]
+    authors = [User(name='author%d' % i, email='author%d@example.com' % i, subject=subjects[i % 3])
+               for i in range(50)]
+    db.session.add_all(objectives + authors)
+    db.session.commit()
+    institutions = [Institution(name='institution%d' % i, administrator_id=authors[i].id) for i in range(5)]
+    institutions[1].view_institution_only = institutions[2]
+    db.session.add_all(institutions)
+    db.session.commit()
+
+    questions, approvals, links = [], [], []
+    for id in xrange(1, count + 1):
+        subject = rng.choice(subjects)
+        questions.append({'id': id, 'question': 'question %d' % id, 'answer': rng.choice([None, '', 'answer']),
+                          'subject_id': subject.id, 'author_id': rng.choice(authors).id})
+        for institution in institutions:
+            if rng.random() < 0.4:
+                approvals.append({'institution_id': institution.id, 'question_id': id})
+        for objective in rng.sample(objectives, 2):
+            links.append({'question_id': id, 'objective_id': objective.id})
+    db.session.execute(Question.__table__.insert(), questions)
+    db.session.execute(institution_approved_questions.insert(), approvals)
+    db.session.execute(question_objectives.insert(), links)
+
+    student = User(name='student', email='student@example.com', subject=subjects[0])
+    student.view_institution_only = institutions[0]
+    student.institution_student = institutions[1]
+    db.session.add(student)
+    db.session.commit()
+    return student, topics[0]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--questions', type=int, default=50000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    handle, path = tempfile.mkstemp(suffix='.sqlite')
+    os.close(handle)
+    app = create_app('testing')
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + path
+    try:
+        with app.app_context():
+            db.create_all()
+            student, topic = populate(args.questions, random.Random(50000))
+
+            new_ids = sorted(q.id for q in student.visible_questions())
+            old_ids = sorted(q.id for q in compound_query(student))
+            assert new_ids == old_ids, "queries disagree"
+            print "%d questions, %d visible to the student" % (args.questions, len(new_ids))
+
+            cases = [
+                ('compound UNION/INTERSECT', lambda: compound_query(student).all()),
+                ('single query', lambda: student.visible_questions().all()),
+                ('single query, topic + answers', lambda: student.visible_questions(topic=topic, answers=True).all()),
+                ('single query, all subjects', lambda: student.visible_questions(subject=False).all()),
+            ]
+            for name, run in cases:
+                best = min(timeit.repeat(run, number=1, repeat=args.repeat))
+                print "%-32s %8.1f ms" % (name, best * 1000)
+    finally:
+        os.unlink(path)
+
+
+if __name__ == '__main__':
+    main()
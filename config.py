@@ -12,12 +12,43 @@ class Config:
 
     UPLOADS_DEFAULT_DEST = os.path.join(basedir, 'uploads')  # DJG - This is a guess copied from above, what does it do?
     UPLOADS_DEFAULT_URL = "/"
+    COURSEME_UPLOAD_CHUNK_SIZE = 4 * 1024 * 1024        # must stay under the request size set by patch_request_class
+    COURSEME_MAX_LECTURE_SIZE = 2 * 1024 * 1024 * 1024
+    COURSEME_UPLOAD_EXPIRY = 7 * 24 * 60 * 60           # seconds before an unfinished upload is purged
+    # DJG - lectures are served with Range/ETag support; behind a front end server let it send the bytes instead:
+    # USE_X_SENDFILE for Apache/lighttpd, or an internal nginx location that maps onto UPLOADS_DEFAULT_DEST/lectures
+    USE_X_SENDFILE = os.environ.get('COURSEME_X_SENDFILE') == '1'
+    COURSEME_LECTURE_ACCEL_PREFIX = os.environ.get('COURSEME_LECTURE_ACCEL_PREFIX')    # e.g. '/protected-lectures/'
+    COURSEME_LECTURE_MAX_AGE = 3600
 
     RECAPTCHA_PUBLIC_KEY = '6LeYIbsSAAAAACRPIllxA7wvXjIE411PfdB2gt2J'
     RECAPTCHA_PRIVATE_KEY = '6LeYIbsSAAAAAJezaIq3Ft_hSTo0YtyeFG-JgRtu'
 
     COURSEME_MAIL_SUBJECT_PREFIX = '[CourseMe]'
     COURSEME_MAIL_SENDER='CourseMe Info <info.courseme@gmail.com>'
+    COURSEME_MAIL_FLUSH_INTERVAL = 5       # seconds between runs of the outbox; 0 sends as each email is queued
+    COURSEME_MAIL_WORKERS = 2              # outbox threads, each sending over its own SMTP connection
+    COURSEME_MAIL_BATCH = 100              # emails claimed from the outbox per run
+    COURSEME_MAIL_RETRY_DELAY = 60         # seconds before a failed email is retried, doubled on each attempt
+    COURSEME_MAIL_MAX_ATTEMPTS = 6
+    COURSEME_MAIL_RETENTION = 7 * 24 * 60 * 60      # seconds sent or abandoned emails are kept in the outbox
+
+    COURSEME_VIEW_FLUSH_INTERVAL = 5       # seconds between write-behind flushes of module views; 0 writes through
+    COURSEME_LAST_SEEN_RESOLUTION = 60     # seconds a user's last_seen may lag behind before it is written again
+    COURSEME_USER_CACHE_TTL = 60           # seconds the signed in user is served from memory between reads; 0 reads every request
+    COURSEME_MAX_PAPERS = 500      # question papers generated per request, e.g. one for each student in a year group
+    COURSEME_DUPLICATE_THRESHOLD = 0.8     # estimated text similarity at which questions are flagged as near-duplicates
+    COURSEME_MESSAGES_PER_PAGE = 20
+    COURSEME_DIGEST_FLUSH_INTERVAL = 60    # seconds between deliveries of queued notifications; 0 delivers at once
+    COURSEME_DIGEST_WINDOW = 15 * 60     # notifications to a user within this many seconds arrive as one digest
+    COURSEME_EVENTS_QUEUE_SIZE = 50     # events held for a slow page before it is told to reload instead
+    COURSEME_EVENTS_HEARTBEAT = 15      # seconds of quiet before an event stream is sent a keep-alive
+    COURSEME_HASH_PROCESSES = None     # worker processes for run.py import_roster, None for one per CPU
+    # DJG - any werkzeug method; the iterations are the work factor. Hashes made with other settings are replaced
+    # as users log in. Hashes must fit in user.password_hash, which rules out sha512
+    COURSEME_PASSWORD_METHOD = 'pbkdf2:sha256:150000'
+    COURSEME_PASSWORD_SALT_LENGTH = 8
+    COURSEME_PASSWORD_PROCESSES = 2    # processes hashing and checking passwords for requests; 0 uses the request thread
 
     @staticmethod
     def init_app(app):
@@ -26,9 +57,10 @@ class Config:
 
 class DevelopmentConfig(Config):
     DEBUG = True
-    MAIL_SERVER = 'smtp.googlemail.com'
-    MAIL_PORT = 587
-    MAIL_USE_TLS = True
+    # DJG - to catch mail locally instead set COURSEME_MAIL_DEBUG=1 and run: python -m smtpd -n -c DebuggingServer localhost:1025
+    MAIL_SERVER = 'localhost' if os.environ.get('COURSEME_MAIL_DEBUG') else 'smtp.googlemail.com'
+    MAIL_PORT = 1025 if os.environ.get('COURSEME_MAIL_DEBUG') else 587
+    MAIL_USE_TLS = not os.environ.get('COURSEME_MAIL_DEBUG')
     MAIL_USE_SSL=False
     MAIL_USERNAME = os.environ.get('MAIL_USERNAME')
     MAIL_PASSWORD = os.environ.get('MAIL_PASSWORD')
@@ -37,6 +69,11 @@ class DevelopmentConfig(Config):
 
 class TestingConfig(Config):
     TESTING = True
+    COURSEME_VIEW_FLUSH_INTERVAL = 0
+    COURSEME_DIGEST_FLUSH_INTERVAL = 0
+    COURSEME_MAIL_FLUSH_INTERVAL = 0
+    COURSEME_PASSWORD_METHOD = 'pbkdf2:sha256:1000'
+    COURSEME_PASSWORD_PROCESSES = 0
     SQLALCHEMY_DATABASE_URI = 'sqlite:///' + os.path.join(basedir, 'courseme-test.sqlite')
 
 
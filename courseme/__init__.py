@@ -36,6 +36,28 @@ def create_app(config_name):
     configure_uploads(app, (lectures))
     patch_request_class(app, 8 * 1024 * 1024)        # 16 megabytes
 
+    from models import module_views, user_subjects, user_last_seen, notification_digests, \
+        recent_modules_cache, approved_ids_cache, reference_cache, user_identity_cache
+    # DJG - the per-process caches may hold rows of another database, e.g. between tests
+    for cache in (recent_modules_cache, approved_ids_cache, reference_cache, user_identity_cache):
+        cache.clear()
+    user_identity_cache.ttl = app.config['COURSEME_USER_CACHE_TTL']
+
+    # DJG - before any background thread starts, as this forks the password hashing processes
+    from util.passwords import hasher
+    hasher.init_app(app)
+
+    module_views.init_app(app)
+    user_subjects.init_app(app)
+    user_last_seen.init_app(app)
+    notification_digests.init_app(app)
+
+    from email import outbox
+    outbox.init_app(app)
+
+    import events
+    events.init_app(app)
+
     from main import main as main_blueprint
     app.register_blueprint(main_blueprint)
 
@@ -9,17 +9,18 @@ import operator
 from .. email import send_email
 # import pdb; pdb.set_trace()        #DJG - remove
 
+from courseme.main.services import Services
 import courseme.util.json as json
 
+_service_layer = Services()
+
 
 @auth.before_app_request
 def before_request():
     g.user = current_user  # DJG - Could scrap this and just use current_user directly?
-    g.subjects = Subject.query.all()        #DJG - Needed to populate the subject dropdown at the top of each page - look for alternatives
+    g.subjects = _service_layer.reference.subjects()      #DJG - Needed to populate the subject dropdown at the top of each page
     if g.user.is_authenticated:
-        g.user.last_seen = datetime.utcnow()
-        db.session.add(g.user)
-        db.session.commit()
+        g.user.seen()
 
 
 @auth.route('/signup', methods=['GET', 'POST'])
@@ -47,7 +48,8 @@ def login():
     form = forms.LoginForm()
     if form.validate_on_submit():
         user = User.user_by_email(form.email.data)
-        if user and user.verify_password(form.password.data):
+        if user and user.check_login(form.password.data):
+            db.session.commit()     # DJG - keeps a hash that check_login replaced with the current settings
             login_user(user, remember=form.remember_me.data)
             flash("Logged in successfully.")
             return redirect(request.args.get('next') or url_for('main.index'))
@@ -1,20 +1,152 @@
-from threading import Thread
+import smtplib
+import socket
+from datetime import datetime, timedelta
+from multiprocessing.pool import ThreadPool
+
 from flask import current_app, render_template
 from flask_mail import Message
-from . import mail
-
+from sqlalchemy import and_, bindparam, or_
 
-def send_async_email(app, msg):
-    with app.app_context():
-        mail.send(msg)
+from . import db, mail
+from .models import OutboxEmail
+from .util.background import PeriodicWorker
 
 
 def send_email(to, subject, template, **kwargs):
+    """Queue an email in the outbox and return straight away; `outbox` sends it
+
+    The email is committed so that the outbox, which may be another process,
+    can see it.  That commits the caller's pending changes too, so call this
+    once they are ready to be saved.
+    """
     app = current_app._get_current_object()
-    msg = Message(app.config['COURSEME_MAIL_SUBJECT_PREFIX'] + ' ' + subject,
-                  sender=app.config['COURSEME_MAIL_SENDER'], recipients=[to])
-    msg.body = render_template(template + '.txt', **kwargs)
-    msg.html = render_template(template + '.html', **kwargs)
-    thr = Thread(target=send_async_email, args=[app, msg])
-    thr.start()
-    return thr
\ No newline at end of file
+    email = OutboxEmail(recipient=to,
+                        sender=app.config['COURSEME_MAIL_SENDER'],
+                        subject=app.config['COURSEME_MAIL_SUBJECT_PREFIX'] + ' ' + subject,
+                        body=render_template(template + '.txt', **kwargs),
+                        html=render_template(template + '.html', **kwargs),
+                        created=datetime.utcnow(),
+                        next_attempt=datetime.utcnow())
+    db.session.add(email)
+    db.session.commit()
+    if not outbox.interval:
+        outbox.run()
+    return email
+
+
+class Outbox(PeriodicWorker):
+    """Sends the emails queued in `OutboxEmail`.
+
+    Each run claims up to `COURSEME_MAIL_BATCH` due emails and splits them
+    between a fixed pool of `COURSEME_MAIL_WORKERS` threads.  Every thread
+    sends its share over a single SMTP connection, so a bulk run costs a few
+    connections rather than one thread and one connection per email.  An
+    email that fails is retried after `COURSEME_MAIL_RETRY_DELAY` seconds,
+    doubling with each attempt, until `COURSEME_MAIL_MAX_ATTEMPTS` is
+    reached.  Emails are claimed with a lease on `next_attempt`, so several
+    processes can share the outbox.  Emails that were sent, or that ran out
+    of attempts, are deleted once they are older than
+    `COURSEME_MAIL_RETENTION` seconds.
+    """
+
+    LEASE = 300     # DJG - seconds a claimed batch is left alone by other processes before it is tried again
+
+    def __init__(self, interval_key):
+        super(Outbox, self).__init__(interval_key)
+        self._pool = None
+
+    def run_once(self):
+        config = current_app.config
+        self._purge(config['COURSEME_MAIL_RETENTION'], config['COURSEME_MAIL_MAX_ATTEMPTS'])
+        emails = self._claim(config['COURSEME_MAIL_BATCH'], config['COURSEME_MAIL_MAX_ATTEMPTS'])
+        if not emails:
+            return 0
+        workers = max(1, min(config['COURSEME_MAIL_WORKERS'], len(emails)))
+        shares = [emails[i::workers] for i in xrange(workers)]
+        app = current_app._get_current_object()
+        messages = [[_message(email) for email in share] for share in shares]
+        results = self._workers(config['COURSEME_MAIL_WORKERS']).map(lambda share: _send_share(app, share), messages)
+
+        now = datetime.utcnow()
+        table = OutboxEmail.__table__
+        sent, failed = [], []
+        for share, errors in zip(shares, results):
+            for email, error in zip(share, errors):
+                if error is None:
+                    sent.append(email.id)
+                else:
+                    delay = config['COURSEME_MAIL_RETRY_DELAY'] * 2 ** email.attempts
+                    failed.append({'_id': email.id, 'attempts': email.attempts + 1, 'last_error': error[:500],
+                                   'next_attempt': now + timedelta(seconds=delay)})
+        if sent:
+            db.session.execute(table.update().where(table.c.id.in_(sent)).values(sent=now, next_attempt=None))
+        if failed:
+            db.session.execute(table.update().where(table.c.id == bindparam('_id')), failed)
+        db.session.commit()
+        return len(sent)
+
+    def stop(self):
+        super(Outbox, self).stop()
+        if self._pool is not None:
+            self._pool.close()
+            self._pool = None
+
+    def _workers(self, size):
+        if self._pool is None:
+            self._pool = ThreadPool(max(1, size))
+        return self._pool
+
+    def _purge(self, retention, max_attempts):
+        table = OutboxEmail.__table__
+        cutoff = datetime.utcnow() - timedelta(seconds=retention)
+        abandoned = and_(table.c.sent == None, table.c.attempts >= max_attempts, table.c.created < cutoff)
+        db.session.execute(table.delete().where(or_(table.c.sent < cutoff, abandoned)))
+        db.session.commit()
+
+    def _claim(self, batch, max_attempts):
+        table = OutboxEmail.__table__
+        now = datetime.utcnow()
+        due = and_(table.c.sent == None, table.c.next_attempt <= now, table.c.attempts < max_attempts)
+        ids = [id for (id,) in db.session.query(table.c.id).filter(due)
+               .order_by(table.c.next_attempt, table.c.id).limit(batch)]
+        if not ids:
+            return []
+        lease = now + timedelta(seconds=self.LEASE)
+        db.session.execute(table.update().where(and_(due, table.c.id.in_(ids))).values(next_attempt=lease))
+        db.session.commit()
+        # DJG - another process may have claimed some of them in the meantime; those have a different lease
+        return OutboxEmail.query.filter(OutboxEmail.id.in_(ids), OutboxEmail.next_attempt == lease) \
+            .order_by(OutboxEmail.id).all()
+
+
+def _message(email):
+    msg = Message(email.subject, sender=email.sender, recipients=[email.recipient])
+    msg.body = email.body
+    msg.html = email.html
+    return msg
+
+
+def _send_share(app, messages):
+    """Send `messages` over one connection, returning None or an error for each"""
+    errors = [None] * len(messages)
+    done = 0
+    with app.app_context():
+        try:
+            with mail.connect() as connection:
+                for msg in messages:
+                    try:
+                        connection.send(msg)
+                    except (smtplib.SMTPServerDisconnected, socket.error):
+                        raise
+                    except Exception, e:
+                        # DJG - refused or malformed, only this message is retried and the connection carries on
+                        errors[done] = repr(e)
+                    done += 1
+        except Exception, e:
+            # DJG - the connection failed or dropped, everything not yet sent is retried later
+            for i in xrange(done, len(messages)):
+                errors[i] = repr(e)
+    return errors
+
+
+outbox = Outbox('COURSEME_MAIL_FLUSH_INTERVAL')
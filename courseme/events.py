@@ -0,0 +1,67 @@
+"""Live updates pushed to open pages as server-sent events"""
+
+from sqlalchemy import event
+
+from . import db
+from .util import json
+from .util.pubsub import Broker
+
+RETRY = 5000    # DJG - milliseconds the browser waits before reconnecting a dropped stream
+
+broker = Broker()
+
+
+def init_app(app):
+    broker.queue_size = app.config['COURSEME_EVENTS_QUEUE_SIZE']
+
+
+def user_channel(user_id):
+    return 'user:%d' % user_id
+
+
+def publish_after_commit(user_id, event, data=None):
+    """Publish an event to the user's open pages once the current transaction commits.
+
+    Nothing is kept for users with no open pages, and the events are dropped
+    if the transaction is rolled back.
+    """
+    if user_id is not None and broker.listening(user_channel(user_id)):
+        db.session.info.setdefault('events', []).append((user_channel(user_id), event, data))
+
+
+def stream(subscription, heartbeat):
+    """Format the events of `subscription` as an event stream.
+
+    A comment line is sent when nothing has happened for `heartbeat`
+    seconds.  It keeps proxies from closing the connection, and writing it
+    is how a closed tab is noticed.  A listener that has fallen too far
+    behind is sent `resync` and the stream ends; the page should reload its
+    state and reconnect.
+    """
+    try:
+        yield 'retry: %d\n\n' % RETRY
+        while True:
+            item = subscription.get(timeout=heartbeat)
+            if subscription.overflowed:
+                yield 'event: resync\ndata: {}\n\n'
+                return
+            if item is None:
+                yield ': heartbeat\n\n'
+            else:
+                event, data = item
+                yield 'event: %s\ndata: %s\n\n' % (event, json.dumps(data))
+    finally:
+        subscription.close()
+
+
+def _publish_committed(session):
+    for channel, event, data in session.info.pop('events', ()):
+        broker.publish(channel, event, data)
+
+
+def _forget_rolled_back(session):
+    session.info.pop('events', None)
+
+
+event.listen(db.session, 'after_commit', _publish_committed)
+event.listen(db.session, 'after_rollback', _forget_rolled_back)
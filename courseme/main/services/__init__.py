@@ -4,6 +4,13 @@ from objective import ObjectiveService
 from topic import TopicService
 from user import UserService
 from message import MessageService
+from recommendation import RecommendationService
+from upload import UploadService
+from question import QuestionService
+from paper import PaperService
+from duplicate import DuplicateService
+from roster import RosterService
+from reference import ReferenceService
 
 class Services(object):
     """Combines together the various services"""
@@ -12,8 +19,22 @@ class Services(object):
                  objective_factory=ObjectiveService,
                  topic_factory=TopicService,
                  user_factory=UserService,
-                 message_factory=MessageService):
+                 message_factory=MessageService,
+                 recommendation_factory=RecommendationService,
+                 upload_factory=UploadService,
+                 question_factory=QuestionService,
+                 paper_factory=PaperService,
+                 duplicate_factory=DuplicateService,
+                 roster_factory=RosterService,
+                 reference_factory=ReferenceService):
         self.objectives = objective_factory(self)
         self.topics = topic_factory(self)
         self.users = user_factory(self)
         self.messages = message_factory(self)
+        self.recommendations = recommendation_factory(self)
+        self.uploads = upload_factory(self)
+        self.questions = question_factory(self)
+        self.papers = paper_factory(self)
+        self.duplicates = duplicate_factory(self)
+        self.rosters = roster_factory(self)
+        self.reference = reference_factory(self)
@@ -1,7 +1,7 @@
 # -*- coding: utf-8 -*-
 
 from courseme.errors import NotFound, NotAuthorised
-from courseme.models import User
+from courseme.models import ReferenceData
 
 class BaseService(object):
     """Base class to inherit Service implementations from.
@@ -29,7 +29,7 @@ class BaseService(object):
             raise NotFound(self.__model__, 'id', id)
 
     def _check_user_id_or_admin(self, user_id, user):
-        if user_id != user.id and user != User.main_admin_user():
+        if user_id != user.id and user.id != ReferenceData.MainAdminId():
             raise NotAuthorised
 
     def _check_user_id(self, user_id, user):
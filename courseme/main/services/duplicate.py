@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+"""Service layer for near-duplicate question detection"""
+
+from collections import defaultdict
+
+from flask import current_app
+from sqlalchemy import func
+from sqlalchemy.orm import subqueryload
+
+from courseme import db
+from courseme.models import Question, QuestionSignature, QuestionBand
+from courseme.main.services.base import BaseService
+from courseme.errors import NotAuthorised
+from courseme.util import minhash
+
+
+class DuplicateService(BaseService):
+
+    __model__ = QuestionSignature
+
+    def build(self, chunk_size=5000):
+        """Recompute every question's signature and the duplicate clusters.
+
+        Questions are read `chunk_size` at a time by keyset on id.  Each
+        signature is split into `minhash.BANDS` bands and only questions that
+        share a band bucket are compared, so the work grows with the number
+        of candidate pairs rather than the square of the number of questions.
+        Candidates whose estimated similarity reaches the threshold are
+        joined with union-find, and each cluster is labelled with its lowest
+        question id.
+
+        :returns: the number of clusters with more than one question.
+        """
+        threshold = current_app.config.get('COURSEME_DUPLICATE_THRESHOLD', minhash.DEFAULT_THRESHOLD)
+        db.session.execute(QuestionBand.__table__.delete())
+        db.session.execute(QuestionSignature.__table__.delete())
+
+        ids, signatures = [], []
+        buckets = defaultdict(list)
+        last_id = 0
+        while True:
+            rows = db.session.query(Question.id, Question.question) \
+                .filter(Question.id > last_id).order_by(Question.id).limit(chunk_size).all()
+            if not rows:
+                break
+            bands = []
+            for id, text in rows:
+                sig = minhash.signature(text)
+                if sig is None:
+                    continue
+                index = len(ids)
+                ids.append(id)
+                signatures.append(sig)
+                for band, key in enumerate(minhash.band_keys(sig)):
+                    buckets[(band, key)].append(index)
+                    bands.append({'question_id': id, 'band': band, 'bucket': key})
+            if bands:
+                db.session.execute(QuestionBand.__table__.insert(), bands)
+            last_id = rows[-1][0]
+
+        # DJG - ids are ascending so each cluster is labelled with its lowest question id
+        roots = minhash.cluster(signatures, buckets.itervalues(), threshold)
+        rows = [{'question_id': id, 'signature': minhash.to_bytes(sig), 'cluster_id': ids[roots[i]]}
+                for i, (id, sig) in enumerate(zip(ids, signatures))]
+        for start in xrange(0, len(rows), chunk_size):
+            db.session.execute(QuestionSignature.__table__.insert(), rows[start:start + chunk_size])
+        db.session.commit()
+        return len(set(row['cluster_id'] for row in rows if row['cluster_id'] != row['question_id']))
+
+    def clusters(self, by_user, min_size=2):
+        """Groups of near-duplicate questions, largest first.
+
+        Only administrators may see every question's duplicates.
+
+        :returns: a list of lists of `Question`, each ordered by id.
+        """
+        if not by_user.is_admin():
+            raise NotAuthorised
+        duplicated = db.session.query(QuestionSignature.cluster_id) \
+            .group_by(QuestionSignature.cluster_id) \
+            .having(func.count(QuestionSignature.question_id) >= min_size).subquery()
+        rows = db.session.query(QuestionSignature.cluster_id, Question) \
+            .join(Question, Question.id == QuestionSignature.question_id) \
+            .filter(QuestionSignature.cluster_id.in_(db.session.query(duplicated.c.cluster_id))) \
+            .options(subqueryload(Question.approving_institutions), subqueryload(Question.author)) \
+            .order_by(QuestionSignature.cluster_id, Question.id)
+        clusters = defaultdict(list)
+        for cluster_id, question in rows:
+            clusters[cluster_id].append(question)
+        return sorted(clusters.values(), key=lambda c: (-len(c), c[0].id))
@@ -2,25 +2,31 @@
 """Service layer for Messages"""
 
 from courseme.main.services.base import BaseService
-from courseme.models import Message
+from courseme.models import Message, User, UserIdentity
 
 import schema as s
 from datetime import datetime
-from sqlalchemy import or_, and_
-from sqlalchemy.orm import load_only
+from flask import current_app
+from sqlalchemy import or_, and_, desc, func
+from sqlalchemy.orm import load_only, joinedload
 from courseme.util import merge
 from courseme import db
+from courseme.events import publish_after_commit
 from courseme.main.forms import SendMessage
 from courseme.util.wtform_utils import select_choices
 
 from courseme.errors import NotAuthorised, ValidationError
 
+_CURSOR_TIME = '%Y%m%d%H%M%S%f'
+_IN_BATCH = 500     # DJG - keeps each IN list under SQLite's limit on bound parameters
+
+
 class MessageService(BaseService):
     __model__ = Message
 
     _base_schema = {
         'from_id': s.Use(int),
-        'to_id'
+        'to_id': s.Use(int),
         'subject': basestring,
         'recommended_material_id': s.Or(None, s.Use(int)),
         'assign_objective_id':s.Or(None, s.Use(int)),
@@ -57,4 +63,87 @@ class MessageService(BaseService):
         form.recommended_material.choices = select_choices(user.visible_modules(), True)
         form.assign_objective.choices = select_choices(self.services.objectives.objectives_for_selection(user, subject_id), True)
         form.assign_scheme.choices = select_choices(self.services.objectives.schemes_for_selection(user, subject_id), True)
-        return form
\ No newline at end of file
+        return form
+
+    def inbox(self, user, before=None, limit=None):
+        """A page of the user's live messages, newest first.
+
+        Pages are found by keyset on (`sent`, `id`) rather than by offset, so
+        with the (to_id, deleted, sent) index a page costs the same however
+        many messages the user has received.
+
+        :param before: the `next` cursor from the previous page, or None
+                       for the newest messages.
+        :param limit: messages per page, defaults to `COURSEME_MESSAGES_PER_PAGE`.
+        :returns: (messages, next) where `next` is the cursor for the
+                  following page, or None if this is the last page.
+        """
+        limit = limit or current_app.config['COURSEME_MESSAGES_PER_PAGE']
+        sent, id = self._parse_cursor(before) if before else (None, None)
+        live = Message.query.filter(Message.to_id == user.id, Message.deleted == None) \
+            .options(joinedload(Message.from_user), joinedload(Message.recommended_material))
+
+        # DJG - messages without a sent time come after all the others; they are read separately so that the
+        # sent <= cursor predicate stays a range seek on the index
+        messages = []
+        if not before or sent is not None:
+            query = live.filter(Message.sent != None)
+            if before:
+                query = query.filter(Message.sent <= sent, or_(Message.sent < sent, Message.id < id))
+            messages = query.order_by(desc(Message.sent), desc(Message.id)).limit(limit + 1).all()
+        if len(messages) <= limit:
+            query = live.filter(Message.sent == None)
+            if before and sent is None:
+                query = query.filter(Message.id < id)
+            messages.extend(query.order_by(desc(Message.id)).limit(limit + 1 - len(messages)))
+        if len(messages) <= limit:
+            return messages, None
+        messages = messages[:limit]
+        return messages, self._cursor(messages[-1])
+
+    def mark_read(self, by_user, ids=None):
+        """Mark the user's unread messages with the given `ids`, or all of them, as read.
+
+        :returns: the number of messages that were unread.
+        """
+        table = Message.__table__
+        condition = and_(table.c.to_id == by_user.id, table.c.read == None)
+        read = 0
+        if ids is None:
+            read = db.session.execute(table.update().where(condition).values(read=datetime.utcnow())).rowcount
+        else:
+            ids = sorted(set(ids))
+            for start in xrange(0, len(ids), _IN_BATCH):
+                batch = table.c.id.in_(ids[start:start + _IN_BATCH])
+                read += db.session.execute(table.update().where(and_(condition, batch))
+                                           .values(read=datetime.utcnow())).rowcount
+        User.add_unread({by_user.id: -read})
+        if read:
+            publish_after_commit(by_user.id, 'read', {'count': read})
+        db.session.commit()
+        return read
+
+    def repair_unread_counts(self):
+        """Recount every user's unread messages with one GROUP BY, in case the counters have drifted.
+
+        :returns: the number of users with unread messages.
+        """
+        counts = dict(db.session.query(Message.to_id, func.count(Message.id))
+                      .filter(Message.read == None, Message.to_id != None)
+                      .group_by(Message.to_id))
+        users = User.__table__
+        db.session.execute(users.update().values(unread_messages=0))
+        UserIdentity.InvalidateAll()
+        User.add_unread(counts)
+        db.session.commit()
+        return len(counts)
+
+    def _cursor(self, message):
+        return '{}_{}'.format(message.sent.strftime(_CURSOR_TIME) if message.sent else '', message.id)
+
+    def _parse_cursor(self, cursor):
+        try:
+            sent, id = cursor.split('_')
+            return (datetime.strptime(sent, _CURSOR_TIME) if sent else None), int(id)
+        except ValueError:
+            raise ValidationError(before="Not a valid page of messages")
@@ -7,7 +7,8 @@ from sqlalchemy import or_, and_
 from sqlalchemy.orm import load_only
 
 from courseme import db
-from courseme.models import Objective, User, UserObjective, SchemeOfWork
+from courseme.events import publish_after_commit
+from courseme.models import Objective, User, UserObjective, SchemeOfWork, QuestionSearch
 from courseme.main.services.base import BaseService
 from courseme.util import merge
 from courseme.errors import NotAuthorised, ValidationError
@@ -116,6 +117,8 @@ class ObjectiveService(BaseService):
         objective.prerequisites = prerequisites
         objective.topic_id = o['topic_id']
         db.session.add(objective)
+        for question in objective.questions:
+            QuestionSearch.Index(question, commit=False)      # DJG - the search index holds objective and topic names
         db.session.commit()
 
         UserObjective.FindOrCreate(by_user.id, by_user.id, objective.id)
@@ -246,6 +249,10 @@ class ObjectiveService(BaseService):
         completed = states[(states.index(userobjective.completed) + 1) % len(states)]  # Cycles through the list of states
         userobjective.completed = completed
         db.session.add(userobjective)
+        publish_after_commit(userobjective.user_id, 'assessment',
+                             merge({'objective_id': userobjective.objective_id,
+                                    'assessor_id': userobjective.assessor_id},
+                                   UserObjective.assessment_states()[completed]))
         db.session.commit()
 
         self._set_common_assessors(userobjective)
@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+"""Service layer for generating randomised question papers"""
+
+import bisect
+import heapq
+import math
+import random
+
+import schema as s
+from flask import current_app
+from sqlalchemy import func, literal
+
+from courseme import db
+from courseme.models import Question, SchemeOfWork, question_objectives, scheme_objectives
+from courseme.main.services.base import BaseService
+from courseme.errors import NotFound, ValidationError
+
+
+class CandidatePool(object):
+    """Question ids that can go on a paper, with their sampling weights.
+
+    Ids are kept in two lists, one for extension questions and one for the
+    rest, each with a running total of the weights so that a sample can
+    jump straight to the next id it replaces (see `sample`).
+    """
+
+    def __init__(self, rows, split=True):
+        self.ids = {True: [], False: []}
+        self.weights = {True: [], False: []}
+        self.totals = {True: [], False: []}
+        for id, extension, weight in rows:
+            extension = bool(extension) and split
+            self.ids[extension].append(id)
+            self.weights[extension].append(float(weight))
+            self.totals[extension].append((self.totals[extension] or [0.0])[-1] + weight)
+
+    def __len__(self):
+        return len(self.ids[True]) + len(self.ids[False])
+
+    def size(self, extension):
+        return len(self.ids[extension])
+
+    def sample(self, extension, k, rng):
+        """A weighted sample of `k` ids without replacement.
+
+        Uses reservoir sampling with exponential jumps (Efraimidis and
+        Spirakis, A-ExpJ): each id gets the key u ** (1 / weight) and the k
+        largest keys are kept in a heap.  Rather than drawing a key for
+        every id, the weight to skip before the next replacement is drawn
+        directly and found in the running totals with a binary search, so a
+        sample costs O(k log(n / k) log n) rather than O(n).
+        """
+        ids, weights, totals = self.ids[extension], self.weights[extension], self.totals[extension]
+        n = len(ids)
+        if k <= 0:
+            return []
+        if k >= n:
+            reservoir = [(_key(rng, w), id) for id, w in zip(ids, weights)]
+            return [id for key, id in sorted(reservoir, reverse=True)]
+
+        reservoir = [(_key(rng, weights[i]), ids[i]) for i in xrange(k)]
+        heapq.heapify(reservoir)
+        position, consumed = k, totals[k - 1]
+        while position < n:
+            threshold = reservoir[0][0]
+            if threshold >= 1.0:
+                break
+            skip = math.log(1.0 - rng.random()) / math.log(threshold)
+            i = bisect.bisect_left(totals, consumed + skip, position)
+            if i >= n:
+                break
+            w = weights[i]
+            key = rng.uniform(threshold ** w, 1.0) ** (1.0 / w)
+            heapq.heapreplace(reservoir, (key, ids[i]))
+            position, consumed = i + 1, totals[i]
+        return [id for key, id in sorted(reservoir, reverse=True)]
+
+
+def _key(rng, weight):
+    return (1.0 - rng.random()) ** (1.0 / weight)
+
+
+class PaperService(BaseService):
+    """Builds question papers by sampling from the questions a user can see.
+
+    A question's weight is the number of the target objectives it covers,
+    so questions that test more of the paper's objectives are more likely
+    to be chosen, but every matching question has a chance.
+    """
+
+    __model__ = Question
+
+    _paper_schema = {
+        s.Optional('objective_ids'): [s.Use(int)],
+        s.Optional('scheme_id'): s.Or(None, s.Use(int)),
+        'count': s.And(s.Use(int), lambda n: n > 0, error="Number of questions must be positive"),
+        s.Optional('extension'): s.Or(None, s.And(s.Use(float), lambda x: 0.0 <= x <= 1.0,
+                                                  error="Extension mix must be between 0 and 1")),
+        s.Optional('seed'): s.Or(None, s.Use(int)),
+    }
+
+    def generate(self, paper_data, by_user):
+        """Generate a single paper, see `generate_many`"""
+        return self.generate_many(paper_data, by_user, papers=1)[0]
+
+    def generate_many(self, paper_data, by_user, papers=1):
+        """Generate `papers` question papers from one candidate pool.
+
+        :param paper_data: is a dictionary with the `count` of questions on
+                           each paper and optionally the target
+                           `objective_ids` or a `scheme_id` to take them
+                           from, the fraction of `extension` questions and a
+                           `seed` so the same papers can be generated again.
+        :param by_user: the `User` setting the papers; only questions visible
+                        to them are used.
+        :param papers: how many papers to generate.
+        :returns: a list of papers, each a list of `Question` ids.
+        """
+        try:
+            p = s.Schema(self._paper_schema).validate(paper_data)
+        except s.SchemaError, e:
+            raise ValidationError(paper=unicode(e))
+        if papers <= 0 or papers > current_app.config['COURSEME_MAX_PAPERS']:
+            raise ValidationError(papers="Between 1 and {} papers can be generated at once".format(
+                current_app.config['COURSEME_MAX_PAPERS']))
+
+        extension = p.get('extension')
+        pool = self.candidates(self._objective_ids(p), by_user, split=extension is not None)
+        if len(pool) < p['count']:
+            raise ValidationError(count="Only {} questions match this paper".format(len(pool)))
+        counts = self._share(pool, p['count'], extension or 0.0)
+
+        rng = random.Random(p.get('seed'))
+        return [[id for extension, k in counts for id in pool.sample(extension, k, rng)]
+                for _ in xrange(papers)]
+
+    def candidates(self, objective_ids, by_user, split=True):
+        """The `CandidatePool` of questions visible to `by_user` that cover any of `objective_ids`.
+
+        Reads only question ids, the extension flag and the number of target
+        objectives each question covers; with no objectives every visible
+        question is a candidate with weight 1.  Unless `split`, extension
+        questions are pooled with the rest.
+        """
+        visible = by_user.visible_questions(subject=False)
+        if objective_ids:
+            rows = visible.with_entities(Question.id, Question.extension,
+                                         func.count(question_objectives.c.objective_id)) \
+                .join(question_objectives, question_objectives.c.question_id == Question.id) \
+                .filter(question_objectives.c.objective_id.in_(objective_ids)) \
+                .group_by(Question.id, Question.extension)
+        else:
+            rows = visible.with_entities(Question.id, Question.extension, literal(1))
+        return CandidatePool(rows.order_by(Question.id), split)
+
+    def _objective_ids(self, p):
+        objective_ids = set(p.get('objective_ids') or [])
+        if p.get('scheme_id'):
+            if SchemeOfWork.query.get(p['scheme_id']) is None:
+                raise NotFound(SchemeOfWork, 'id', p['scheme_id'])
+            objective_ids.update(id for (id,) in db.session.query(scheme_objectives.c.objective_id)
+                                 .filter(scheme_objectives.c.scheme_id == p['scheme_id']))
+        return sorted(objective_ids)
+
+    def _share(self, pool, count, extension):
+        # DJG - split count between core and extension questions, topping up from the other pool if one runs short
+        wanted = int(round(count * extension))
+        extension_count = min(wanted, pool.size(True))
+        core_count = min(count - extension_count, pool.size(False))
+        extension_count = min(count - core_count, pool.size(True))
+        return [(False, core_count), (True, extension_count)]
@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+"""Service layer for Questions"""
+
+import re
+
+from sqlalchemy import literal_column, text
+
+from courseme import db
+from courseme.models import Question, QuestionSearch, User, Objective, Topic, question_objectives, \
+    question_selections, question_search
+from courseme.main.services.base import BaseService
+
+_IN_BATCH = 500     # DJG - keeps each IN list under SQLite's limit on bound parameters
+_SEARCH_TERM = re.compile(r'\w+', re.UNICODE)
+# DJG - bm25 weights for the question, objectives and topics columns of question_search; lower scores rank first
+_SEARCH_RANK = literal_column('bm25(question_search, 1.0, 2.0, 1.0)')
+
+
+class QuestionService(BaseService):
+
+    __model__ = Question
+
+    def by_ids(self, ids):
+        """The `Questions` with the given ids, in no particular order"""
+        questions = []
+        for batch in _batches(list(set(ids))):
+            questions.extend(Question.query.filter(Question.id.in_(batch)))
+        return questions
+
+    def search(self, terms, user=None, limit=50, offset=0):
+        """Questions matching the search `terms`, best match first, serialised as for `catalogue`.
+
+        Each word must appear in the question text or in the names of its
+        objectives or their topics; the last word may be the start of a
+        word.  Signed in users only get questions from `visible_questions`,
+        filtered in the same SQL statement as the match, and answers are
+        only included where `catalogue` allows them.
+        """
+        words = _SEARCH_TERM.findall(terms or u'')
+        if not words:
+            return []
+        query = user.visible_questions() if user is not None and user.is_authenticated() else Question.query
+
+        if QuestionSearch.Available():
+            match = u' '.join(u'"%s"' % word for word in words) + u'*'
+            query = query.join(question_search, question_search.c.rowid == Question.id) \
+                .filter(text('question_search MATCH :match').bindparams(match=match)) \
+                .order_by(_SEARCH_RANK, Question.id)
+        else:
+            for word in words:
+                query = query.filter(Question.question.ilike(u'%' + word + u'%'))
+            query = query.order_by(Question.id)
+        return self.catalogue(query.limit(limit).offset(offset).all(), user)
+
+    def catalogue(self, questions, user=None):
+        """Serialise `questions` for the question catalogue.
+
+        Gives the same dictionaries as `Question.as_dict`, but the user's
+        selected questions and licence are looked up once, and authors,
+        objectives and topics are loaded for all of the questions together
+        with IN queries.  The questions themselves are left untouched.
+
+        :param questions: an iterable of `Question`.
+        :param user: the `User` the catalogue is for; answers are only
+                     included for licenced users and the question's author.
+        """
+        questions = list(questions)
+        if not questions:
+            return []
+
+        authenticated = user is not None and user.is_authenticated()
+        selected = self._selected_ids(user) if authenticated else set()
+        licenced = authenticated and bool(user.is_enterprise_licenced())
+
+        author_names = {}
+        for author_ids in _batches(list(set(q.author_id for q in questions))):
+            author_names.update(db.session.query(User.id, User.name).filter(User.id.in_(author_ids)))
+
+        objectives = dict((q.id, []) for q in questions)
+        topics = dict((q.id, []) for q in questions)
+        for question_ids in _batches(list(objectives)):
+            rows = db.session.query(question_objectives.c.question_id, Objective.name, Topic.name) \
+                .join(Objective, Objective.id == question_objectives.c.objective_id) \
+                .outerjoin(Topic, Topic.id == Objective.topic_id) \
+                .filter(question_objectives.c.question_id.in_(question_ids)) \
+                .order_by(question_objectives.c.question_id, Objective.id)
+            for question_id, objective_name, topic_name in rows:
+                objectives[question_id].append(objective_name)
+                if topic_name is not None and topic_name not in topics[question_id]:
+                    topics[question_id].append(topic_name)
+
+        catalogue = []
+        for q in questions:
+            result = q.column_dict()
+            result['topics'] = topics[q.id]
+            result['objectives'] = objectives[q.id]
+            result['selected'] = 1 if q.id in selected else 0
+            if authenticated and (licenced or q.author_id == user.id) and bool(q.answer):
+                result['has_answer'] = 1
+            else:
+                result['answer'] = None
+                result['has_answer'] = 0
+            result['author'] = author_names.get(q.author_id)
+            catalogue.append(result)
+        return catalogue
+
+    def _selected_ids(self, user):
+        return set(id for (id,) in db.session.query(question_selections.c.question_id)
+                   .filter(question_selections.c.user_id == user.id))
+
+
+def _batches(ids):
+    for start in xrange(0, len(ids), _IN_BATCH):
+        yield ids[start:start + _IN_BATCH]
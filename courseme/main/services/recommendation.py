@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+"""Service layer for "students also viewed" recommendations"""
+
+import numpy as np
+import scipy.sparse as sp
+from sqlalchemy import or_
+
+from courseme import db
+from courseme.models import Module, UserModule, ModuleNeighbour
+from courseme.main.services.base import BaseService
+
+# DJG - how much each kind of interaction counts towards a co-view
+VIEW_WEIGHT = 1.0
+STAR_WEIGHT = 1.0
+VOTE_WEIGHT = 0.5
+
+
+class RecommendationService(BaseService):
+
+    __model__ = ModuleNeighbour
+
+    def related_modules(self, user, module, limit=5):
+        """The modules most often viewed alongside `module` that `user` can see.
+
+        :param user: the `User` viewing `module`.
+        :param module: the `Module` to find related material for.
+        :param limit: the maximum number of `Modules` to return.
+        """
+        neighbour_ids = [n for (n,) in db.session.query(ModuleNeighbour.neighbour_id)
+                         .filter(ModuleNeighbour.module_id == module.id)
+                         .order_by(ModuleNeighbour.rank)]
+        if not neighbour_ids:
+            return []
+        # DJG - the same rules as User.visible_modules, checked against the user's cached approved ids
+        restricted = user.restricted_module_ids()
+        viewed = set(id for (id,) in db.session.query(UserModule.module_id)
+                     .filter(UserModule.user_id == user.id)
+                     .filter(UserModule.module_id.in_(neighbour_ids)))
+        visible = [m for m in Module.LiveModules().filter(Module.id.in_(neighbour_ids))
+                   if restricted is None or m.id in restricted or m.author_id == user.id or m.id in viewed]
+        rank = dict((id, i) for i, id in enumerate(neighbour_ids))
+        visible.sort(key=lambda m: rank[m.id])
+        return visible[:limit]
+
+    def build(self, top_k=10, chunk_size=50000, block_size=2000):
+        """Rebuild the `ModuleNeighbour` table from `UserModule`.
+
+        Builds a sparse user by module matrix of interaction weights, scales
+        each module column to unit length and takes the item-item cosine
+        similarity one block of module columns at a time, keeping the
+        `top_k` neighbours of each module.  Rows are read `chunk_size` at a
+        time by keyset on `UserModule.id` into arrays of ids and weights,
+        which are dropped once the matrix is built.  After that the sparse
+        matrix and its transpose are held, plus one similarity block of at
+        most modules x `block_size` and its neighbour rows, which are
+        written before the next block is computed.  The old table is
+        replaced in a single transaction.
+
+        :returns: the number of `ModuleNeighbour` rows written.
+        """
+        table = ModuleNeighbour.__table__
+        x, module_ids = self._interaction_matrix(chunk_size)
+        db.session.execute(table.delete())
+        written = 0
+        if x is not None:
+            xt = x.T.tocsr()
+            for start in xrange(0, len(module_ids), block_size):
+                similarity = xt.dot(x[:, start:start + block_size]).tocsc()
+                neighbours = []
+                for column in xrange(similarity.shape[1]):
+                    item = start + column
+                    lo, hi = similarity.indptr[column], similarity.indptr[column + 1]
+                    candidates = similarity.indices[lo:hi]
+                    scores = similarity.data[lo:hi]
+                    keep = candidates != item
+                    candidates, scores = candidates[keep], scores[keep]
+                    if len(scores) > top_k:
+                        best = np.argpartition(-scores, top_k)[:top_k]
+                        candidates, scores = candidates[best], scores[best]
+                    order = np.argsort(-scores, kind='mergesort')
+                    for rank, i in enumerate(order):
+                        neighbours.append({'module_id': int(module_ids[item]),
+                                           'neighbour_id': int(module_ids[candidates[i]]),
+                                           'score': float(scores[i]),
+                                           'rank': rank})
+                if neighbours:
+                    db.session.execute(table.insert(), neighbours)
+                written += len(neighbours)
+        db.session.commit()
+        return written
+
+    def _interaction_matrix(self, chunk_size):
+        # DJG - the column-normalised user by module matrix in CSC form and the module id of each column, or
+        # (None, None) if nobody has interacted with anything
+        users, modules, weights = self._read_interactions(chunk_size)
+        if not len(weights):
+            return None, None
+        user_ids, user_index = np.unique(users, return_inverse=True)
+        module_ids, module_index = np.unique(modules, return_inverse=True)
+        x = sp.csr_matrix((weights, (user_index, module_index)),
+                          shape=(len(user_ids), len(module_ids)))
+        x.sum_duplicates()
+
+        norms = np.sqrt(np.asarray(x.multiply(x).sum(axis=0)).ravel())
+        norms[norms == 0] = 1.0
+        return x.dot(sp.diags(1.0 / norms)).tocsc(), module_ids
+
+    def _read_interactions(self, chunk_size):
+        users, modules, weights = [], [], []
+        last_id = 0
+        while True:
+            rows = db.session.query(UserModule.id, UserModule.user_id, UserModule.module_id,
+                                    UserModule.starred, UserModule.vote) \
+                .filter(UserModule.id > last_id) \
+                .filter(or_(UserModule.deleted == None, UserModule.deleted == False)) \
+                .order_by(UserModule.id) \
+                .limit(chunk_size).all()
+            if not rows:
+                break
+            chunk = np.array([(user_id, module_id, bool(starred), vote or 0)
+                              for id, user_id, module_id, starred, vote in rows], dtype=np.float64)
+            chunk_weights = VIEW_WEIGHT + STAR_WEIGHT * chunk[:, 2] + VOTE_WEIGHT * chunk[:, 3]
+            positive = chunk_weights > 0
+            users.append(chunk[positive, 0].astype(np.int64))
+            modules.append(chunk[positive, 1].astype(np.int64))
+            weights.append(chunk_weights[positive])
+            last_id = rows[-1][0]
+        if not weights:
+            return np.array([], np.int64), np.array([], np.int64), np.array([])
+        return np.concatenate(users), np.concatenate(modules), np.concatenate(weights)
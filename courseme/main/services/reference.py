@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+"""Service layer for reference data"""
+
+from courseme.main.services.base import BaseService
+from courseme.models import ReferenceData, Institution, Topic, User
+
+
+class ReferenceService(BaseService):
+    """Subjects, topics and the system entities, served from the per-process `ReferenceData` cache"""
+
+    def subjects(self):
+        """Every `Subject` as (id, name) tuples, e.g. for the navbar"""
+        return ReferenceData.Subjects()
+
+    def topics(self, subject_id):
+        """The topics of a subject as (id, name) tuples"""
+        return ReferenceData.Topics(subject_id)
+
+    def topic_choices(self, user):
+        """Select choices for the topics of the subject the user is browsing"""
+        return Topic.TopicChoices(user)
+
+    def main_admin_id(self):
+        return ReferenceData.MainAdminId()
+
+    def main_admin_user(self):
+        return User.main_admin_user()
+
+    def main_institution(self):
+        return Institution.main_courseme_institution()
+
+    def refresh(self):
+        """Drop the cached data, e.g. after editing the tables outside of the application"""
+        ReferenceData.Invalidate()
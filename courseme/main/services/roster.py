@@ -0,0 +1,227 @@
+# -*- coding: utf-8 -*-
+"""Service layer for importing institution rosters"""
+
+import csv
+from datetime import datetime
+
+import schema as s
+
+from courseme import db
+from courseme.models import User, Institution, Message, ROLE_USER, student_tutor, institution_members
+from courseme.main.services.base import BaseService
+from courseme.errors import ValidationError
+from courseme.util.passwords import hash_passwords, random_password
+
+ROSTER_FIELDS = ('email', 'username', 'forename', 'surname', 'password', 'role', 'tutors')
+ROSTER_ROLES = ('student', 'tutor')
+
+_IN_BATCH = 500     # DJG - keeps each IN list under SQLite's limit on bound parameters
+
+
+def _text(value):
+    return (value or u'').strip() or None
+
+
+class RosterService(BaseService):
+    """Bulk import of an institution's students and tutors.
+
+    A roster is a list of rows, one per person, with the columns in
+    `ROSTER_FIELDS`: an `email`, optionally a `username`, `forename`,
+    `surname` and `password`, a `role` of student (the default) or tutor and
+    `tutors`, the emails of the student's tutors separated by semicolons.
+    People without an account are created as students or members of the
+    institution and the tutor links are added, all in one transaction.
+    Existing accounts from outside the institution are never changed.
+    """
+
+    __model__ = Institution
+
+    _row_schema = {
+        'email': s.And(s.Use(lambda e: (e or u'').strip().lower()), lambda e: '@' in e,
+                       error="A valid email address is needed"),
+        'username': s.Use(_text),
+        'forename': s.Use(_text),
+        'surname': s.Use(_text),
+        'password': s.Use(_text),
+        'role': s.And(s.Use(lambda r: (r or u'student').strip().lower()), lambda r: r in ROSTER_ROLES,
+                      error="Role must be one of " + ', '.join(ROSTER_ROLES)),
+        'tutors': s.Use(lambda t: [e.strip().lower() for e in (t or u'').split(';') if e.strip()]),
+    }
+
+    def parse_csv(self, stream):
+        """The rows of a UTF-8 roster CSV file whose header line names the columns"""
+        rows = []
+        for row in csv.DictReader(stream):
+            rows.append(dict((key.strip().lower(), (value or '').decode('utf-8'))
+                             for key, value in row.iteritems() if key))
+        return rows
+
+    def import_roster(self, institution, rows, by_user, processes=0):
+        """Create and enrol everyone on a roster, then send the administrator a summary.
+
+        Only new users and users who are already students (or, for tutors,
+        members) of the institution are changed.  Anyone else on the roster
+        is left as they are: they are sent a message from the administrator
+        asking them to join, and each of their tutors sends them an access
+        request that they can allow from their messages page.
+
+        :param institution: the `Institution` the roster is for.
+        :param rows: a list of dictionaries with the columns in `ROSTER_FIELDS`.
+        :param by_user: the `User` importing the roster, the institution's
+                        administrator or the main CourseMe admin.
+        :param processes: by default passwords are hashed by the shared
+                          `hasher`; pass a number of processes (None for
+                          one per CPU) to start a pool just for this
+                          import, from the command line only, see
+                          `hash_passwords`.
+        :returns: a dictionary of the `created` and existing (`updated`)
+                  users' emails, the emails of the users who were only sent
+                  a request (`requested`) and the `passwords` generated for
+                  new users whose row did not give one, by email.
+        """
+        self._check_user_id_or_admin(institution.administrator_id, by_user)
+        rows = self._validate(rows)
+        emails = [r['email'] for r in rows]
+
+        existing = self._user_ids(emails)
+        tutor_emails = set(e for r in rows for e in r['tutors'])
+        unknown = tutor_emails - set(emails) - set(self._user_ids(tutor_emails - set(emails)))
+        if unknown:
+            raise ValidationError(tutors=u"No user with email {}".format(u', '.join(sorted(unknown))))
+
+        new_rows = [r for r in rows if r['email'] not in existing]
+        generated = {}
+        for r in new_rows:
+            if not r['password']:
+                r['password'] = generated[r['email']] = random_password()
+        hashes = hash_passwords([r['password'] for r in new_rows], processes)
+        names = User.make_unique_usernames([r['username'] or r['email'].split('@')[0] for r in new_rows])
+
+        now = datetime.utcnow()
+        if new_rows:
+            db.session.execute(User.__table__.insert(), [dict(
+                email=r['email'],
+                name=name,
+                forename=r['forename'],
+                surname=r['surname'],
+                password_hash=password_hash,
+                role=ROLE_USER,
+                time_registered=now,
+                last_seen=now,
+                institution_student_id=institution.id if r['role'] == 'student' else None)
+                for r, name, password_hash in zip(new_rows, names, hashes)])
+        ids = self._user_ids(set(emails) | tutor_emails)
+
+        # DJG - an institution may only change its own people; existing accounts belong to their owners
+        own_students, own_members = self._own_user_ids(institution, existing.values())
+        own = set(ids[r['email']] for r in new_rows) | own_students
+        own |= set(ids[r['email']] for r in rows if r['role'] == 'tutor' and ids[r['email']] in own_members)
+        outsiders = [r for r in rows if ids[r['email']] not in own]
+
+        pairs = self._new_links(set((ids[t], ids[r['email']]) for r in rows for t in r['tutors']))
+        links = self._add_tutor_links(set((tutor, student) for tutor, student in pairs if student in own))
+        requests = sorted((tutor, student) for tutor, student in pairs if student not in own)
+
+        tutors = []
+        for batch in _batches([ids[r['email']] for r in rows if r['role'] == 'tutor' and ids[r['email']] in own]):
+            tutors.extend(User.query.filter(User.id.in_(batch)))
+        institution.add_members(tutors, commit=False)
+        self._send_requests(institution, outsiders, requests, ids, now)
+
+        students = sum(1 for r in rows if r['role'] == 'student')
+        admin = User.main_admin_user()
+        db.session.add(Message(
+            from_id=admin.id if admin else None,
+            to_id=institution.administrator_id,
+            subject="Roster imported into institution " + institution.name,
+            body="{} students and {} tutors were imported into {}, of whom {} are new users. {} tutor links were added. "
+                 "{} existing users outside {} were sent a request to join rather than being changed. "
+                 "You can review the student list on the institution profile page.".format(
+                students, len(rows) - students, institution.name, len(new_rows), links, len(outsiders),
+                institution.name),
+            sent=now))
+        db.session.commit()
+        return {'created': [r['email'] for r in new_rows],
+                'updated': [email for email in emails if email in existing and existing[email] in own],
+                'requested': [r['email'] for r in outsiders],
+                'passwords': generated}
+
+    def _validate(self, rows):
+        valid, errors, seen = [], {}, set()
+        schema = s.Schema(self._row_schema)
+        for line, row in enumerate(rows, 1):
+            try:
+                r = schema.validate(dict((field, row.get(field)) for field in ROSTER_FIELDS))
+            except s.SchemaError, e:
+                errors['row {}'.format(line)] = unicode(e)
+                continue
+            if r['email'] in seen:
+                errors['row {}'.format(line)] = u"{} appears more than once".format(r['email'])
+            seen.add(r['email'])
+            valid.append(r)
+        if errors:
+            raise ValidationError(errors)
+        if not valid:
+            raise ValidationError(rows="The roster is empty")
+        return valid
+
+    def _user_ids(self, emails):
+        ids = {}
+        for batch in _batches(sorted(emails)):
+            ids.update(db.session.query(User.email, User.id).filter(User.email.in_(batch)))
+        return ids
+
+    def _own_user_ids(self, institution, user_ids):
+        # DJG - which of user_ids are already students, and which members, of the institution
+        students, members = set(), set()
+        for batch in _batches(sorted(user_ids)):
+            students.update(id for (id,) in db.session.query(User.id).filter(User.id.in_(batch))
+                            .filter(User.institution_student_id == institution.id))
+            members.update(id for (id,) in db.session.query(institution_members.c.member_id)
+                           .filter(institution_members.c.institution_id == institution.id)
+                           .filter(institution_members.c.member_id.in_(batch)))
+        return students, members
+
+    def _new_links(self, pairs):
+        # DJG - pairs are (tutor_id, student_id); the links that do not exist yet
+        for batch in _batches(sorted(set(student for tutor, student in pairs))):
+            pairs -= set(db.session.query(student_tutor.c.tutor_id, student_tutor.c.student_id)
+                         .filter(student_tutor.c.student_id.in_(batch)))
+        return pairs
+
+    def _add_tutor_links(self, pairs):
+        if pairs:
+            db.session.execute(student_tutor.insert(),
+                               [{'tutor_id': tutor, 'student_id': student} for tutor, student in sorted(pairs)])
+        return len(pairs)
+
+    def _send_requests(self, institution, outsiders, requests, ids, now):
+        # DJG - the access requests are the ones a tutor sends from the messages page, so the student can allow them
+        messages = [dict(
+            from_id=institution.administrator_id,
+            to_id=ids[r['email']],
+            subject="Invitation to join the institution " + institution.name,
+            body="The administrator of " + institution.name + " would like to add you to the institution as a " +
+                 r['role'] + ". Your account has not been changed. Please contact them if you want to join.",
+            request_access=False,
+            sent=now) for r in outsiders]
+        messages.extend(dict(
+            from_id=tutor,
+            to_id=student,
+            subject="Request to view your progress",
+            body="Your tutor at " + institution.name + " has asked to view your progress through learning "
+                 "objectives.",
+            request_access=True,
+            sent=now) for tutor, student in requests)
+        if messages:
+            db.session.execute(Message.__table__.insert(), messages)
+            counts = {}
+            for message in messages:
+                counts[message['to_id']] = counts.get(message['to_id'], 0) + 1
+            User.add_unread(counts)
+
+
+def _batches(ids):
+    ids = list(ids)
+    for start in xrange(0, len(ids), _IN_BATCH):
+        yield ids[start:start + _IN_BATCH]
@@ -0,0 +1,261 @@
+# -*- coding: utf-8 -*-
+"""Service layer for resumable lecture uploads"""
+
+import errno
+import hashlib
+import os
+import uuid
+from datetime import datetime, timedelta
+try:
+    import fcntl
+except ImportError:     # DJG - no file locking on Windows; the development server only runs one process there anyway
+    fcntl = None
+
+import schema as s
+from flask import current_app
+from flask_uploads import extension
+from werkzeug.security import safe_join
+from werkzeug.utils import secure_filename
+
+from courseme import db, lectures
+from courseme.models import LectureUpload, Module
+from courseme.main.services.base import BaseService
+from courseme.errors import NotAuthorised, NotFound, ValidationError
+
+_COPY_BUFFER = 64 * 1024
+
+
+class UploadService(BaseService):
+    """Chunked, resumable uploads of lecture videos.
+
+    A client calls `start` with the file name and size, sends the file with
+    `append` one chunk at a time, and calls `complete` once every byte has
+    arrived.  Chunks are streamed straight into a partial file next to the
+    `lectures` upload folder, so a chunk is never held in memory in full.
+    Chunks must arrive in order; after a dropped connection the client asks
+    for `status` and resumes from `received`.  Uploads that are never
+    completed are removed by `purge_stale`.
+    """
+
+    __model__ = LectureUpload
+
+    _start_schema = {
+        'filename': basestring,
+        'total_size': s.Use(int),
+        s.Optional('module_id'): s.Or(None, s.Use(int)),
+        s.Optional('checksum'): s.Or(None, basestring),
+    }
+
+    def by_token(self, token):
+        """Lookup upload by token, returns None if no matching upload is found"""
+        return LectureUpload.query.filter_by(token=token).first()
+
+    def require_by_token(self, token, by_user):
+        """Lookup upload by token for its owner, raises NotFound or NotAuthorised"""
+        upload = self.by_token(token)
+        if upload is None:
+            raise NotFound(LectureUpload, 'token', token)
+        self._check_user_id(upload.user_id, by_user)
+        return upload
+
+    def start(self, upload_data, by_user):
+        """Begin a new upload.
+
+        :param upload_data: is a dictionary with the `filename` and
+                            `total_size` of the file and optionally the
+                            `module_id` it should be attached to and the
+                            SHA-256 `checksum` of the whole file.
+        :param by_user: the `User` who is uploading.
+        """
+        u = s.Schema(self._start_schema).validate(upload_data)
+
+        filename = secure_filename(u['filename'])
+        if not filename or not lectures.extension_allowed(extension(filename)):
+            raise ValidationError(filename="This type of file cannot be uploaded as a lecture")
+        if u['total_size'] <= 0 or u['total_size'] > current_app.config['COURSEME_MAX_LECTURE_SIZE']:
+            raise ValidationError(total_size="File is empty or too large")
+        if u.get('module_id'):
+            module = Module.query.get(u['module_id'])
+            if module is None:
+                raise NotFound(Module, 'id', u['module_id'])
+            self._check_user_id(module.author_id, by_user)
+
+        upload = LectureUpload(token=uuid.uuid4().hex,
+                               user_id=by_user.id,
+                               module_id=u.get('module_id'),
+                               filename=filename,
+                               total_size=u['total_size'],
+                               received=0,
+                               checksum=(u.get('checksum') or '').lower() or None,
+                               started=datetime.utcnow())
+        open(self._partial_path(upload), 'wb').close()
+        db.session.add(upload)
+        db.session.commit()
+        return upload
+
+    def status(self, token, by_user):
+        """The state of an upload, so that an interrupted client can resume"""
+        return self.require_by_token(token, by_user).as_dict()
+
+    def append(self, token, offset, length, stream, by_user, checksum=None):
+        """Write one chunk of the file.
+
+        :param offset: the byte offset of the chunk; must equal the number of
+                       bytes received so far.
+        :param length: the length of the chunk in bytes.
+        :param stream: a file-like object to read the chunk from.
+        :param checksum: the SHA-256 hex digest of the chunk, if given the
+                         chunk is rejected unless it matches.
+        """
+        upload = self.require_by_token(token, by_user)
+        if upload.completed:
+            raise ValidationError(token="This upload has already been completed")
+        if length <= 0 or length > current_app.config['COURSEME_UPLOAD_CHUNK_SIZE']:
+            raise ValidationError(length="Chunks must be between 1 and {} bytes".format(
+                current_app.config['COURSEME_UPLOAD_CHUNK_SIZE']))
+        if offset + length > upload.total_size:
+            raise ValidationError(length="Chunk runs past the end of the file")
+
+        with open(self._partial_path(upload), 'r+b') as f:
+            self._lock(f)
+            db.session.refresh(upload)
+            if offset != upload.received:
+                raise ValidationError(offset="Expected a chunk at offset {}".format(upload.received),
+                                      received=upload.received)
+
+            f.seek(offset)
+            digest = hashlib.sha256()
+            remaining = length
+            while remaining:
+                block = stream.read(min(_COPY_BUFFER, remaining))
+                if not block:
+                    break
+                digest.update(block)
+                f.write(block)
+                remaining -= len(block)
+
+            if remaining or (checksum and checksum.lower() != digest.hexdigest()):
+                f.truncate(offset)
+                raise ValidationError(checksum="Chunk was incomplete or corrupted, resend from offset {}".format(offset),
+                                      received=offset)
+            f.flush()
+            os.fsync(f.fileno())
+
+            upload.received = offset + length
+            db.session.add(upload)
+            db.session.commit()
+        return upload
+
+    def complete(self, token, by_user, checksum=None):
+        """Verify a fully received upload and move it into the lectures folder.
+
+        The file is moved into place with a hard link so that it appears
+        atomically and never overwrites another lecture.  If the upload was
+        started for a module the file is attached to it as its material.
+
+        :param checksum: the SHA-256 hex digest of the whole file, checked in
+                         addition to any checksum given to `start`.
+        """
+        upload = self.require_by_token(token, by_user)
+        if upload.completed:
+            return upload
+        if upload.received != upload.total_size:
+            raise ValidationError(received="Only {} of {} bytes have been received".format(
+                upload.received, upload.total_size), offset=upload.received)
+
+        partial_path = self._partial_path(upload)
+        digest = hashlib.sha256()
+        with open(partial_path, 'rb') as f:
+            for block in iter(lambda: f.read(_COPY_BUFFER), b''):
+                digest.update(block)
+        for expected in (upload.checksum, checksum):
+            if expected and expected.lower() != digest.hexdigest():
+                raise ValidationError(checksum="File checksum does not match")
+
+        destination = self._folder(lectures.config.destination)
+        name = upload.filename
+        while True:
+            try:
+                os.link(partial_path, os.path.join(destination, name))
+                break
+            except OSError as e:
+                if e.errno != errno.EEXIST:
+                    raise
+                name = lectures.resolve_conflict(destination, upload.filename)
+        os.unlink(partial_path)
+
+        upload.material_path = name
+        upload.completed = datetime.utcnow()
+        if upload.module:
+            upload.module.material_source = 'upload'
+            upload.module.material_path = name
+            upload.module.last_updated = datetime.utcnow()
+            db.session.add(upload.module)
+        db.session.add(upload)
+        db.session.commit()
+        return upload
+
+    def purge_stale(self, older_than=None):
+        """Delete unfinished uploads started more than `older_than` seconds ago, and their partial files.
+
+        :param older_than: defaults to `COURSEME_UPLOAD_EXPIRY`.
+        :returns: the number of uploads removed.
+        """
+        if older_than is None:
+            older_than = current_app.config['COURSEME_UPLOAD_EXPIRY']
+        cutoff = datetime.utcnow() - timedelta(seconds=older_than)
+        stale = LectureUpload.query.filter(LectureUpload.completed == None, LectureUpload.started < cutoff).all()
+        for upload in stale:
+            try:
+                os.unlink(self._partial_path(upload))
+            except OSError as e:
+                if e.errno != errno.ENOENT:
+                    raise
+            db.session.delete(upload)
+        db.session.commit()
+        return len(stale)
+
+    def material_path(self, token, by_user):
+        """The stored name of a completed upload, for attaching to a new module"""
+        upload = self.require_by_token(token, by_user)
+        if not upload.completed:
+            raise ValidationError(material="Upload has not finished")
+        return upload.material_path
+
+    def lecture_file(self, module, by_user):
+        """The absolute path of the uploaded lecture for `module`.
+
+        Raises NotAuthorised unless `by_user` can see the module and NotFound
+        if it has no uploaded material or the file has gone missing.
+        """
+        if not by_user.can_view_module(module):
+            raise NotAuthorised
+        if module.material_source != 'upload' or not module.material_path:
+            raise NotFound(Module, 'material_path', module.id)
+        path = safe_join(lectures.config.destination, module.material_path)
+        if path is None or not os.path.isfile(path):
+            raise NotFound(Module, 'material_path', module.material_path)
+        return path
+
+    def _partial_path(self, upload):
+        folder = self._folder(os.path.join(lectures.config.destination, '.partial'))
+        return os.path.join(folder, upload.token)
+
+    def _folder(self, folder):
+        try:
+            os.makedirs(folder)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+        return folder
+
+    def _lock(self, f):
+        # DJG - stops two requests writing the same chunk at once; released when the file is closed
+        if fcntl is None:
+            return
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except IOError as e:
+            if e.errno in (errno.EAGAIN, errno.EACCES):
+                raise ValidationError(offset="Another chunk of this upload is being written")
+            raise
@@ -1,13 +1,15 @@
-from flask import render_template, flash, redirect, session, url_for, request, g
+from flask import render_template, flash, redirect, session, url_for, request, g, current_app, abort, send_file, \
+    Response
 from flask_login import login_user, logout_user, current_user, login_required
 from . import main
 from .. import db, lectures
 import forms
 from .. models import User, ROLE_USER, ROLE_ADMIN, Objective, SchemeOfWork, UserObjective, Module, UserModule, Institution, \
-    Group, Message, Question, Subject, Topic
+    Group, Message, Question, QuestionSearch, QuestionSignature, Subject, Topic
 from datetime import datetime
 import operator
 from ..email import send_email
+from ..events import broker, user_channel, stream
 
 from courseme.main.services import Services
 import courseme.util.json as json
@@ -60,7 +62,7 @@ def select_subject(id):
 @login_required
 def objectives_admin(service_layer=_service_layer):
     title = "CourseMe - Objectives"
-    objectiveform = forms.EditObjective(topic_choices=Topic.TopicChoices(g.user))
+    objectiveform = forms.EditObjective(topic_choices=service_layer.reference.topic_choices(g.user))
     objectives = service_layer.objectives.objectives_for_selection(g.user, g.user.subject_id).all()
     objectives.sort(
         key=operator.methodcaller("score"))  # DJG - isn't there a way of doing this within the order_by of the query
@@ -138,7 +140,7 @@ def objectives_group(group_id, scheme_id=0, name_display=1, service_layer=_servi
 
 @main.route('/objective-add-update', methods=['POST'])
 def objective_add_update(service_layer=_service_layer):
-    form = forms.EditObjective(topic_choices=Topic.TopicChoices(g.user))
+    form = forms.EditObjective(topic_choices=service_layer.reference.topic_choices(g.user))
     form.prerequisites.choices = [(i, i) for i in form.prerequisites.data]
 
     if form.validate():
@@ -203,7 +205,7 @@ def objective_assess(profile_id, objective_id, service_layer=_service_layer):
 def editmodule(id=0, service_layer=_service_layer):
     title = 'CourseMe - Edit Module'
     moduleform = forms.EditModule()
-    objectiveform = forms.EditObjective(topic_choices=Topic.TopicChoices(g.user))
+    objectiveform = forms.EditObjective(topic_choices=service_layer.reference.topic_choices(g.user))
     module_objectives = []
     module = None
     if not g.user.subject:
@@ -280,7 +282,13 @@ def editmodule(id=0, service_layer=_service_layer):
                     if module.material_source == material_source and material_source == "upload":
                         material_path = module.material_path
 
-                if material_source == 'upload' and 'material' in request.files:  #DJG - Does flask-uploads automatically check against the allowed extention types and make the filename safe? Believe so.
+                if material_source == 'upload' and request.form.get('upload_token'):
+                    try:
+                        material_path = service_layer.uploads.material_path(request.form['upload_token'], g.user)
+                    except (ValidationError, NotAuthorised, NotFound):
+                        material_path = ""
+
+                elif material_source == 'upload' and 'material' in request.files:  #DJG - Does flask-uploads automatically check against the allowed extention types and make the filename safe? Believe so.
                     material_path = lectures.save(request.files[
                         'material'])  #This saves the file and returns its name (including the folder)
 
@@ -356,15 +364,15 @@ def editmodule(id=0, service_layer=_service_layer):
 def module(id, service_layer=_service_layer):
     title = "CourseMe - Module"
     module = Module.query.get_or_404(id)
-    g.user.subject_id = module.subject_id
-    db.session.add(g.user)
-    db.session.commit()
+    g.user.view_subject(module.subject_id)
     messageform = service_layer.messages.populate_message_form(g.user, g.user.subject_id)
     #messageform.message_to_group.choices = select_choices(g.user.groups_created.all(), True)
     #messageform.recommended_material.choices = select_choices(g.user.visible_modules(), True)
     #messageform.assign_objective.choices = select_choices(service_layer.objectives.objectives_for_selection(g.user, g.user.subject_id), True)
     #messageform.assign_scheme.choices = select_choices(service_layer.objectives.schemes_for_selection(g.user, g.user.subject_id), True)
-    usermodule = UserModule.FindOrCreate(g.user.id, id)
+    usermodule = UserModule.Find(g.user, module)
+    UserModule.record_view(g.user.id, module.id)
+    related_modules = service_layer.recommendations.related_modules(g.user, module)
     templates = {"Lecture": "lecture.html", "Course": "course.html"}
 
     return render_template(templates[module.material_type],
@@ -372,9 +380,92 @@ def module(id, service_layer=_service_layer):
                            messageform=messageform,
                            module=module,
                            usermodule=usermodule,
+                           related_modules=related_modules,
                            service_layer=service_layer)
 
 
+@main.route('/module/<int:id>/lecture')
+@login_required
+def lecture_material(id, service_layer=_service_layer):
+    # DJG - send_file answers Range, If-None-Match and If-Modified-Since itself, and hands the open file to the
+    # server's wsgi.file_wrapper so the bytes are copied with sendfile rather than through Python
+    module = Module.query.get_or_404(id)
+    try:
+        path = service_layer.uploads.lecture_file(module, g.user)
+    except NotAuthorised:
+        abort(403)
+    except NotFound:
+        abort(404)
+
+    accel_prefix = current_app.config.get('COURSEME_LECTURE_ACCEL_PREFIX')
+    if accel_prefix:
+        response = current_app.response_class(mimetype='video/mp4')
+        response.headers['X-Accel-Redirect'] = accel_prefix + module.material_path
+    else:
+        response = send_file(path, mimetype='video/mp4', conditional=True,
+                             cache_timeout=current_app.config['COURSEME_LECTURE_MAX_AGE'])
+    response.cache_control.private = True       # DJG - visibility depends on the user so shared caches must not keep it
+    return response
+
+
+@main.route('/lecture-upload', methods=['POST'])
+@login_required
+def lecture_upload_start(service_layer=_service_layer):
+    try:
+        upload = service_layer.uploads.start(request.form.to_dict(), g.user)
+        return _ajax_success(chunk_size=current_app.config['COURSEME_UPLOAD_CHUNK_SIZE'], **upload.as_dict())
+    except ValidationError, e:
+        return _ajax_failure(**e.errors)
+    except NotAuthorised, e:
+        return _ajax_failure(status_code=401, module_id="You are not authorised to edit this module")
+    except NotFound, e:
+        return _ajax_failure(status_code=404, module_id="Not found")
+
+
+@main.route('/lecture-upload/<token>', methods=['GET'])
+@login_required
+def lecture_upload_status(token, service_layer=_service_layer):
+    try:
+        return _ajax_success(**service_layer.uploads.status(token, g.user))
+    except (NotAuthorised, NotFound), e:
+        return _ajax_failure(status_code=404, token="Not found")
+
+
+@main.route('/lecture-upload/<token>', methods=['PUT'])
+@login_required
+def lecture_upload_chunk(token, service_layer=_service_layer):
+    # DJG - expects a raw body with a header like 'Content-Range: bytes 0-4194303/734003200'
+    content_range = request.headers.get('Content-Range', '')
+    try:
+        start, end = content_range.split(' ', 1)[1].split('/', 1)[0].split('-', 1)
+        offset, length = int(start), int(end) - int(start) + 1
+    except (IndexError, ValueError):
+        return _ajax_failure(content_range="A Content-Range header is required")
+    if request.content_length != length:
+        return _ajax_failure(content_range="Content-Range does not match the size of the chunk")
+
+    try:
+        upload = service_layer.uploads.append(token, offset, length, request.stream, g.user,
+                                              checksum=request.headers.get('X-Chunk-Checksum'))
+        return _ajax_success(**upload.as_dict())
+    except ValidationError, e:
+        return _ajax_failure(status_code=409, **e.errors)
+    except (NotAuthorised, NotFound), e:
+        return _ajax_failure(status_code=404, token="Not found")
+
+
+@main.route('/lecture-upload/<token>/complete', methods=['POST'])
+@login_required
+def lecture_upload_complete(token, service_layer=_service_layer):
+    try:
+        upload = service_layer.uploads.complete(token, g.user, checksum=request.form.get('checksum'))
+        return _ajax_success(**upload.as_dict())
+    except ValidationError, e:
+        return _ajax_failure(status_code=409, **e.errors)
+    except (NotAuthorised, NotFound), e:
+        return _ajax_failure(status_code=404, token="Not found")
+
+
 @main.route('/star/<int:id>')
 @login_required
 def starclick(id):
@@ -518,10 +609,58 @@ def students():
 
 @main.route('/messages')
 @login_required
-def messages():
+def messages(service_layer=_service_layer):
     title = "CourseMe - Messages"
+    try:
+        messages, next = service_layer.messages.inbox(g.user, before=request.args.get('before'))
+    except ValidationError:
+        return redirect(url_for('.messages'))
+    unread = [m.id for m in messages if m.read is None]
+    if unread:
+        service_layer.messages.mark_read(g.user, unread)
     return render_template('messages.html',
-                           title=title)
+                           title=title,
+                           messages=messages,
+                           next=next)
+
+
+@main.route('/inbox', methods=['GET'])
+@login_required
+def inbox(service_layer=_service_layer):
+    try:
+        limit = max(1, min(int(request.args.get('limit', current_app.config['COURSEME_MESSAGES_PER_PAGE'])), 100))
+        messages, next = service_layer.messages.inbox(g.user, before=request.args.get('before'), limit=limit)
+    except ValueError:
+        return _ajax_failure(limit="Limit must be a whole number")
+    except ValidationError, e:
+        return _ajax_failure(**e.errors)
+    return _ajax_success(messages=[m.as_dict() for m in messages], next=next)
+
+
+@main.route('/events')
+@login_required
+def event_stream():
+    # DJG - new messages and assessments for the user's open pages. The stream holds no database connection;
+    # under runserver_async it holds no thread either
+    subscription = broker.subscribe(user_channel(g.user.id))
+    db.session.remove()
+    response = Response(stream(subscription, current_app.config['COURSEME_EVENTS_HEARTBEAT']),
+                        mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'    # DJG - stop nginx buffering the stream
+    return response
+
+
+@main.route('/messages/read', methods=['POST'])
+@login_required
+def messages_read(service_layer=_service_layer):
+    # DJG - ids=3&ids=7 marks those messages read, no ids marks them all
+    try:
+        ids = [int(id) for id in request.form.getlist('ids')] or None
+    except ValueError:
+        return _ajax_failure(ids="Message ids must be whole numbers")
+    read = service_layer.messages.mark_read(g.user, ids)
+    return _ajax_success(read=read, unread=g.user.unread_messages)
 
 
 @main.route('/groups')
@@ -736,6 +875,26 @@ def restrict_modules_viewed(user_id, institution_id):
     return json.dumps(result)
 
 
+@main.route('/institution/<int:id>/roster', methods=['POST'])
+@login_required
+def import_roster(id, service_layer=_service_layer):
+    # DJG - expects a CSV file upload named roster, see RosterService for the columns
+    institution = Institution.query.get(id)
+    if institution is None:
+        return _ajax_failure(status_code=404, institution="Not found")
+    roster = request.files.get('roster')
+    if roster is None:
+        return _ajax_failure(roster="Upload a CSV file of students and tutors")
+    try:
+        result = service_layer.rosters.import_roster(institution, service_layer.rosters.parse_csv(roster.stream),
+                                                     g.user)
+    except ValidationError, e:
+        return _ajax_failure(**e.errors)
+    except NotAuthorised, e:
+        return _ajax_failure(status_code=401, institution="Only the institution's administrator can import a roster")
+    return _ajax_success(**result)
+
+
 @main.route('/send_message', methods=['POST'])
 @login_required
 def send_message(service_layer=_service_layer):
@@ -756,7 +915,8 @@ def send_message(service_layer=_service_layer):
                         subject=form.message_subject.data,
                         body=form.message_body.data,
                         request_access=form.request_access.data,
-                        recommended_material_id=recommended_material.id
+                        recommended_material_id=recommended_material.id,
+                        sent=datetime.utcnow()
                     )
                     db.session.add(message)
                     db.session.commit()
@@ -766,7 +926,7 @@ def send_message(service_layer=_service_layer):
             elif form.message_type.data == "Group":
                 group = Group.query.filter_by(name=form.message_to.data, creator=g.user).one()
                 if group:
-                    group.message(
+                    result['recipients'] = group.message(
                         subject=form.message_subject.data,
                         body=form.message_body.data,
                         request_access=form.request_access.data,
@@ -817,7 +977,7 @@ def deny_access(request_id):
 def edit_question(id=0, service_layer=_service_layer):
     title = "CourseMe - Questions"
     form = forms.EditQuestion()
-    objectiveform = forms.EditObjective(topic_choices=Topic.TopicChoices(g.user))
+    objectiveform = forms.EditObjective(topic_choices=service_layer.reference.topic_choices(g.user))
     question_objectives = []
     question = None
     #import pdb; pdb.set_trace()
@@ -894,6 +1054,8 @@ def edit_question(id=0, service_layer=_service_layer):
                     question.last_updated = datetime.utcnow()
                     db.session.add(question)
                     db.session.commit()
+                    QuestionSignature.Add(question)
+                    QuestionSearch.Index(question)
                 else:
                     question = Question.CreateQuestion(
                         question=form.question.data,
@@ -924,6 +1086,8 @@ def delete_question(id=0):
     question = Question.query.get(id)
     if question:
         if question.author == g.user:
+            QuestionSignature.Remove(question.id, commit=False)
+            QuestionSearch.Remove(question.id, commit=False)
             db.session.delete(question)
             db.session.commit()
             result['savedsuccess'] = True
@@ -937,16 +1101,14 @@ def delete_question(id=0):
 
 
 @main.route('/questions', methods=['GET'])
-def questions():
+def questions(service_layer=_service_layer):
     title = "CourseMe - Questions"
     if g.user.is_authenticated():
         questions = g.user.visible_questions().all()
-        catalogue = [question.as_dict(g.user) for question in
-                     questions]  #DJG - confused over best way to do this http://stackoverflow.com/questions/1958219/convert-sqlalchemy-row-object-to-python-dict
+        catalogue = service_layer.questions.catalogue(questions, g.user)
     else:
         questions = Question.query.all()
-        catalogue = [question.as_dict() for question in
-                     questions]  #DJG - confused over best way to do this http://stackoverflow.com/questions/1958219/convert-sqlalchemy-row-object-to-python-dict
+        catalogue = service_layer.questions.catalogue(questions)
 
     return render_template('questions.html',
                            title=title,
@@ -955,13 +1117,58 @@ def questions():
     )
 
 
+@main.route('/duplicate-questions')
+@login_required
+def duplicate_questions(service_layer=_service_layer):
+    title = "CourseMe - Duplicate Questions"
+    try:
+        clusters = service_layer.duplicates.clusters(g.user)
+    except NotAuthorised:
+        flash('Only administrators can review duplicate questions')
+        return redirect(url_for('.questions'))
+    return render_template('duplicate_questions.html',
+                           title=title,
+                           clusters=clusters)
+
+
+@main.route('/question-papers', methods=['POST'])
+@login_required
+def question_papers(service_layer=_service_layer):
+    # DJG - e.g. count=20&extension=0.25&objective_ids=3&objective_ids=7&papers=30&seed=1
+    paper_data = request.form.to_dict()
+    paper_data.pop('papers', None)
+    if 'objective_ids' in request.form:
+        paper_data['objective_ids'] = request.form.getlist('objective_ids')
+    try:
+        papers = service_layer.papers.generate_many(paper_data, g.user, papers=int(request.form.get('papers', 1)))
+    except ValueError:
+        return _ajax_failure(papers="Number of papers must be a whole number")
+    except ValidationError, e:
+        return _ajax_failure(**e.errors)
+    except NotFound, e:
+        return _ajax_failure(status_code=404, scheme_id="Not found")
+    questions = service_layer.questions.by_ids(id for paper in papers for id in paper)
+    return _ajax_success(papers=papers, questions=service_layer.questions.catalogue(questions, g.user))
+
+
+@main.route('/questions/search', methods=['GET'])
+def search_questions(service_layer=_service_layer):
+    try:
+        limit = min(int(request.args.get('limit', 50)), 200)
+        offset = max(int(request.args.get('offset', 0)), 0)
+    except ValueError:
+        return _ajax_failure(limit="Limit and offset must be whole numbers")
+    results = service_layer.questions.search(request.args.get('q', u''), g.user, limit=limit, offset=offset)
+    return _ajax_success(questions=results)
+
+
 @main.route('/select-question/<int:id>', methods=['GET', 'POST'])
 @login_required
 def select_question(id=0):
     result = {}
     result['savedsuccess'] = False
     question = Question.query.get(id)
-    if question:
+    if question and g.user.can_view_question(question):
         result['selected_class'] = g.user.toggle_select_question(question)
         result['savedsuccess'] = True
         return json.dumps(result)
@@ -972,12 +1179,12 @@ def select_question(id=0):
 
 @main.route('/questions-print', methods=['GET'])
 @login_required
-def questions_print():
+def questions_print(service_layer=_service_layer):
     # return app.send_static_file('print_questions.html')
     title = "CourseMe - Questions"
     if g.user.is_authenticated():
         questions = g.user.questions_selected
-        catalogue = [question.as_dict(g.user) for question in questions]  #DJG - confused over best way to do this http://stackoverflow.com/questions/1958219/convert-sqlalchemy-row-object-to-python-dict
+        catalogue = service_layer.questions.catalogue(questions, g.user)
     else:
         questions =[]
         catalogue = []
@@ -990,9 +1197,9 @@ def questions_print():
 
 @main.route('/selected-questions', methods=['GET'])
 @login_required
-def selected_questions():
+def selected_questions(service_layer=_service_layer):
     questions = g.user.questions_selected
-    catalogue = [question.as_dict() for question in questions]  #DJG - confused over best way to do this http://stackoverflow.com/questions/1958219/convert-sqlalchemy-row-object-to-python-dict
+    catalogue = service_layer.questions.catalogue(questions)
     return json.dumps(catalogue)
 
 
@@ -1,13 +1,26 @@
 # from flask import g         #DJG - Just added this to get the TopicChoices static method working. Could maybe otherwise add it as a method of User; doesn't work
+import itertools
 import json
 import operator
+from collections import defaultdict, namedtuple, OrderedDict
 from datetime import datetime, timedelta
 import md5
 from flask import current_app
-from werkzeug.security import generate_password_hash, check_password_hash
+from werkzeug.security import generate_password_hash
 from itsdangerous import TimedJSONWebSignatureSerializer as Serializer
-from sqlalchemy import desc
+from markupsafe import Markup
+from sqlalchemy import desc, and_, or_, bindparam, exists, true, false, event, literal, select, DDL
+from sqlalchemy.sql import table, column
+from sqlalchemy.orm.attributes import set_committed_value
+from sqlalchemy.orm.session import make_transient_to_detached
+from sqlalchemy.orm.util import identity_key
 from courseme import db, lm
+from courseme.events import broker, publish_after_commit
+from courseme.util.background import PeriodicWorker, WriteBehindBuffer
+from courseme.util.cache import KeyedCache
+from courseme.util.idset import IdSet
+from courseme.util.passwords import hasher
+from courseme.util import minhash
 
 
 ROLE_USER = 0
@@ -24,6 +37,26 @@ OBJ_WARN = 3
 
 ENTERPRISE_LICENCE_DURATION = 1
 
+MATERIAL_TYPES = ["Course", "Lecture", "Exercise", "Tool"]
+RECENT_MODULES_SCAN = 200   # DJG - only the most recent views are considered for the recents dropdown
+
+NOTIFICATION_BATCH = 500     # DJG - keeps each IN list under SQLite's limit on bound parameters
+USERNAME_PREFIX_BATCH = 200   # DJG - LIKE terms per query when checking many usernames at once
+
+MAIN_ADMIN_EMAIL = 'support@courseme.com'     # DJG - Not robust. Need some way to mark the main system admin user
+
+RecentModule = namedtuple('RecentModule', ['id', 'name', 'material_type'])
+Reference = namedtuple('Reference', ['id', 'name'])
+
+recent_modules_cache = KeyedCache(ttl=60)
+approved_ids_cache = KeyedCache(ttl=60)
+reference_cache = KeyedCache(ttl=300)
+user_identity_cache = KeyedCache(ttl=60)
+
+
+def _escape_like(value):
+    return value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
 
 def create_slug(context):
     slug = context.current_parameters['name']
@@ -52,7 +85,7 @@ class Topic(db.Model):
     @staticmethod
     def TopicChoices(user):
         topic_choices = [("0", "")]
-        for topic in Topic.query.filter(Topic.subject_id == user.subject_id).all():
+        for topic in ReferenceData.Topics(user.subject_id):
             topic_choices.append((str(topic.id), topic.name))
         return topic_choices
 
@@ -83,6 +116,8 @@ class User(db.Model):
     last_seen = db.Column(db.DateTime, default=datetime.utcnow)
     enterprise_licence = db.Column(db.DateTime)
     time_deleted = db.Column(db.DateTime)
+    unread_messages = db.Column(db.Integer, nullable=False, default=0, server_default='0')  # DJG - kept up to date as messages are written and read, see Message
+    session_version = db.Column(db.Integer, nullable=False, default=0, server_default='0')  # DJG - bumped when the password changes, which signs out every other session
 
     subject_id = db.Column(db.Integer, db.ForeignKey('subject.id'))
     subject = db.relationship("Subject")
@@ -122,14 +157,29 @@ class User(db.Model):
 
     @password.setter
     def password(self, password):
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = hasher.hash(password)
+        if self.id is not None:
+            self.session_version = (self.session_version or 0) + 1
 
     def verify_password(self, password):
-        return check_password_hash(self.password_hash, password)
+        return hasher.verify(self.password_hash, password)
+
+    def check_login(self, password):
+        """Verify the password, replacing the hash if it was made with older settings.
+
+        The new hash is left for the caller to commit.
+        """
+        if not self.verify_password(password):
+            return False
+        if hasher.needs_rehash(self.password_hash):
+            self.password_hash = hasher.hash(password)
+        return True
 
     @lm.user_loader
     def load_user(id):
-        return User.query.get(int(id))
+        # DJG - sessions from before session_version hold just the user id
+        user_id, _, version = id.partition(':')
+        return UserIdentity.Load(int(user_id), int(version) if version else None)
 
     def is_authenticated(self):
         return True
@@ -141,7 +191,7 @@ class User(db.Model):
         return False
 
     def get_id(self):
-        return unicode(self.id)
+        return u'%d:%d' % (self.id, self.session_version or 0)
 
     def generate_confirmation_token(self, expiration=3600*24*2):
         s = Serializer(current_app.config['SECRET_KEY'], expiration)
@@ -211,46 +261,59 @@ class User(db.Model):
     #         Objective.subject_id == self.subject_id)  # DJG - what about visible courses?
 
 
-    def restricted_questions_view(self):
+    def visible_questions(self, restricted=True, authored=True, live=True, subject=True, topic=None, answers=False):
+        """The questions the user can see, as a single query over `Question`.
+
+        A question is visible if it passes the user's institution restrictions
+        (`restricted`) or the user wrote it (`authored`), and it belongs to the
+        user's subject, has an objective in `topic` and has an answer when
+        `subject`, `topic` and `answers` ask for it.  Every condition is an
+        EXISTS or column predicate so the database can use the indexes on the
+        association tables rather than building and intersecting whole sets.
+        """
+        visible = []
+        if restricted:
+            institution_ids = self._restricting_institution_ids()
+            visible.append(and_(*[Question.ApprovedBy(institution_id) for institution_id in institution_ids])
+                           if institution_ids else true())
+        if authored:
+            visible.append(Question.author_id == self.id)
+
+        query = Question.query.filter(or_(*visible) if visible else false())
+        # DJG - live is accepted for symmetry with visible_modules; every question is currently live (see LiveQuestions)
+        if subject and self.subject_id:
+            query = query.filter(Question.subject_id == self.subject_id)
+        if topic:
+            query = query.filter(Question.InTopic(topic.id))
+        if answers:
+            query = query.filter(Question.HasAnswer())
+        return query
+
+    def _restricting_institution_ids(self):
+        # DJG - the user's own view restriction and the one set by the institution they are a student of both apply
+        # DJG - read through the relationships so restrictions set on unflushed objects are seen
+        ids = set()
+        if self.view_institution_only:
+            ids.add(self.view_institution_only.id)
         institution_student = self.institution_student
         if institution_student and institution_student.view_institution_only:
-            query_student = institution_student.view_institution_only.approved_questions
-        else:
-            query_student = Question.query
-
-        if self.view_institution_only:
-            query_select = self.view_institution_only.approved_questions
-        else:
-            query_select = Question.query
-        restricted_view = query_select.intersect(query_student)
-        return restricted_view
+            ids.add(institution_student.view_institution_only.id)
+        return sorted(ids)
 
 
-    def visible_questions(self, restricted=True, authored=True, live=True, subject=True, topic=None, answers=False):
-        # union parts
-        query_restricted = self.restricted_questions_view() if restricted else Question.query.filter(1 == 0)
-        query_authored = self.questions_authored if authored else Question.query.filter(1 == 0)
-        # intersect parts
-        query_live = Question.LiveQuestions() if live else Question.query
-        query_subject = self.subject.questions if subject and self.subject else Question.query
-        query_topic = topic.questions if topic else Question.query
-        query_answers = Question.query.filter(Question.has_answer()) if answers else Question.query
-        return query_restricted.union(query_authored).intersect(query_live, query_subject, query_topic, query_answers)
+    def restricted_module_ids(self):
+        """The ids of the modules the user's institution restrictions allow, or None if nothing is restricted"""
+        return ApprovedIds.For(institution_approved_modules.c.module_id, self._restricting_institution_ids())
 
+    def restricted_question_ids(self):
+        """The ids of the questions the user's institution restrictions allow, or None if nothing is restricted"""
+        return ApprovedIds.For(institution_approved_questions.c.question_id, self._restricting_institution_ids())
 
     def restricted_modules_view(self):
-        institution_student = self.institution_student
-        if institution_student and institution_student.view_institution_only:
-            query_student = institution_student.view_institution_only.approved_modules
-        else:
-            query_student = Module.query
-
-        if self.view_institution_only:
-            query_select = self.view_institution_only.approved_modules
-        else:
-            query_select = Module.query
-        restricted_view = query_select.intersect(query_student)
-        return restricted_view
+        institution_ids = self._restricting_institution_ids()
+        if not institution_ids:
+            return Module.query
+        return Module.query.filter(and_(*[Module.ApprovedBy(institution_id) for institution_id in institution_ids]))
 
 
     def visible_modules(self, restricted=True, authored=True, viewed=True, live=True, material_type=None, subject=True,
@@ -268,18 +331,70 @@ class User(db.Model):
         return query_restricted.union(query_authored, query_viewed).intersect(query_live, query_type, query_subject,
                                                                               query_topic)
 
+    def can_view_module(self, module):
+        """Whether the user may see `module`; authors and admins can always see their material"""
+        if module.author_id == self.id or self.is_admin():
+            return True
+        if not module.live:
+            return False
+        restricted = self.restricted_module_ids()
+        if restricted is None or module.id in restricted:
+            return True
+        return db.session.query(exists().where(and_(UserModule.user_id == self.id,
+                                                    UserModule.module_id == module.id))).scalar()
+
+    def can_view_question(self, question):
+        """Whether the user may see `question`; authors and admins can always see their questions"""
+        if question.author_id == self.id or self.is_admin():
+            return True
+        restricted = self.restricted_question_ids()
+        return restricted is None or question.id in restricted
+
     def enrolled_courses(self):
         return self.visible_modules(False, False, True, True, material_type='Course', subject=False,
                                     topic=False).filter(UserModule.enrolled).order_by(desc(UserModule.last_viewed))
 
     def recent_modules(self, count):
-        # import pdb; pdb.set_trace()        #DJG - remove
+        """The `count` live modules the user viewed most recently, newest first"""
         if self:
-            # return self.visible_modules(restricted=False, authored=False, viewed=True, live=True, material_type=None, subject=False, topic=None).join(UserModule).order_by(desc(UserModule.last_viewed)).limit(count).all()     #DJG - working but not on index page
-            return []
+            recent = self._recent_modules()
+            recent = sorted((m for ms in recent.itervalues() for m in ms), key=operator.itemgetter(0), reverse=True)
+            return [m for last_viewed, m in recent[:count]]
         else:
             return []
 
+    def recent_modules_by_type(self, count):
+        """Up to `count` recently viewed live modules of each material type, newest first.
+
+        Returns an OrderedDict of material type to list of `RecentModule`; types
+        the user has not viewed recently are left out.
+        """
+        result = OrderedDict()
+        if self:
+            for material_type, recent in self._recent_modules().iteritems():
+                result[material_type] = [m for last_viewed, m in recent[:count]]
+        return result
+
+    def _recent_modules(self):
+        # DJG - cached per user and dropped whenever a batch of views for the user is written
+        return recent_modules_cache.get_or_load(self.id, self._load_recent_modules)
+
+    def _load_recent_modules(self):
+        # DJG - walks ix_user_module_user_id_last_viewed and stops after RECENT_MODULES_SCAN rows
+        views = db.session.query(UserModule.last_viewed, UserModule.module_id) \
+            .filter(UserModule.user_id == self.id) \
+            .filter(UserModule.last_viewed != None) \
+            .order_by(desc(UserModule.last_viewed)) \
+            .limit(RECENT_MODULES_SCAN).subquery()
+        rows = db.session.query(views.c.last_viewed, Module.id, Module.name, Module.material_type) \
+            .join(Module, Module.id == views.c.module_id) \
+            .filter(Module.live) \
+            .order_by(desc(views.c.last_viewed)).all()
+        recent = OrderedDict((material_type, []) for material_type in MATERIAL_TYPES)
+        for last_viewed, id, name, material_type in rows:
+            recent.setdefault(material_type, []).append((last_viewed, RecentModule(id, name, material_type)))
+        return OrderedDict((t, ms) for t, ms in recent.iteritems() if ms)
+
     def member_institutions(self):
         # DJG - must be able to do better than this avoiding two query calls! Try union of queries
         institutions = []
@@ -297,7 +412,7 @@ class User(db.Model):
         return institutions
 
     def live_messages(self):
-        return self.received_messages.filter(bool(Message.deleted)).order_by(desc(Message.sent))
+        return self.received_messages.filter(Message.deleted == None).order_by(desc(Message.sent), desc(Message.id))
 
     def institution_tutors_q(self):
         # DJG - The members of the institution of which the user is a student
@@ -380,17 +495,99 @@ class User(db.Model):
     def is_admin(self):
         return self.role == ROLE_ADMIN
 
+    def view_subject(self, subject_id):
+        """Switch the subject the user is browsing without a write on the request.
+
+        The new subject is visible on this instance straight away and is
+        persisted later by the `user_subjects` write-behind buffer.
+        """
+        if self.subject_id != subject_id:
+            set_committed_value(self, 'subject_id', subject_id)
+            db.session.expire(self, ['subject'])
+            UserIdentity.Update(self.id, subject_id=subject_id)
+            user_subjects.put(self.id, subject_id)
+
+    def seen(self, now=None):
+        """Note that the user is active without a write on every request.
+
+        `last_seen` only moves on once it is `COURSEME_LAST_SEEN_RESOLUTION`
+        seconds old, and is persisted later by the `user_last_seen`
+        write-behind buffer.
+        """
+        now = now or datetime.utcnow()
+        resolution = timedelta(seconds=current_app.config['COURSEME_LAST_SEEN_RESOLUTION'])
+        if self.last_seen is None or now - self.last_seen >= resolution:
+            set_committed_value(self, 'last_seen', now)
+            UserIdentity.Update(self.id, last_seen=now)
+            user_last_seen.put(self.id, now)
+
+    @staticmethod
+    def record_last_seen(times):
+        """Write a batch of buffered last_seen times in one transaction.
+
+        :param times: dict of user id to the time the user was last seen.
+        """
+        table = User.__table__
+        db.session.execute(
+            table.update().where(table.c.id == bindparam('_id')).values(last_seen=bindparam('_last_seen')),
+            [{'_id': user_id, '_last_seen': last_seen} for user_id, last_seen in times.iteritems()])
+        db.session.commit()
+
+    @staticmethod
+    def record_subjects(subjects):
+        """Write a batch of buffered subject changes in one transaction.
+
+        :param subjects: dict of user id to subject id.
+        """
+        table = User.__table__
+        db.session.execute(
+            table.update().where(table.c.id == bindparam('_id')).values(subject_id=bindparam('_subject_id')),
+            [{'_id': user_id, '_subject_id': subject_id} for user_id, subject_id in subjects.iteritems()])
+        db.session.commit()
+
+    @staticmethod
+    def add_unread(counts):
+        """Add to users' unread message counters without committing.
+
+        :param counts: dict of user id to the number of messages to add,
+                       negative for messages that have been read.
+        """
+        table = User.__table__
+        counts = [{'_id': user_id, '_count': count} for user_id, count in counts.iteritems() if count]
+        if counts:
+            db.session.execute(
+                table.update().where(table.c.id == bindparam('_id'))
+                .values(unread_messages=table.c.unread_messages + bindparam('_count')), counts)
+            UserIdentity.AddUnread(dict((c['_id'], c['_count']) for c in counts))
+
     @staticmethod
     def make_unique_username(username):
-        if User.query.filter_by(name=username).first() == None:
-            return username
-        version = 2
-        while True:
-            new_username = username + str(version)
-            if User.query.filter_by(name=new_username).first() == None:
-                break
-            version += 1
-        return new_username
+        return User.make_unique_usernames([username])[0]
+
+    @staticmethod
+    def make_unique_usernames(usernames):
+        """Unique versions of `usernames`, numbered from 2 when a name is taken or repeated.
+
+        The names already taken are read in one pass with a prefix match for
+        each requested name, rather than querying every candidate in turn.
+        """
+        usernames = list(usernames)
+        taken = set()
+        prefixes = sorted(set(usernames))
+        for start in xrange(0, len(prefixes), USERNAME_PREFIX_BATCH):
+            batch = prefixes[start:start + USERNAME_PREFIX_BATCH]
+            taken.update(name for (name,) in db.session.query(User.name).filter(or_(*[
+                User.name.like(_escape_like(prefix) + u'%', escape='\\') for prefix in batch])))
+        unique = []
+        for username in usernames:
+            candidate, version = username, 2
+            while candidate in taken:
+                suffix = str(version)
+                candidate = username[:User.__table__.c.name.type.length - len(suffix)] + suffix
+                version += 1
+            taken.add(candidate)
+            unique.append(candidate)
+        return unique
 
     @staticmethod
     def admin_users():
@@ -402,8 +599,9 @@ class User(db.Model):
 
     @staticmethod
     def main_admin_user():
-        return User.user_by_email('support@courseme.com')
-        # DJG - Not robust. Need some way to return the main system admin user
+        # DJG - get() finds the user in the session after the first call, so this is at most one query per request
+        admin_id = ReferenceData.MainAdminId()
+        return User.query.get(admin_id) if admin_id is not None else None
 
     @staticmethod
     def user_by_email(email):
@@ -795,6 +993,11 @@ class Module(db.Model):  # DJG - change this class to material as it now capture
     def LiveModules():
         return Module.query.filter(Module.live)
 
+    @staticmethod
+    def ApprovedBy(institution_id):
+        return exists().where(and_(institution_approved_modules.c.module_id == Module.id,
+                                   institution_approved_modules.c.institution_id == institution_id))
+
     @staticmethod
     def RecommendChoices():
         try:  # DJG - this exception handling is needed because the forms module references this method and so on database creation it creates an error since the table cannot be found and queries. Perhaps there is a better way to prevent the cyclic dependency on startup
@@ -804,6 +1007,8 @@ class Module(db.Model):  # DJG - change this class to material as it now capture
 
 
 class UserModule(db.Model):
+    __table_args__ = (db.Index('ix_user_module_user_id_module_id', 'user_id', 'module_id', unique=True),)
+
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey(User.id))
     module_id = db.Column(db.Integer, db.ForeignKey(Module.id))
@@ -896,8 +1101,113 @@ class UserModule(db.Model):
         usermodule.last_viewed = datetime.utcnow()
         db.session.add(usermodule)
         db.session.commit()
+        recent_modules_cache.invalidate(user_id)
         return usermodule
 
+    @staticmethod
+    def Find(user, module):
+        """The user's UserModule for display, without writing anything.
+
+        If the user has never viewed the module an unsaved UserModule with the
+        default settings is returned; use `record_view` to log the view itself.
+        """
+        usermodule = UserModule.query.filter_by(user_id=user.id, module_id=module.id).first()
+        if usermodule is None:
+            usermodule = UserModule(user_id=user.id,
+                                    module_id=module.id,
+                                    starred=False,
+                                    vote=0,
+                                    enrolled=False,
+                                    deleted=False)
+            # DJG - set_committed_value avoids the backref cascade adding this to the session
+            set_committed_value(usermodule, 'user', user)
+            set_committed_value(usermodule, 'module', module)
+        return usermodule
+
+    @staticmethod
+    def record_view(user_id, module_id):
+        """Queue a view of the module in the `module_views` write-behind buffer"""
+        now = datetime.utcnow()
+        module_views.put((user_id, module_id), (now, now))
+
+    @staticmethod
+    def record_views(views):
+        """Upsert a batch of buffered views on (user_id, module_id) in one transaction.
+
+        :param views: dict of (user_id, module_id) to (first_viewed, last_viewed).
+        """
+        table = UserModule.__table__
+        user_ids = set(user_id for user_id, module_id in views)
+        module_ids = set(module_id for user_id, module_id in views)
+        existing = set(db.session.query(UserModule.user_id, UserModule.module_id)
+                       .filter(UserModule.user_id.in_(user_ids))
+                       .filter(UserModule.module_id.in_(module_ids)))
+
+        updates = []
+        inserts = []
+        for (user_id, module_id), (first_viewed, last_viewed) in views.iteritems():
+            if (user_id, module_id) in existing:
+                updates.append({'_user_id': user_id, '_module_id': module_id, '_last_viewed': last_viewed})
+            else:
+                inserts.append({'user_id': user_id, 'module_id': module_id,
+                                'first_viewed': first_viewed, 'last_viewed': last_viewed})
+        if updates:
+            db.session.execute(
+                table.update()
+                    .where(and_(table.c.user_id == bindparam('_user_id'), table.c.module_id == bindparam('_module_id')))
+                    .values(last_viewed=bindparam('_last_viewed')),
+                updates)
+        if inserts:
+            db.session.execute(table.insert(), inserts)
+        db.session.commit()
+        recent_modules_cache.invalidate(*user_ids)
+
+
+db.Index('ix_user_module_user_id_last_viewed', UserModule.user_id, UserModule.last_viewed.desc())
+
+
+class ModuleNeighbour(db.Model):
+    # DJG - written in bulk by RecommendationService.build; the top neighbours of each module by co-view similarity
+    id = db.Column(db.Integer, primary_key=True)
+    module_id = db.Column(db.Integer, db.ForeignKey(Module.id), index=True, nullable=False)
+    neighbour_id = db.Column(db.Integer, db.ForeignKey(Module.id), nullable=False)
+    score = db.Column(db.Float, nullable=False)
+    rank = db.Column(db.SmallInteger, nullable=False)
+
+
+class LectureUpload(db.Model):
+    # DJG - one resumable chunked upload of a lecture video; see UploadService
+    id = db.Column(db.Integer, primary_key=True)
+    token = db.Column(db.String(32), index=True, unique=True, nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey(User.id), nullable=False)
+    module_id = db.Column(db.Integer, db.ForeignKey(Module.id))
+    filename = db.Column(db.String(255), nullable=False)
+    total_size = db.Column(db.BigInteger, nullable=False)
+    received = db.Column(db.BigInteger, nullable=False, default=0)
+    checksum = db.Column(db.String(64))
+    material_path = db.Column(db.String(400))
+    started = db.Column(db.DateTime)
+    completed = db.Column(db.DateTime)
+
+    user = db.relationship(User)
+    module = db.relationship(Module)
+
+    def as_dict(self):
+        result = {}
+        result['token'] = self.token
+        result['filename'] = self.filename
+        result['total_size'] = self.total_size
+        result['received'] = self.received
+        result['completed'] = bool(self.completed)
+        result['material_path'] = self.material_path
+        return result
+
+
+module_views = WriteBehindBuffer(UserModule.record_views, 'COURSEME_VIEW_FLUSH_INTERVAL',
+                                 merge=lambda old, new: (old[0], new[1]))
+user_subjects = WriteBehindBuffer(User.record_subjects, 'COURSEME_VIEW_FLUSH_INTERVAL')
+user_last_seen = WriteBehindBuffer(User.record_last_seen, 'COURSEME_VIEW_FLUSH_INTERVAL', merge=max)
+
 
 class Message(
     db.Model):  # DJG - probably need a separate one for module and course recommendations, need to add the relationship to the material being recommended and all the permissions
@@ -921,24 +1231,171 @@ class Message(
     recommended_material = db.relationship(Module, foreign_keys=[recommended_material_id], backref='recommendations')
     recommended_material = db.relationship(Module, foreign_keys=[recommended_material_id], backref='recommendations')
 
+    def as_dict(self):
+        result = dict((column.name, getattr(self, column.name)) for column in self.__table__.columns)
+        result['from_name'] = self.from_user.name if self.from_user else None
+        result['recommended_material_name'] = self.recommended_material.name if self.recommended_material else None
+        return result
+
     def report(self):
         self.reported = datetime.utcnow()
         db.session.add(self)
         db.session.commit()
         # DJG - do some kind of notification process
 
+    @staticmethod
+    def AdminMessages(recipients, recommended_material_id=None):
+        """Queue admin notifications to many users with one INSERT ... SELECT, without committing.
+
+        The notifications are delivered by `PendingNotification.Flush`, or
+        written straight into the recipients' messages as part of the
+        caller's transaction when digests are turned off.
+
+        :param recipients: a query of (to_id, subject, body) rows, subject and
+                           body may be SQL expressions built per recipient.
+                           A fourth column, if any, is the recommended
+                           material of each row and overrides
+                           `recommended_material_id`.
+        """
+        rows = recipients.subquery()
+        columns = list(rows.c)
+        recommended = columns[3] if len(columns) > 3 else literal(recommended_material_id, db.Integer)
+        now = literal(datetime.utcnow(), db.DateTime)
+        if notification_digests.interval:
+            db.session.execute(PendingNotification.__table__.insert().from_select(
+                ['to_id', 'subject', 'body', 'recommended_material_id', 'created'],
+                select([columns[0], columns[1], columns[2], recommended, now])))
+            return
+        # DJG - nothing is queued, so there is no claim to lose and the caller's transaction is never rolled back
+        db.session.execute(Message.__table__.insert().from_select(
+            ['from_id', 'to_id', 'subject', 'body', 'recommended_material_id', 'sent'],
+            select([literal(ReferenceData.MainAdminId(), db.Integer), columns[0], columns[1], columns[2],
+                    recommended, now])))
+        counts = dict(db.session.execute(select([columns[0], db.func.count()]).group_by(columns[0])).fetchall())
+        User.add_unread(counts)
+        for to_id, count in counts.iteritems():
+            publish_after_commit(to_id, 'message', {'count': count})
+
     @staticmethod
     def AdminMessage(to_id, subject, body="", recommended_material_id=0):
-        admin_message = Message(from_id=User.main_admin_user().id,
-                                to_id=to_id,
-                                subject=subject,
-                                body=body,
-                                sent=datetime.utcnow(),
-                                recommended_material_id=recommended_material_id)
-        db.session.add(admin_message)
+        """Queue an admin notification to one user and commit, see `AdminMessages`"""
+        Message.AdminMessages(db.session.query(literal(to_id, db.Integer), literal(subject, db.Text),
+                                               literal(body, db.Text)),
+                              recommended_material_id=recommended_material_id)
         db.session.commit()
 
 
+# DJG - serves the inbox: a user's live messages newest first, see MessageService.inbox
+db.Index('ix_message_to_id_deleted_sent', Message.to_id, Message.deleted, Message.sent.desc())
+
+
+@event.listens_for(Message, 'after_insert')
+def _count_unread_message(mapper, connection, message):
+    # DJG - messages added through the session; bulk inserts of messages update the counters themselves
+    if message.to_id and message.read is None:
+        users = User.__table__
+        connection.execute(users.update().where(users.c.id == message.to_id)
+                           .values(unread_messages=users.c.unread_messages + 1))
+        UserIdentity.AddUnread({message.to_id: 1})
+        publish_after_commit(message.to_id, 'message', {'count': 1, 'subject': message.subject})
+
+
+
+class PendingNotification(db.Model):
+    """An admin notification waiting to be delivered.
+
+    System notifications (approvals, enrolments, licence warnings and so on)
+    are queued here rather than written straight to `Message`, and the
+    `notification_digests` worker delivers them: everything queued for a
+    user within `COURSEME_DIGEST_WINDOW` seconds of their oldest pending
+    notification arrives as a single digest message.
+    """
+    id = db.Column(db.Integer, primary_key=True)
+    to_id = db.Column(db.Integer, db.ForeignKey(User.id), index=True, nullable=False)
+    subject = db.Column(db.Text, nullable=False)
+    body = db.Column(db.Text)
+    recommended_material_id = db.Column(db.Integer)
+    created = db.Column(db.DateTime, nullable=False)
+
+    @staticmethod
+    def Flush(window):
+        """Deliver the pending notifications of every user whose oldest one is at least `window` seconds old.
+
+        A user's notifications become one digest message, or are delivered
+        individually if `window` is 0.  The rows are claimed by deleting
+        them, so if another process has delivered some of them first
+        nothing is written.
+
+        :returns: the number of messages written.
+        """
+        table = PendingNotification.__table__
+        cutoff = datetime.utcnow() - timedelta(seconds=window)
+        due = select([table.c.to_id]).group_by(table.c.to_id).having(db.func.min(table.c.created) <= cutoff)
+        pending = db.session.query(table).filter(table.c.to_id.in_(due)).order_by(table.c.to_id, table.c.id).all()
+        if not pending:
+            return 0
+
+        claimed = 0
+        ids = [n.id for n in pending]
+        for start in xrange(0, len(ids), NOTIFICATION_BATCH):
+            claimed += db.session.execute(table.delete().where(
+                table.c.id.in_(ids[start:start + NOTIFICATION_BATCH]))).rowcount
+        if claimed != len(ids):
+            db.session.rollback()
+            return 0
+
+        admin = User.main_admin_user()
+        now = datetime.utcnow()
+        messages = []
+        for to_id, notifications in itertools.groupby(pending, key=operator.attrgetter('to_id')):
+            notifications = list(notifications)
+            groups = [notifications] if window else [[n] for n in notifications]
+            for group in groups:
+                message = dict(from_id=admin.id if admin else None, to_id=to_id, sent=now,
+                               subject=group[0].subject, body=group[0].body,
+                               recommended_material_id=group[0].recommended_material_id)
+                if len(group) > 1:
+                    message['subject'] = "{} new notifications from CourseMe".format(len(group))
+                    message['body'] = "\n\n".join(n.subject + ("\n" + n.body if n.body else "") for n in group)
+                    message['recommended_material_id'] = None
+                messages.append(message)
+        db.session.execute(Message.__table__.insert(), messages)
+        counts = dict((to_id, len(list(rows))) for to_id, rows in
+                      itertools.groupby(messages, key=operator.itemgetter('to_id')))
+        User.add_unread(counts)
+        for to_id, count in counts.iteritems():
+            publish_after_commit(to_id, 'message', {'count': count})
+        db.session.commit()
+        return len(messages)
+
+
+class DigestWorker(PeriodicWorker):
+    """Delivers queued notifications every `COURSEME_DIGEST_FLUSH_INTERVAL` seconds"""
+
+    def run_once(self):
+        return PendingNotification.Flush(current_app.config['COURSEME_DIGEST_WINDOW'])
+
+
+notification_digests = DigestWorker('COURSEME_DIGEST_FLUSH_INTERVAL')
+
+
+
+class OutboxEmail(db.Model):
+    # DJG - an email waiting to be sent by courseme.email.outbox; sent is set once it has gone
+    __table_args__ = (db.Index('ix_outbox_email_sent_next_attempt', 'sent', 'next_attempt'),)
+    id = db.Column(db.Integer, primary_key=True)
+    recipient = db.Column(db.String(128), nullable=False)
+    sender = db.Column(db.String(128), nullable=False)
+    subject = db.Column(db.String(256), nullable=False)
+    body = db.Column(db.Text)
+    html = db.Column(db.Text)
+    created = db.Column(db.DateTime, nullable=False)
+    next_attempt = db.Column(db.DateTime)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    last_error = db.Column(db.String(500))
+    sent = db.Column(db.DateTime)
+
+
 group_members = db.Table('group_members',
                          db.Column('group_id', db.Integer, db.ForeignKey('group.id')),
                          db.Column('member_id', db.Integer, db.ForeignKey('user.id'))
@@ -974,19 +1431,37 @@ class Group(db.Model):
         else:
             pass
 
-    def message(self, subject, body, recommended_material=None, request_access=False):  # DJG - am I using this?
-        for member in self.members:
-            message = Message(
-                from_id=self.creator_id,
-                to_id=member.id,
-                subject=subject,
-                body=body,
-                sent=datetime.utcnow()
-            )
-            if recommended_material: message.recommended_material = recommended_material
-            if request_access: message.request_access = request_access
-            db.session.add(message)
-            db.session.commit()
+    def message(self, subject, body, recommended_material=None, request_access=False):
+        """Send a message to every member with one INSERT ... SELECT over the group's members.
+
+        The members are never loaded and there is a single commit whatever
+        the size of the group.
+
+        :returns: the number of messages sent.
+        """
+        columns = ['from_id', 'to_id', 'subject', 'body', 'sent', 'recommended_material_id', 'request_access']
+        recipients = select([literal(self.creator_id, db.Integer),
+                             group_members.c.member_id,
+                             literal(subject, db.Text),
+                             literal(body, db.Text),
+                             literal(datetime.utcnow(), db.DateTime),
+                             literal(recommended_material.id if recommended_material else None, db.Integer),
+                             literal(bool(request_access), db.Boolean)]) \
+            .where(group_members.c.group_id == self.id).distinct()
+        sent = db.session.execute(Message.__table__.insert().from_select(columns, recipients)).rowcount
+        users = User.__table__
+        db.session.execute(users.update().where(users.c.id.in_(
+            select([group_members.c.member_id]).where(group_members.c.group_id == self.id)))
+            .values(unread_messages=users.c.unread_messages + 1))
+        if len(broker) or len(user_identity_cache):
+            # DJG - only worth reading the members back when someone has a page open or a snapshot to keep up to date
+            member_ids = [member_id for (member_id,) in db.session.execute(
+                select([group_members.c.member_id]).distinct().where(group_members.c.group_id == self.id))]
+            UserIdentity.AddUnread(dict((member_id, 1) for member_id in member_ids))
+            for member_id in member_ids:
+                publish_after_commit(member_id, 'message', {'count': 1, 'subject': subject})
+        db.session.commit()
+        return sent
 
     def viewable_members(self):
         students = self.members.order_by(User.email).all()
@@ -1015,6 +1490,8 @@ institution_approved_questions = db.Table('institution_approved_questions',
                                           db.Column('institution_id', db.Integer, db.ForeignKey('institution.id')),
                                           db.Column('question_id', db.Integer, db.ForeignKey('question.id'))
 )
+db.Index('ix_institution_approved_questions_question_id_institution_id',
+         institution_approved_questions.c.question_id, institution_approved_questions.c.institution_id)
 
 
 class Institution(db.Model):
@@ -1047,27 +1524,64 @@ class Institution(db.Model):
 
     def add_member(self, user):
         if user:
-            if not self.is_member(user):
-                self.members.append(user)
-                message = Message(
-                    from_id=self.administrator_id,
-                    to_id=user.id,
-                    subject="You have been added to the institution " + self.name,
-                    body="You have been added to the institution " + self.name + ". All of your authored material will now appear on the approved list of modules for this institution and you can view the progress of all students of " + self.name + ". Your name will be listed on the institution profile page. If you want to leave this institution go to the institutions section of your profile page and click the button to leave.",
-                    sent=datetime.utcnow())
-                db.session.add(message)
-            for module in user.visible_modules(restricted=False, authored=True, viewed=False, live=True,
-                                               material_type=None, subject=False, topic=None).all():
-                if not self.is_approved(module):
-                    self.approve_module(module)
-            for question in user.visible_questions(restricted=False, authored=True, live=True, subject=False,
-                                                   topic=None, answers=False).all():
-                if not self.is_approved_question(question):
-                    self.approve_question(question)
-            db.session.add(self)
+            self.add_members([user])
+
+    def add_members(self, users, commit=True):
+        """Make `users` members and approve everything they have authored, in one transaction.
+
+        New members get a welcome message.  Their live modules and their
+        questions are approved with one anti-join INSERT ... SELECT per
+        association table, so existing approvals are skipped in SQL; for the
+        main CourseMe institution they are approved for every institution,
+        and each institution's administrator is told about each newly
+        approved item as `approve_module` and `approve_question` do.  Pass
+        `commit=False` to make this part of a larger transaction.
+        """
+        users = dict((user.id, user) for user in users if user)
+        if not users:
+            return
+        existing = set(id for (id,) in db.session.query(institution_members.c.member_id)
+                       .filter(institution_members.c.institution_id == self.id)
+                       .filter(institution_members.c.member_id.in_(list(users))))
+        new_members = [user for id, user in sorted(users.items()) if id not in existing]
+        if new_members:
+            db.session.execute(institution_members.insert(),
+                               [{'institution_id': self.id, 'member_id': user.id} for user in new_members])
+            db.session.execute(Message.__table__.insert(), [dict(
+                from_id=self.administrator_id,
+                to_id=user.id,
+                subject="You have been added to the institution " + self.name,
+                body="You have been added to the institution " + self.name + ". All of your authored material will now appear on the approved list of modules for this institution and you can view the progress of all students of " + self.name + ". Your name will be listed on the institution profile page. If you want to leave this institution go to the institutions section of your profile page and click the button to leave.",
+                sent=datetime.utcnow()) for user in new_members])
+            User.add_unread(dict((user.id, 1) for user in new_members))
+
+        everywhere = self == Institution.main_courseme_institution()
+        module_notify = question_notify = None
+        if everywhere:
+            module_notify = (Module,
+                             literal("New ") + Subject.name + literal(" ") + Module.material_type +
+                             literal(" approved by CourseMe"),
+                             literal("CourseMe has approved a new ") + Subject.name + literal(" ") +
+                             Module.material_type +
+                             literal(". This module has now been added to the approved module list for your Institution ") +
+                             Institution.name +
+                             literal(". You can review the list of approved modules and questions on your institution profile page."),
+                             Module.id)
+            question_notify = (Question,
+                               literal("New ") + Subject.name + literal(" question approved by " + self.name),
+                               literal(self.name + " has approved a new ") + Subject.name +
+                               literal(" question. This question has now been added to the approved question list for your Institution ") +
+                               Institution.name +
+                               literal(". You can review the list of approved modules and questions on your institution profile page."),
+                               literal(None, db.Integer))
+        self._approve_all(institution_approved_modules.c.module_id,
+                          select([Module.id]).where(and_(Module.author_id.in_(list(users)), Module.live)), everywhere,
+                          notify=module_notify)
+        self._approve_all(institution_approved_questions.c.question_id,
+                          select([Question.id]).where(Question.author_id.in_(list(users))), everywhere,
+                          notify=question_notify)
+        if commit:
             db.session.commit()
-        else:
-            pass
 
     def add_student(self, user, send_message=True):
         if user:
@@ -1093,31 +1607,87 @@ class Institution(db.Model):
 
     def approve_module(self, module):
         if module and not self.is_approved(module):
-            self.approved_modules.append(module)
-            db.session.add(self)
-            db.session.commit()
-            if self == Institution.main_courseme_institution():  # DJG - all new approvals by CourseMe are pushed out to all institutions
-                for institution in Institution.query.all():
-                    institution.approve_module(module)
-                    Message.AdminMessage(institution.administrator.id,
-                                         subject="New " + module.subject.name + " " + module.material_type + " approved by CourseMe",
-                                         body="CourseMe has approved a new " + module.subject.name + " " + module.material_type + ". This module has now been added to the approved module list for your Institution " + institution.name + ". You can review the list of approved modules and questions on your institution profile page.",
-                                         recommended_material_id=module.id)
+            # DJG - all new approvals by CourseMe are pushed out to all institutions
+            notify = None
+            if self == Institution.main_courseme_institution():
+                notify = (literal("New " + module.subject.name + " " + module.material_type + " approved by CourseMe"),
+                          literal("CourseMe has approved a new " + module.subject.name + " " + module.material_type +
+                                  ". This module has now been added to the approved module list for your Institution ") +
+                          Institution.name +
+                          literal(". You can review the list of approved modules and questions on your institution profile page."))
+            self._approve(institution_approved_modules.c.module_id, module.id, everywhere=notify is not None,
+                          notify=notify, recommended_material_id=module.id)
+            db.session.expire(module, ['approving_institutions'])
 
     def approve_question(self, question, message=True):
         if question and not self.is_approved_question(question):
-            self.approved_questions.append(question)
-            db.session.add(self)
-            db.session.commit()
-            if self == Institution.main_courseme_institution():  # DJG - all new approvals by CourseMe are pushed out to all institutions
-                for institution in Institution.query.all():
-                    institution.approve_question(question)
-                    if message:
-                        Message.AdminMessage(
-                            institution.administrator.id,
-                            subject="New " + question.subject.name + " question approved by " + self.name,
-                            body=self.name + " has approved a new " + question.subject.name + " question. This question has now been added to the approved question list for your Institution " + institution.name + ". You can review the list of approved modules and questions on your institution profile page."
-                        )
+            notify = None
+            if self == Institution.main_courseme_institution():
+                notify = (literal("New " + question.subject.name + " question approved by " + self.name),
+                          literal(self.name + " has approved a new " + question.subject.name +
+                                  " question. This question has now been added to the approved question list for your Institution ") +
+                          Institution.name +
+                          literal(". You can review the list of approved modules and questions on your institution profile page."))
+            self._approve(institution_approved_questions.c.question_id, question.id, everywhere=notify is not None,
+                          notify=notify if message else None)
+            db.session.expire(question, ['approving_institutions'])
+
+    def _approve(self, item_column, item_id, everywhere, notify=None, recommended_material_id=None):
+        """Approve one module or question in a single INSERT ... SELECT.
+
+        Approves it for this institution or, if `everywhere`, for every
+        institution that does not already have it, skipping existing pairs
+        in SQL.  `notify` is a (subject, body) pair of SQL expressions over
+        `Institution`; one admin message per newly approving institution is
+        written with a single INSERT ... SELECT before the approvals, so no
+        institution is told about material it already had.
+        """
+        approvals = item_column.table
+        missing = ~exists().where(and_(approvals.c.institution_id == Institution.id, item_column == item_id))
+        targets = missing if everywhere else and_(missing, Institution.id == self.id)
+        if notify:
+            subject, body = notify
+            Message.AdminMessages(db.session.query(Institution.administrator_id, subject, body)
+                                  .filter(targets).filter(Institution.id != self.id),
+                                  recommended_material_id=recommended_material_id)
+        db.session.execute(approvals.insert().from_select(
+            ['institution_id', item_column.name],
+            select([Institution.id, literal(item_id)]).where(targets)))
+        ApprovedIds.Invalidate()
+        db.session.commit()
+
+    def _approve_all(self, item_column, items, everywhere, notify=None):
+        # DJG - anti-join INSERT ... SELECT of every (institution, item) pair not already approved, without committing.
+        # notify is (model, subject, body, recommended_material_id) of SQL expressions over Institution, the model of
+        # the items and its Subject; one admin message per newly approved pair is queued before the approvals, as in
+        # _approve.
+        approvals = item_column.table
+        items = items.alias()
+        item_id = list(items.c)[0]
+        institution_id = Institution.id if everywhere else literal(self.id)
+        if notify:
+            model, subject, body, recommended = notify
+            Message.AdminMessages(db.session.query(Institution.administrator_id, subject, body, recommended)
+                                  .filter(model.id.in_(select([item_id])))
+                                  .filter(Subject.id == model.subject_id)
+                                  .filter(~exists().where(and_(approvals.c.institution_id == institution_id,
+                                                               item_column == model.id)))
+                                  .filter(Institution.id != self.id))
+        pairs = select([institution_id, item_id]).where(
+            ~exists().where(and_(approvals.c.institution_id == institution_id, item_column == item_id)))
+        if everywhere:
+            pairs = pairs.select_from(Institution.__table__)
+        db.session.execute(approvals.insert().from_select(['institution_id', item_column.name], pairs))
+        ApprovedIds.Invalidate()
+
+    def _copy_approvals(self, other):
+        # DJG - one INSERT ... SELECT per association table, the approved material is never loaded into the session
+        for approvals, item_column in ((institution_approved_modules, institution_approved_modules.c.module_id),
+                                       (institution_approved_questions, institution_approved_questions.c.question_id)):
+            db.session.execute(approvals.insert().from_select(
+                ['institution_id', item_column.name],
+                select([literal(self.id), item_column]).where(approvals.c.institution_id == other.id)))
+        ApprovedIds.Invalidate()
 
     @staticmethod
     def main_courseme_institution():
@@ -1136,22 +1706,238 @@ class Institution(db.Model):
                 blurb=blurb
             )
             db.session.add(institution)
-            db.session.commit()
+            db.session.flush()
             courseme = Institution.main_courseme_institution()  # Initialise an institution to have all of the same approved material as the main CourseMe institution
             if courseme:
-                institution.approved_modules = courseme.approved_modules
-                institution.approved_questions = courseme.approved_questions
-            db.session.add(institution)
+                institution._copy_approvals(courseme)
             db.session.commit()
             institution.add_member(
                 administrator)  # This means that the administrator is a member of the institution and the add_member function will add all of their autgored material to the institution approved list
             return institution
 
 
+
+class ApprovedIds(object):
+    """The ids of the material approved by every one of a set of institutions, cached per process.
+
+    A user's view can be restricted to what their own chosen institution
+    approves and to what the institution they are a student of approves, so
+    the visible material is the intersection of one or two approval lists.
+    Each combination that is asked for is read once with a single query and
+    kept as a sorted `IdSet`, after which visibility checks are a binary
+    search rather than a query.  Anything that changes approvals calls
+    `Invalidate`; the cache is also cleared whenever a session that changed
+    approvals commits, and other processes pick up changes within the TTL of
+    `approved_ids_cache`.
+    """
+
+    @staticmethod
+    def For(item_column, institution_ids):
+        """The `IdSet` of `item_column` values approved by all of `institution_ids`, None if there are none"""
+        if not institution_ids:
+            return None
+        institution_ids = tuple(sorted(set(institution_ids)))
+        return approved_ids_cache.get_or_load((item_column.table.name,) + institution_ids,
+                                              lambda: ApprovedIds._Load(item_column, institution_ids))
+
+    @staticmethod
+    def _Load(item_column, institution_ids):
+        approvals = item_column.table
+        query = db.session.query(item_column).filter(approvals.c.institution_id == institution_ids[0])
+        for institution_id in institution_ids[1:]:
+            other = approvals.alias()
+            query = query.filter(exists().where(and_(other.c.institution_id == institution_id,
+                                                     other.c[item_column.name] == item_column)))
+        return IdSet.from_sorted(id for (id,) in query.distinct().order_by(item_column))
+
+    @staticmethod
+    def Invalidate():
+        approved_ids_cache.clear()
+        db.session.info['approvals_changed'] = True
+
+
+def _approvals_changed(target, value, initiator):
+    ApprovedIds.Invalidate()
+
+
+def _clear_changed_approvals(session):
+    if session.info.pop('approvals_changed', False):
+        approved_ids_cache.clear()
+
+
+def _forget_changed_approvals(session):
+    session.info.pop('approvals_changed', None)
+
+
+# DJG - approvals made through the relationships (e.g. in CreateModule) rather than Institution._approve
+for _attribute in (Institution.approved_modules, Institution.approved_questions):
+    event.listen(_attribute, 'append', _approvals_changed)
+    event.listen(_attribute, 'remove', _approvals_changed)
+event.listen(db.session, 'after_commit', _clear_changed_approvals)
+event.listen(db.session, 'after_rollback', _forget_changed_approvals)
+
+class UserIdentity(object):
+    """Loads the signed in user for Flask-Login from a per-process snapshot.
+
+    The columns most requests need, including the unread message count
+    shown in the navbar, are kept in `user_identity_cache`, keyed by user
+    id.  On a hit the `User` is rebuilt from the snapshot and
+    attached to the session without a query, and any other attribute is
+    loaded from the database when it is first used.  The session's
+    `session_version` must match the snapshot's; if it does not, the user
+    is read again, and a session whose version is out of date is signed
+    out.  ORM updates to a user invalidate the snapshot.  Bulk updates of
+    users call `Invalidate`, `Update` or `AddUnread` themselves.  Other processes see
+    changes within the TTL, which `COURSEME_USER_CACHE_TTL` sets; 0 turns
+    the cache off.
+    """
+
+    COLUMNS = ('id', 'email', 'name', 'role', 'subject_id', 'institution_student_id', 'view_institution_only_id',
+               'session_version', 'last_seen', 'unread_messages')
+
+    @staticmethod
+    def Load(user_id, version=None):
+        user = db.session.identity_map.get(identity_key(User, user_id))
+        if user is None and current_app.config['COURSEME_USER_CACHE_TTL']:
+            snapshot = user_identity_cache.get(user_id)
+            if snapshot is not None and (version is None or snapshot['session_version'] == version):
+                user = User(**snapshot)
+                make_transient_to_detached(user)
+                user = db.session.merge(user, load=False)
+            else:
+                user = User.query.get(user_id)
+                if user is not None:
+                    user_identity_cache.set(user_id, dict((column, getattr(user, column))
+                                                          for column in UserIdentity.COLUMNS))
+        elif user is None:
+            user = User.query.get(user_id)
+        if user is None or (version is not None and user.session_version != version):
+            return None
+        return user
+
+    @staticmethod
+    def Update(user_id, **values):
+        """Change values in the user's snapshot, for writes that will reach the database later"""
+        snapshot = user_identity_cache.get(user_id)
+        if snapshot is not None:
+            snapshot = dict(snapshot)
+            snapshot.update(values)
+            user_identity_cache.set(user_id, snapshot)
+
+    @staticmethod
+    def AddUnread(counts):
+        """Add to the snapshots' unread message counts once the current transaction commits.
+
+        :param counts: dict of user id to the number of messages to add,
+                       negative for messages that have been read.
+        """
+        pending = db.session.info.setdefault('unread_changed', {})
+        for user_id, count in counts.iteritems():
+            pending[user_id] = pending.get(user_id, 0) + count
+
+    @staticmethod
+    def Invalidate(*user_ids):
+        user_identity_cache.invalidate(*user_ids)
+        db.session.info.setdefault('identities_changed', set()).update(user_ids)
+
+    @staticmethod
+    def InvalidateAll():
+        user_identity_cache.clear()
+        db.session.info['all_identities_changed'] = True
+
+
+def _identity_changed(mapper, connection, user):
+    UserIdentity.Invalidate(user.id)
+
+
+def _clear_changed_identities(session):
+    if session.info.pop('all_identities_changed', False):
+        user_identity_cache.clear()
+    user_identity_cache.invalidate(*session.info.pop('identities_changed', ()))
+    for user_id, count in session.info.pop('unread_changed', {}).iteritems():
+        snapshot = user_identity_cache.get(user_id)
+        if snapshot is not None:
+            UserIdentity.Update(user_id, unread_messages=snapshot['unread_messages'] + count)
+
+
+def _forget_changed_identities(session):
+    for key in ('identities_changed', 'all_identities_changed', 'unread_changed'):
+        session.info.pop(key, None)
+
+
+event.listen(User, 'after_update', _identity_changed)
+event.listen(User, 'after_delete', _identity_changed)
+event.listen(db.session, 'after_commit', _clear_changed_identities)
+event.listen(db.session, 'after_rollback', _forget_changed_identities)
+
+
+class ReferenceData(object):
+    """Near-static rows read on most requests, cached per process.
+
+    The subjects for the navbar, the topics of each subject and the id of
+    the main admin user are read once and kept as plain tuples and ids in
+    `reference_cache`, so they can be shared by every request without being
+    tied to a session.  The cache is cleared whenever a session that
+    changed these rows commits, and other processes pick up changes within
+    the TTL of `reference_cache`.
+    """
+
+    @staticmethod
+    def Subjects():
+        return reference_cache.get_or_load('subjects', lambda: [
+            Reference(*row) for row in db.session.query(Subject.id, Subject.name).order_by(Subject.id)])
+
+    @staticmethod
+    def Topics(subject_id):
+        return reference_cache.get_or_load(('topics', subject_id), lambda: [
+            Reference(*row) for row in db.session.query(Topic.id, Topic.name)
+            .filter(Topic.subject_id == subject_id).order_by(Topic.id)])
+
+    @staticmethod
+    def MainAdminId():
+        """The id of the main admin user, None if there is no such user"""
+        def load():
+            row = db.session.query(User.id).filter(User.email == MAIN_ADMIN_EMAIL).first()
+            return row[0] if row else None
+        return reference_cache.get_or_load('main_admin', load)
+
+    @staticmethod
+    def Invalidate():
+        reference_cache.clear()
+        db.session.info['reference_changed'] = True
+
+
+def _reference_changed(mapper, connection, target):
+    ReferenceData.Invalidate()
+
+
+def _admin_changed(mapper, connection, user):
+    if user.email == MAIN_ADMIN_EMAIL or MAIN_ADMIN_EMAIL in db.inspect(user).attrs.email.history.deleted:
+        ReferenceData.Invalidate()
+
+
+def _clear_changed_reference(session):
+    if session.info.pop('reference_changed', False):
+        reference_cache.clear()
+
+
+def _forget_changed_reference(session):
+    session.info.pop('reference_changed', None)
+
+
+for _change in ('after_insert', 'after_update', 'after_delete'):
+    event.listen(Subject, _change, _reference_changed)
+    event.listen(Topic, _change, _reference_changed)
+    event.listen(User, _change, _admin_changed)
+event.listen(db.session, 'after_commit', _clear_changed_reference)
+event.listen(db.session, 'after_rollback', _forget_changed_reference)
+
 question_objectives = db.Table('question_objectives',
                                db.Column('question_id', db.Integer, db.ForeignKey('question.id')),
                                db.Column('objective_id', db.Integer, db.ForeignKey('objective.id'))
 )
+db.Index('ix_question_objectives_question_id_objective_id',
+         question_objectives.c.question_id, question_objectives.c.objective_id)
 
 
 class Question(db.Model):
@@ -1174,26 +1960,43 @@ class Question(db.Model):
                                  # DJG - shouldn't I have  lazy='dynamic', here too?
                                  backref=db.backref('questions', lazy='dynamic'))
 
+    def column_dict(self):
+        return dict((column.name, getattr(self, column.name)) for column in self.__table__.columns)
+
     def as_dict(self, user=None):
-        result = self.__dict__
-        result['topics'] = list(set([o.topic.name for o in
-                                     self.objectives]))  # DJG - put this before the objectives line or the self.objectives becomes the unicode list of objective names and can no longer look up the topic
+        # DJG - for a single question; QuestionService.catalogue serialises lists of questions in a few queries
+        result = self.column_dict()
+        result['topics'] = list(set([o.topic.name for o in self.objectives]))
         result['objectives'] = [o.name for o in self.objectives]
         result['selected'] = 1 if (user and user.is_authenticated() and user.question_selected(self)) else 0
         if (user and user.is_authenticated() and (user.is_enterprise_licenced() or user == self.author ) and bool(
                 self.answer)):  # DJG - bool(answer appears to catch the empty answer cases while still allowing False and 0 as valid answers)
-            result['answer'] = result['answer']
             result['has_answer'] = 1
         else:
             result['answer'] = None
             result['has_answer'] = 0
         result['author'] = self.author.name
-        del result['_sa_instance_state']
         return result
 
     def has_answer(self):
         return bool(self.answer)
 
+    @staticmethod
+    def HasAnswer():
+        """SQL version of `has_answer`"""
+        return and_(Question.answer != None, Question.answer != '')
+
+    @staticmethod
+    def ApprovedBy(institution_id):
+        return exists().where(and_(institution_approved_questions.c.question_id == Question.id,
+                                   institution_approved_questions.c.institution_id == institution_id))
+
+    @staticmethod
+    def InTopic(topic_id):
+        return exists().where(and_(question_objectives.c.question_id == Question.id,
+                                   question_objectives.c.objective_id == Objective.id,
+                                   Objective.topic_id == topic_id))
+
     @staticmethod
     def LiveQuestions():
         return Question.query
@@ -1215,6 +2018,8 @@ class Question(db.Model):
 
             db.session.add(new_question)
             db.session.commit()
+            QuestionSignature.Add(new_question)
+            QuestionSearch.Index(new_question)
 
             for institution in author.member_institutions():
                 institution.approve_question(new_question, message)
@@ -1222,3 +2027,151 @@ class Question(db.Model):
             return new_question
         else:
             return False
+
+
+class QuestionSignature(db.Model):
+    # DJG - MinHash signature of a question's text; questions with the same cluster_id are near-duplicates
+    question_id = db.Column(db.Integer, db.ForeignKey(Question.id), primary_key=True, autoincrement=False)
+    signature = db.Column(db.LargeBinary, nullable=False)
+    cluster_id = db.Column(db.Integer, index=True, nullable=False)
+
+    question = db.relationship(Question)
+
+    @staticmethod
+    def Add(question):
+        """Sign a new or edited question and merge it into the clusters of any near-duplicates.
+
+        Only questions sharing an LSH bucket with the new one are compared,
+        so this does not rebuild anything; see DuplicateService.build for
+        the full batch job.  An edited question first leaves its old cluster.
+        """
+        QuestionSignature.Remove(question.id, commit=False)
+        sig = minhash.signature(question.question)
+        if sig is None:
+            db.session.commit()
+            return None
+        keys = minhash.band_keys(sig)
+        threshold = current_app.config.get('COURSEME_DUPLICATE_THRESHOLD', minhash.DEFAULT_THRESHOLD)
+
+        candidates = db.session.query(QuestionSignature.question_id, QuestionSignature.signature,
+                                      QuestionSignature.cluster_id) \
+            .join(QuestionBand, QuestionBand.question_id == QuestionSignature.question_id) \
+            .filter(or_(*[and_(QuestionBand.band == band, QuestionBand.bucket == key)
+                          for band, key in enumerate(keys)])) \
+            .distinct().all()
+        clusters = set(cluster_id for question_id, data, cluster_id in candidates
+                       if minhash.similarity(sig, minhash.from_bytes(data))[0] >= threshold)
+        cluster_id = min(clusters | set([question.id]))
+        if clusters - set([cluster_id]):
+            db.session.query(QuestionSignature).filter(QuestionSignature.cluster_id.in_(clusters)) \
+                .update({'cluster_id': cluster_id}, synchronize_session=False)
+
+        db.session.execute(QuestionSignature.__table__.insert(),
+                           {'question_id': question.id, 'signature': minhash.to_bytes(sig), 'cluster_id': cluster_id})
+        db.session.execute(QuestionBand.__table__.insert(),
+                           [{'question_id': question.id, 'band': band, 'bucket': key} for band, key in enumerate(keys)])
+        db.session.commit()
+        return cluster_id
+
+    @staticmethod
+    def Remove(question_id, commit=True):
+        cluster_id = db.session.query(QuestionSignature.cluster_id) \
+            .filter(QuestionSignature.question_id == question_id).scalar()
+        db.session.execute(QuestionBand.__table__.delete().where(QuestionBand.question_id == question_id))
+        db.session.execute(QuestionSignature.__table__.delete().where(QuestionSignature.question_id == question_id))
+        if cluster_id is not None:
+            QuestionSignature._Recluster(cluster_id)
+        if commit:
+            db.session.commit()
+
+    @staticmethod
+    def _Recluster(cluster_id):
+        # DJG - the questions left in a cluster may only have been linked through the one that left, so split them
+        # up again the way DuplicateService.build would
+        rows = db.session.query(QuestionSignature.question_id, QuestionSignature.signature) \
+            .filter(QuestionSignature.cluster_id == cluster_id).order_by(QuestionSignature.question_id).all()
+        ids = [question_id for question_id, data in rows]
+        index = dict((question_id, i) for i, question_id in enumerate(ids))
+        buckets = defaultdict(list)
+        for question_id, band, bucket in db.session.query(QuestionBand.question_id, QuestionBand.band,
+                                                          QuestionBand.bucket) \
+                .filter(QuestionBand.question_id.in_(ids)).order_by(QuestionBand.question_id):
+            buckets[(band, bucket)].append(index[question_id])
+        threshold = current_app.config.get('COURSEME_DUPLICATE_THRESHOLD', minhash.DEFAULT_THRESHOLD)
+        roots = minhash.cluster([minhash.from_bytes(data) for question_id, data in rows], buckets.itervalues(),
+                                threshold)
+        changed = [{'_id': question_id, '_cluster_id': ids[roots[i]]}
+                   for i, question_id in enumerate(ids) if ids[roots[i]] != cluster_id]
+        if changed:
+            db.session.execute(QuestionSignature.__table__.update()
+                               .where(QuestionSignature.question_id == bindparam('_id'))
+                               .values(cluster_id=bindparam('_cluster_id')), changed)
+
+
+class QuestionBand(db.Model):
+    # DJG - one row per LSH band of each QuestionSignature, so candidate duplicates are found with an index lookup
+    __table_args__ = (db.Index('ix_question_band_band_bucket', 'band', 'bucket'),)
+    id = db.Column(db.Integer, primary_key=True)
+    question_id = db.Column(db.Integer, db.ForeignKey(Question.id), index=True, nullable=False)
+    band = db.Column(db.SmallInteger, nullable=False)
+    bucket = db.Column(db.BigInteger, nullable=False)
+
+
+# DJG - SQLite FTS5 index of question text with objective and topic names, rowid is the question id. It is a virtual
+# table so it is created by these DDL events (and the migration) rather than as part of the metadata.
+question_search = table('question_search', column('rowid'), column('question'), column('objectives'), column('topics'))
+event.listen(db.metadata, 'after_create', DDL(
+    "CREATE VIRTUAL TABLE IF NOT EXISTS question_search "
+    "USING fts5(question, objectives, topics, tokenize='porter unicode61')").execute_if(dialect='sqlite'))
+event.listen(db.metadata, 'before_drop', DDL("DROP TABLE IF EXISTS question_search").execute_if(dialect='sqlite'))
+
+
+class QuestionSearch(object):
+    """Keeps `question_search` in step with questions, one question at a time"""
+
+    @staticmethod
+    def Available():
+        return db.session.get_bind().dialect.name == 'sqlite'
+
+    @staticmethod
+    def Index(question, commit=True):
+        if not QuestionSearch.Available():
+            return
+        names = db.session.query(Objective.name, Topic.name) \
+            .join(question_objectives, question_objectives.c.objective_id == Objective.id) \
+            .outerjoin(Topic, Topic.id == Objective.topic_id) \
+            .filter(question_objectives.c.question_id == question.id).all()
+        QuestionSearch.Remove(question.id, commit=False)
+        db.session.execute(question_search.insert().values(
+            rowid=question.id,
+            question=Markup(question.question or u'').striptags(),
+            objectives=u' '.join(objective for objective, topic in names),
+            topics=u' '.join(sorted(set(topic for objective, topic in names if topic)))))
+        if commit:
+            db.session.commit()
+
+    @staticmethod
+    def Remove(question_id, commit=True):
+        if not QuestionSearch.Available():
+            return
+        db.session.execute(question_search.delete().where(question_search.c.rowid == question_id))
+        if commit:
+            db.session.commit()
+
+    @staticmethod
+    def Rebuild(chunk_size=1000):
+        """Index every question again, returns the number indexed"""
+        if not QuestionSearch.Available():
+            return 0
+        db.session.execute(question_search.delete())
+        count, last_id = 0, 0
+        while True:
+            questions = Question.query.filter(Question.id > last_id).order_by(Question.id).limit(chunk_size).all()
+            if not questions:
+                break
+            for question in questions:
+                QuestionSearch.Index(question, commit=False)
+            count += len(questions)
+            last_id = questions[-1].id
+        db.session.commit()
+        return count
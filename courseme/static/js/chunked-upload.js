@@ -0,0 +1,70 @@
+// Resumable upload of lecture videos in chunks - see UploadService on the server
+// chunkedUpload_upload(file, moduleId, onProgress) returns a jQuery promise resolved with the completed upload
+
+function chunkedUpload_checksum(blob) {
+    var deferred = $.Deferred();
+    if (!(window.crypto && window.crypto.subtle && window.FileReader)) {
+        return deferred.resolve(null).promise();        //DJG - subtle crypto is only available over https; the server then skips the chunk check
+    }
+    var reader = new FileReader();
+    reader.onload = function() {
+        window.crypto.subtle.digest("SHA-256", reader.result).then(function(hash) {
+            var bytes = new Uint8Array(hash);
+            var hex = "";
+            for (var i = 0; i < bytes.length; i++) {
+                hex += ("0" + bytes[i].toString(16)).slice(-2);
+            }
+            deferred.resolve(hex);
+        }, function() { deferred.resolve(null); });
+    };
+    reader.onerror = function() { deferred.resolve(null); };
+    reader.readAsArrayBuffer(blob);
+    return deferred.promise();
+}
+
+function chunkedUpload_sendFrom(upload, file, offset, onProgress, deferred, retries) {
+    if (offset >= file.size) {
+        $.post(flask_util.url_for('main.lecture_upload_complete', {token: upload.token}))
+            .done(function(json) { deferred.resolve($.parseJSON(json).data); })
+            .fail(function(xhr) { deferred.reject(xhr); });
+        return;
+    }
+    var end = Math.min(offset + upload.chunk_size, file.size);
+    var chunk = file.slice(offset, end);
+    chunkedUpload_checksum(chunk).then(function(checksum) {
+        var headers = {"Content-Range": "bytes " + offset + "-" + (end - 1) + "/" + file.size};
+        if (checksum) { headers["X-Chunk-Checksum"] = checksum; }
+        $.ajax({
+            url: flask_util.url_for('main.lecture_upload_chunk', {token: upload.token}),
+            type: "PUT",
+            data: chunk,
+            processData: false,
+            contentType: "application/octet-stream",
+            headers: headers
+        }).done(function(json) {
+            var received = $.parseJSON(json).data.received;
+            if (onProgress) { onProgress(received, file.size); }
+            chunkedUpload_sendFrom(upload, file, received, onProgress, deferred, 3);
+        }).fail(function(xhr) {
+            if (retries <= 0) { return deferred.reject(xhr); }
+            // Ask the server how much it has and carry on from there
+            $.getJSON(flask_util.url_for('main.lecture_upload_status', {token: upload.token}))
+                .done(function(result) {
+                    chunkedUpload_sendFrom(upload, file, result.data.received, onProgress, deferred, retries - 1);
+                })
+                .fail(function(xhr) { deferred.reject(xhr); });
+        });
+    });
+}
+
+function chunkedUpload_upload(file, moduleId, onProgress) {
+    var deferred = $.Deferred();
+    var data = {filename: file.name, total_size: file.size};
+    if (moduleId) { data.module_id = moduleId; }
+    $.post(flask_util.url_for('main.lecture_upload_start'), data)
+        .done(function(json) {
+            chunkedUpload_sendFrom($.parseJSON(json).data, file, 0, onProgress, deferred, 3);
+        })
+        .fail(function(xhr) { deferred.reject(xhr); });
+    return deferred.promise();
+}
@@ -0,0 +1,28 @@
+// Server-sent events for the signed in user - see courseme/events.py on the server
+// Keeps the unread message badges current and re-triggers each event on the document as "courseme:<event>"
+// with the event's data, so pages can update themselves, e.g. $(document).on('courseme:assessment', ...)
+
+function liveUpdates_setUnread(count) {
+    $(".unread-badge").text(count).toggleClass("hidden", count <= 0);
+}
+
+function liveUpdates_start() {
+    if (!window.EventSource) {
+        return;     //DJG - older browsers just see changes on reload
+    }
+    var source = new EventSource(flask_util.url_for('main.event_stream'));
+    $.each(["message", "read", "assessment", "resync"], function(i, name) {
+        source.addEventListener(name, function(e) {
+            var data = $.parseJSON(e.data);
+            var unread = parseInt($(".unread-badge").first().text(), 10) || 0;
+            if (name == "message") {
+                liveUpdates_setUnread(unread + data.count);
+            } else if (name == "read") {
+                liveUpdates_setUnread(unread - data.count);
+            }
+            $(document).trigger("courseme:" + name, [data]);
+        });
+    });
+}
+
+$(document).ready(liveUpdates_start);
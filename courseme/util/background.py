@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+"""Work that runs outside of the request cycle"""
+
+import atexit
+import threading
+
+from flask import current_app, has_app_context
+
+
+class PeriodicWorker(object):
+    """Runs `run_once` every few seconds on a daemon thread.
+
+    The interval is read from the application config under `interval_key`
+    when the worker is bound with `init_app`.  Each run happens inside an
+    application context so that `db.session` can be used as normal.  An
+    interval of 0 (or None) starts no thread at all; callers are then
+    expected to do the work inline, which is what the tests rely on.
+    A final run happens when the interpreter shuts down.
+    """
+
+    def __init__(self, interval_key):
+        self.interval_key = interval_key
+        self.interval = 0
+        self.app = None
+        self._thread = None
+        self._stopped = threading.Event()
+        atexit.register(self.stop)
+
+    def init_app(self, app):
+        self.app = app
+        self.interval = app.config.get(self.interval_key) or 0
+        if self.interval > 0 and self._thread is None:
+            self._thread = threading.Thread(target=self._loop,
+                                            name=self.__class__.__name__)
+            self._thread.daemon = True
+            self._thread.start()
+
+    def run_once(self):
+        raise NotImplementedError
+
+    def run(self):
+        """Do the work now, inside an application context if bound"""
+        # DJG - reuse the caller's context when inline, popping a new one would remove the caller's session
+        if self.app is None or (has_app_context() and current_app._get_current_object() is self.app):
+            return self.run_once()
+        with self.app.app_context():
+            return self.run_once()
+
+    def stop(self):
+        """Stop the thread and do one last run"""
+        self._stopped.set()
+        # DJG - with no interval the work was done inline, so there is nothing left over
+        if self.app is not None and self.interval:
+            self.run()
+
+    def _loop(self):
+        while not self._stopped.wait(self.interval):
+            try:
+                self.run()
+            except Exception:
+                self.app.logger.exception("%s failed", self.__class__.__name__)
+
+
+class WriteBehindBuffer(PeriodicWorker):
+    """Collects writes in memory and hands them over in batches.
+
+    Writes are keyed, and a write to a key that is already pending is
+    combined with `merge(old, new)`; by default the newest value wins.
+    `flush_func` receives a dict of key to value and should write the lot
+    in a single transaction.  If it raises, the batch is put back so the
+    next flush retries it.
+    """
+
+    def __init__(self, flush_func, interval_key, merge=None):
+        super(WriteBehindBuffer, self).__init__(interval_key)
+        self.flush_func = flush_func
+        self.merge = merge or (lambda old, new: new)
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._pending)
+
+    def put(self, key, value):
+        with self._lock:
+            if key in self._pending:
+                value = self.merge(self._pending[key], value)
+            self._pending[key] = value
+        if not self.interval:
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return
+        try:
+            self.flush_func(pending)
+        except Exception:
+            with self._lock:
+                for key, value in pending.iteritems():
+                    if key in self._pending:
+                        value = self.merge(value, self._pending[key])
+                    self._pending[key] = value
+            raise
+
+    def run_once(self):
+        self.flush()
@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+"""In-process caching"""
+
+import threading
+import time
+
+
+class KeyedCache(object):
+    """A thread-safe dict whose entries expire after `ttl` seconds.
+
+    The cache lives in a single process, so entries can be up to `ttl`
+    seconds stale with respect to writes made by other processes; writes
+    made in this process should call `invalidate`.  Once `max_size` is
+    reached the oldest entries are dropped first.  A value loaded by
+    `get_or_load` is not kept if its key was invalidated while it loaded,
+    as it may have been read from before the change.
+    """
+
+    def __init__(self, ttl=60, max_size=10000):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._entries = {}
+        self._generations = {}      # DJG - bumped by invalidate, so a load that overlaps one is not kept
+        self._cleared = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, default=None):
+        entry = self._entries.get(key)
+        if entry is None or entry[0] < time.time():
+            return default
+        return entry[1]
+
+    def set(self, key, value):
+        with self._lock:
+            self._store(key, value)
+        return value
+
+    def get_or_load(self, key, load):
+        """Return the cached value for `key`, calling `load()` on a miss"""
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] >= time.time():
+            return entry[1]
+        with self._lock:
+            generation = (self._cleared, self._generations.get(key))
+        value = load()
+        with self._lock:
+            if generation == (self._cleared, self._generations.get(key)):
+                self._store(key, value)
+        return value
+
+    def invalidate(self, *keys):
+        with self._lock:
+            for key in keys:
+                self._entries.pop(key, None)
+                self._generations[key] = self._generations.get(key, 0) + 1
+            if len(self._generations) > self.max_size:
+                self._generations.clear()
+                self._cleared += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._generations.clear()
+            self._cleared += 1
+
+    def _store(self, key, value):
+        if len(self._entries) >= self.max_size and key not in self._entries:
+            self._evict()
+        self._entries[key] = (time.time() + self.ttl, value)
+
+    def _evict(self):
+        now = time.time()
+        expired = [k for k, (expires, v) in self._entries.iteritems() if expires < now]
+        for key in expired:
+            del self._entries[key]
+        if len(self._entries) >= self.max_size:
+            oldest = sorted(self._entries, key=lambda k: self._entries[k][0])
+            for key in oldest[:max(1, self.max_size // 10)]:
+                del self._entries[key]
@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+"""MinHash signatures and LSH banding for finding near-duplicate text"""
+
+import hashlib
+import re
+import struct
+import zlib
+
+import numpy as np
+
+NUM_PERM = 128
+BANDS = 16                      # DJG - 16 bands of 8 rows puts the LSH threshold at about (1/16) ** (1/8) = 0.71
+ROWS = NUM_PERM // BANDS
+SHINGLE_SIZE = 5
+DEFAULT_THRESHOLD = 0.8         # estimated Jaccard similarity above which two texts count as duplicates
+
+_PRIME = (1 << 31) - 1
+# DJG - fixed seed so that signatures stored in the database stay comparable between processes and releases
+_random = np.random.RandomState(20150601)
+_A = _random.randint(1, _PRIME, NUM_PERM).astype(np.uint64)
+_B = _random.randint(0, _PRIME, NUM_PERM).astype(np.uint64)
+
+_TAGS = re.compile(r'<[^>]*>')
+_NON_WORD = re.compile(r'[\W_]+', re.UNICODE)
+
+
+def normalise(text):
+    """Lower case words of `text` with markup and punctuation removed"""
+    text = _TAGS.sub(' ', text or u'')
+    return _NON_WORD.sub(' ', text.lower()).strip()
+
+
+def shingles(text):
+    """The set of overlapping character SHINGLE_SIZE-grams of normalised `text`"""
+    text = normalise(text)
+    if len(text) <= SHINGLE_SIZE:
+        return set([text]) if text else set()
+    return set(text[i:i + SHINGLE_SIZE] for i in xrange(len(text) - SHINGLE_SIZE + 1))
+
+
+def signature(text):
+    """The MinHash signature of `text` as a NUM_PERM array of uint32, or None if it has no words.
+
+    Each shingle is hashed with crc32 and put through NUM_PERM universal
+    hash functions (a * x + b) mod p; the signature keeps the minimum of
+    each.  The fraction of positions where two signatures agree estimates
+    the Jaccard similarity of their shingle sets.
+    """
+    shingle_set = shingles(text)
+    if not shingle_set:
+        return None
+    hashes = np.fromiter((zlib.crc32(s.encode('utf-8')) & 0xffffffff for s in shingle_set),
+                         dtype=np.uint64, count=len(shingle_set)) % _PRIME
+    return ((np.outer(hashes, _A) + _B) % _PRIME).min(axis=0).astype(np.uint32)
+
+
+def to_bytes(sig):
+    return sig.astype('<u4').tostring()
+
+
+def from_bytes(data):
+    return np.frombuffer(data, dtype='<u4').astype(np.uint32)
+
+
+def band_keys(sig):
+    """One 64 bit bucket key per band; texts sharing any key are candidate duplicates"""
+    data = to_bytes(sig)
+    width = ROWS * 4
+    return [struct.unpack('<q', hashlib.md5(data[i * width:(i + 1) * width]).digest()[:8])[0]
+            for i in xrange(BANDS)]
+
+
+def similarity(sig, others):
+    """Estimated Jaccard similarity of `sig` with each row of `others`"""
+    return (np.atleast_2d(others) == sig).mean(axis=1)
+
+
+def cluster(signatures, buckets, threshold):
+    """For each of `signatures`, the index of the lowest signature in its cluster.
+
+    `buckets` are lists of indexes of signatures that share an LSH bucket.
+    Only signatures in a common bucket are compared, and those whose
+    estimated similarity reaches `threshold` are joined with union-find.
+    """
+    if not signatures:
+        return []
+    matrix = np.vstack(signatures)
+    parent = range(len(signatures))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    for members in buckets:
+        for position, i in enumerate(members[:-1]):
+            others = members[position + 1:]
+            for j in np.asarray(others)[similarity(matrix[i], matrix[others]) >= threshold]:
+                root_i, root_j = find(i), find(j)
+                if root_i != root_j:
+                    parent[max(root_i, root_j)] = min(root_i, root_j)
+    return [find(i) for i in xrange(len(signatures))]
@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+"""Password hashing off the request thread, and for many users at once"""
+
+import atexit
+import functools
+import multiprocessing
+import os
+import random
+import string
+import threading
+
+from werkzeug.security import generate_password_hash, check_password_hash
+
+POOL_THRESHOLD = 8      # DJG - below this many passwords starting the worker processes costs more than it saves
+TIMEOUT = 30            # DJG - seconds to wait for a worker process before giving up on a hash
+
+_PASSWORD_CHARS = string.ascii_letters + string.digits
+_random = random.SystemRandom()
+
+
+class PasswordHasher(object):
+    """Hashes and checks passwords in a bounded pool of worker processes.
+
+    Password hashes are deliberately slow and hold the interpreter lock
+    while they run.  If they ran on the request threads, a class of
+    students logging in at once would tie up every thread.  Instead
+    `processes` workers do the hashing and the requests wait in turn, so the
+    rest of the site keeps responding.  With no processes the work is done
+    on the calling thread.
+
+    `method` is any werkzeug method, e.g. "pbkdf2:sha256:150000", and is
+    the work factor.  Hashes made with other settings still verify, and
+    `needs_rehash` tells when one should be replaced.  The pool is started
+    by `configure`, so call it (or `init_app`) before starting any other
+    threads; forking while they run can copy a lock another thread holds.
+    `hash_passwords` uses the same pool, so nothing forks once requests are
+    being served.
+    Under gevent (`COURSEME_ASYNC`) the work is always done on the calling
+    greenlet, as the pool's result threads do not mix with a patched
+    process.
+    """
+
+    def __init__(self, method='pbkdf2:sha256', salt_length=8, processes=0):
+        self._pool = None
+        self._lock = threading.Lock()
+        self.configure(method, salt_length, processes)
+        atexit.register(self.close)
+
+    def init_app(self, app):
+        processes = 0 if os.environ.get('COURSEME_ASYNC') else app.config['COURSEME_PASSWORD_PROCESSES']
+        self.configure(app.config['COURSEME_PASSWORD_METHOD'], app.config['COURSEME_PASSWORD_SALT_LENGTH'],
+                       processes)
+
+    def configure(self, method, salt_length, processes):
+        self.close()
+        self.method = method
+        self.salt_length = salt_length
+        self.processes = processes or 0
+        self._prefix = None
+        if self.processes:
+            with self._lock:
+                self._pool = multiprocessing.Pool(self.processes)
+
+    def hash(self, password):
+        return self._call(generate_password_hash, password, self.method, self.salt_length)
+
+    def verify(self, pwhash, password):
+        # DJG - str() as hashlib on python 2 will not take the unicode method name read back from the database
+        return self._call(check_password_hash, str(pwhash), password)
+
+    def needs_rehash(self, pwhash):
+        if self._prefix is None:
+            # DJG - werkzeug fills in the default iterations, so ask it what the prefix of a current hash looks like
+            self._prefix = generate_password_hash('', self.method, self.salt_length).split('$', 1)[0]
+        return pwhash.split('$', 1)[0] != self._prefix
+
+    def hash_function(self):
+        """`generate_password_hash` with the current settings, for `hash_passwords`"""
+        return functools.partial(generate_password_hash, method=self.method, salt_length=self.salt_length)
+
+    def close(self):
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    def _call(self, func, *args):
+        pool = self._pool
+        if pool is None:
+            # DJG - no processes, or closed at exit; a pool is never forked from a request thread
+            return func(*args)
+        return pool.apply_async(func, args).get(TIMEOUT)
+
+
+hasher = PasswordHasher()
+
+
+def hash_passwords(passwords, processes=0):
+    """The hashes of each of `passwords`, in order, with `hasher`'s settings.
+
+    A large batch is spread over `hasher`'s worker processes, or hashed on
+    the calling thread if it has none.  Passing `processes` instead starts a
+    pool of that many processes (None for one per CPU) for the one batch;
+    as that forks, only do it where no other threads are running, e.g. from
+    the command line.
+    """
+    passwords = list(passwords)
+    hash_function = hasher.hash_function()
+    if processes == 0:
+        pool = hasher._pool
+        if pool is None or len(passwords) < POOL_THRESHOLD:
+            return [hash_function(p) for p in passwords]
+        return pool.map(hash_function, passwords, chunksize=_chunksize(passwords, pool))
+    if processes == 1 or len(passwords) < POOL_THRESHOLD:
+        return [hash_function(p) for p in passwords]
+    pool = multiprocessing.Pool(processes)
+    try:
+        return pool.map(hash_function, passwords, chunksize=_chunksize(passwords, pool))
+    finally:
+        pool.close()
+        pool.join()
+
+
+def _chunksize(passwords, pool):
+    return max(1, len(passwords) // (4 * len(pool._pool)))
+
+
+def random_password(length=10):
+    return ''.join(_random.choice(_PASSWORD_CHARS) for _ in xrange(length))
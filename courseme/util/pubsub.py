@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+"""In-process publish/subscribe"""
+
+import threading
+from Queue import Queue, Full, Empty
+
+
+class Subscription(object):
+    """The events published to one channel for one listener.
+
+    Events are held in a bounded queue.  A listener that falls behind does
+    not hold up publishers or grow without limit.  Once its queue is full
+    the subscription is marked `overflowed` and later events are dropped,
+    so the listener should start again from the database.
+    """
+
+    def __init__(self, broker, channel, maxsize):
+        self.broker = broker
+        self.channel = channel
+        self.overflowed = False
+        self._queue = Queue(maxsize)
+
+    def get(self, timeout=None):
+        """The next (event, data), or None if nothing arrives within `timeout` seconds"""
+        try:
+            return self._queue.get(timeout=timeout)
+        except Empty:
+            return None
+
+    def put(self, event, data):
+        try:
+            self._queue.put_nowait((event, data))
+        except Full:
+            self.overflowed = True
+
+    def close(self):
+        self.broker.unsubscribe(self)
+
+
+class Broker(object):
+    """Hands published events to the current subscribers of each channel.
+
+    Publishing never blocks and costs nothing for channels without
+    subscribers.  The broker lives in a single process, so it only reaches
+    listeners connected to the same process as the publisher.
+    """
+
+    def __init__(self, queue_size=50):
+        self.queue_size = queue_size
+        self._channels = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return sum(len(subscriptions) for subscriptions in self._channels.values())
+
+    def subscribe(self, channel, maxsize=None):
+        subscription = Subscription(self, channel, maxsize or self.queue_size)
+        with self._lock:
+            self._channels.setdefault(channel, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscriptions = self._channels.get(subscription.channel)
+            if subscriptions is not None:
+                subscriptions.discard(subscription)
+                if not subscriptions:
+                    del self._channels[subscription.channel]
+
+    def listening(self, channel):
+        return channel in self._channels
+
+    def publish(self, channel, event, data=None):
+        """Send (event, data) to every subscriber of `channel`; returns how many there were"""
+        with self._lock:
+            subscriptions = list(self._channels.get(channel, ()))
+        for subscription in subscriptions:
+            subscription.put(event, data)
+        return len(subscriptions)
@@ -24,6 +24,12 @@ target_metadata = current_app.extensions['migrate'].db.metadata
 # my_important_option = config.get_main_option("my_important_option")
 # ... etc.
 
+def include_object(object, name, type_, reflected, compare_to):
+    # DJG - the question_search FTS5 table and its shadow tables are managed by hand, keep autogenerate away from them
+    if type_ == 'table' and name.startswith('question_search'):
+        return False
+    return True
+
 def run_migrations_offline():
     """Run migrations in 'offline' mode.
 
@@ -57,7 +63,8 @@ def run_migrations_online():
     connection = engine.connect()
     context.configure(
                 connection=connection,
-                target_metadata=target_metadata
+                target_metadata=target_metadata,
+                include_object=include_object
                 )
 
     try:
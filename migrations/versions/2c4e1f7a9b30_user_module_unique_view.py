@@ -0,0 +1,46 @@
+"""unique user_module per user and module for bulk view upserts
+
+Revision ID: 2c4e1f7a9b30
+Revises: 817e8a81d83
+Create Date: 2026-10-19 09:12:41.208000
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '2c4e1f7a9b30'
+down_revision = '817e8a81d83'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    # DJG - UserModule.FindOrCreate could race and write the same user and module twice. Fold each set of
+    # duplicates into the row with the lowest id before the index forbids them: the earliest and latest views, any
+    # star, enrolment or vote, the most recent notes, and live if any of them is live
+    op.execute("UPDATE user_module SET "
+               "first_viewed = (SELECT min(d.first_viewed) FROM user_module d "
+               "WHERE d.user_id = user_module.user_id AND d.module_id = user_module.module_id), "
+               "last_viewed = (SELECT max(d.last_viewed) FROM user_module d "
+               "WHERE d.user_id = user_module.user_id AND d.module_id = user_module.module_id), "
+               "starred = (SELECT max(d.starred) FROM user_module d "
+               "WHERE d.user_id = user_module.user_id AND d.module_id = user_module.module_id), "
+               "enrolled = (SELECT max(d.enrolled) FROM user_module d "
+               "WHERE d.user_id = user_module.user_id AND d.module_id = user_module.module_id), "
+               "vote = (SELECT max(d.vote) FROM user_module d "
+               "WHERE d.user_id = user_module.user_id AND d.module_id = user_module.module_id), "
+               "notes = (SELECT d.notes FROM user_module d "
+               "WHERE d.user_id = user_module.user_id AND d.module_id = user_module.module_id "
+               "AND d.notes IS NOT NULL ORDER BY d.last_viewed DESC, d.id DESC LIMIT 1), "
+               "deleted = (SELECT min(d.deleted) FROM user_module d "
+               "WHERE d.user_id = user_module.user_id AND d.module_id = user_module.module_id) "
+               "WHERE id IN (SELECT min(id) FROM user_module WHERE user_id IS NOT NULL AND module_id IS NOT NULL "
+               "GROUP BY user_id, module_id HAVING count(*) > 1)")
+    op.execute("DELETE FROM user_module WHERE user_id IS NOT NULL AND module_id IS NOT NULL AND id NOT IN "
+               "(SELECT keep FROM (SELECT min(id) AS keep FROM user_module "
+               "WHERE user_id IS NOT NULL AND module_id IS NOT NULL GROUP BY user_id, module_id) AS kept)")
+    op.create_index('ix_user_module_user_id_module_id', 'user_module', ['user_id', 'module_id'], unique=True)
+
+
+def downgrade():
+    op.drop_index('ix_user_module_user_id_module_id', table_name='user_module')
@@ -0,0 +1,22 @@
+"""index user_module on user and most recent view for the recents dropdown
+
+Revision ID: 4b9d2e6c1a07
+Revises: 2c4e1f7a9b30
+Create Date: 2026-10-19 10:02:17.551000
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '4b9d2e6c1a07'
+down_revision = '2c4e1f7a9b30'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.create_index('ix_user_module_user_id_last_viewed', 'user_module', ['user_id', sa.text('last_viewed DESC')])
+
+
+def downgrade():
+    op.drop_index('ix_user_module_user_id_last_viewed', table_name='user_module')
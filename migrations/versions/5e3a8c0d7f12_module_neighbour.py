@@ -0,0 +1,33 @@
+"""module_neighbour table for related material recommendations
+
+Revision ID: 5e3a8c0d7f12
+Revises: 4b9d2e6c1a07
+Create Date: 2026-10-19 11:40:05.873000
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '5e3a8c0d7f12'
+down_revision = '4b9d2e6c1a07'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.create_table('module_neighbour',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('module_id', sa.Integer(), nullable=False),
+    sa.Column('neighbour_id', sa.Integer(), nullable=False),
+    sa.Column('score', sa.Float(), nullable=False),
+    sa.Column('rank', sa.SmallInteger(), nullable=False),
+    sa.ForeignKeyConstraint(['module_id'], ['module.id'], ),
+    sa.ForeignKeyConstraint(['neighbour_id'], ['module.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_module_neighbour_module_id'), 'module_neighbour', ['module_id'], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_module_neighbour_module_id'), table_name='module_neighbour')
+    op.drop_table('module_neighbour')
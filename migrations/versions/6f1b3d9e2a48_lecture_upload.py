@@ -0,0 +1,39 @@
+"""lecture_upload table for resumable chunked uploads
+
+Revision ID: 6f1b3d9e2a48
+Revises: 5e3a8c0d7f12
+Create Date: 2026-10-19 12:25:41.209000
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '6f1b3d9e2a48'
+down_revision = '5e3a8c0d7f12'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.create_table('lecture_upload',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('token', sa.String(length=32), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('module_id', sa.Integer(), nullable=True),
+    sa.Column('filename', sa.String(length=255), nullable=False),
+    sa.Column('total_size', sa.BigInteger(), nullable=False),
+    sa.Column('received', sa.BigInteger(), nullable=False),
+    sa.Column('checksum', sa.String(length=64), nullable=True),
+    sa.Column('material_path', sa.String(length=400), nullable=True),
+    sa.Column('started', sa.DateTime(), nullable=True),
+    sa.Column('completed', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['module_id'], ['module.id'], ),
+    sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_lecture_upload_token'), 'lecture_upload', ['token'], unique=True)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_lecture_upload_token'), table_name='lecture_upload')
+    op.drop_table('lecture_upload')
@@ -0,0 +1,27 @@
+"""indexes for the EXISTS predicates in User.visible_questions
+
+Revision ID: 7a2c4e8f1b53
+Revises: 6f1b3d9e2a48
+Create Date: 2026-10-19 13:02:17.448000
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '7a2c4e8f1b53'
+down_revision = '6f1b3d9e2a48'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.create_index('ix_institution_approved_questions_question_id_institution_id', 'institution_approved_questions',
+                    ['question_id', 'institution_id'], unique=False)
+    op.create_index('ix_question_objectives_question_id_objective_id', 'question_objectives',
+                    ['question_id', 'objective_id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_question_objectives_question_id_objective_id', table_name='question_objectives')
+    op.drop_index('ix_institution_approved_questions_question_id_institution_id',
+                  table_name='institution_approved_questions')
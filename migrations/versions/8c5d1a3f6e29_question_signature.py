@@ -0,0 +1,43 @@
+"""question_signature and question_band tables for near-duplicate detection
+
+Revision ID: 8c5d1a3f6e29
+Revises: 7a2c4e8f1b53
+Create Date: 2026-10-19 14:10:52.611000
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '8c5d1a3f6e29'
+down_revision = '7a2c4e8f1b53'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.create_table('question_signature',
+    sa.Column('question_id', sa.Integer(), autoincrement=False, nullable=False),
+    sa.Column('signature', sa.LargeBinary(), nullable=False),
+    sa.Column('cluster_id', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['question_id'], ['question.id'], ),
+    sa.PrimaryKeyConstraint('question_id')
+    )
+    op.create_index(op.f('ix_question_signature_cluster_id'), 'question_signature', ['cluster_id'], unique=False)
+    op.create_table('question_band',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('question_id', sa.Integer(), nullable=False),
+    sa.Column('band', sa.SmallInteger(), nullable=False),
+    sa.Column('bucket', sa.BigInteger(), nullable=False),
+    sa.ForeignKeyConstraint(['question_id'], ['question.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_question_band_question_id'), 'question_band', ['question_id'], unique=False)
+    op.create_index('ix_question_band_band_bucket', 'question_band', ['band', 'bucket'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_question_band_band_bucket', table_name='question_band')
+    op.drop_index(op.f('ix_question_band_question_id'), table_name='question_band')
+    op.drop_table('question_band')
+    op.drop_index(op.f('ix_question_signature_cluster_id'), table_name='question_signature')
+    op.drop_table('question_signature')
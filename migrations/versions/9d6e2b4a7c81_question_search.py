@@ -0,0 +1,26 @@
+"""question_search full-text index (SQLite FTS5)
+
+Revision ID: 9d6e2b4a7c81
+Revises: 8c5d1a3f6e29
+Create Date: 2026-10-19 14:48:30.106000
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '9d6e2b4a7c81'
+down_revision = '8c5d1a3f6e29'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    # DJG - virtual tables are SQLite only; run "python run.py rebuild_search_index" afterwards to fill it
+    if op.get_bind().dialect.name == 'sqlite':
+        op.execute("CREATE VIRTUAL TABLE IF NOT EXISTS question_search "
+                   "USING fts5(question, objectives, topics, tokenize='porter unicode61')")
+
+
+def downgrade():
+    if op.get_bind().dialect.name == 'sqlite':
+        op.execute("DROP TABLE IF EXISTS question_search")
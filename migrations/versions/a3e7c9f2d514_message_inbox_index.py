@@ -0,0 +1,23 @@
+"""index for keyset pagination of the inbox
+
+Revision ID: a3e7c9f2d514
+Revises: 9d6e2b4a7c81
+Create Date: 2026-10-19 18:31:05.212000
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = 'a3e7c9f2d514'
+down_revision = '9d6e2b4a7c81'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.create_index('ix_message_to_id_deleted_sent', 'message',
+                    ['to_id', 'deleted', sa.text('sent DESC')], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_message_to_id_deleted_sent', table_name='message')
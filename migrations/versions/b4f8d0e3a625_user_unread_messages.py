@@ -0,0 +1,25 @@
+"""unread message counter on user
+
+Revision ID: b4f8d0e3a625
+Revises: a3e7c9f2d514
+Create Date: 2026-10-19 18:52:40.381000
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = 'b4f8d0e3a625'
+down_revision = 'a3e7c9f2d514'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.add_column('user', sa.Column('unread_messages', sa.Integer(), nullable=False, server_default='0'))
+    # DJG - fill it in the same way as "python run.py repair_unread_counts"
+    op.execute("UPDATE user SET unread_messages = "
+               "(SELECT count(*) FROM message WHERE message.to_id = user.id AND message.read IS NULL)")
+
+
+def downgrade():
+    op.drop_column('user', 'unread_messages')
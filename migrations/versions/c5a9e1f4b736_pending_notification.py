@@ -0,0 +1,33 @@
+"""pending_notification queue for notification digests
+
+Revision ID: c5a9e1f4b736
+Revises: b4f8d0e3a625
+Create Date: 2026-10-19 19:14:22.907000
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = 'c5a9e1f4b736'
+down_revision = 'b4f8d0e3a625'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.create_table('pending_notification',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('to_id', sa.Integer(), nullable=False),
+    sa.Column('subject', sa.Text(), nullable=False),
+    sa.Column('body', sa.Text(), nullable=True),
+    sa.Column('recommended_material_id', sa.Integer(), nullable=True),
+    sa.Column('created', sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(['to_id'], ['user.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_pending_notification_to_id'), 'pending_notification', ['to_id'], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_pending_notification_to_id'), table_name='pending_notification')
+    op.drop_table('pending_notification')
@@ -0,0 +1,37 @@
+"""outbox_email queue for the pooled SMTP sender
+
+Revision ID: d6b0f2a5c847
+Revises: c5a9e1f4b736
+Create Date: 2026-10-19 20:02:51.314000
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = 'd6b0f2a5c847'
+down_revision = 'c5a9e1f4b736'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.create_table('outbox_email',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('recipient', sa.String(length=128), nullable=False),
+    sa.Column('sender', sa.String(length=128), nullable=False),
+    sa.Column('subject', sa.String(length=256), nullable=False),
+    sa.Column('body', sa.Text(), nullable=True),
+    sa.Column('html', sa.Text(), nullable=True),
+    sa.Column('created', sa.DateTime(), nullable=False),
+    sa.Column('next_attempt', sa.DateTime(), nullable=True),
+    sa.Column('attempts', sa.Integer(), nullable=False),
+    sa.Column('last_error', sa.String(length=500), nullable=True),
+    sa.Column('sent', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_outbox_email_sent_next_attempt', 'outbox_email', ['sent', 'next_attempt'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_outbox_email_sent_next_attempt', table_name='outbox_email')
+    op.drop_table('outbox_email')
@@ -0,0 +1,22 @@
+"""user.session_version for the cached user loader
+
+Revision ID: e7c1a3b6d958
+Revises: d6b0f2a5c847
+Create Date: 2026-10-19 21:05:37.128000
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = 'e7c1a3b6d958'
+down_revision = 'd6b0f2a5c847'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.add_column('user', sa.Column('session_version', sa.Integer(), nullable=False, server_default='0'))
+
+
+def downgrade():
+    op.drop_column('user', 'session_version')
@@ -1,5 +1,10 @@
 #!flask/bin/python
 import os
+if os.environ.get('COURSEME_ASYNC'):
+    # DJG - must happen before anything else is imported so that threads, queues and sockets all cooperate
+    from gevent import monkey
+    monkey.patch_all()
+
 COV = None
 if os.environ.get('FLASK_COVERAGE'):
     import coverage
@@ -7,7 +12,7 @@ if os.environ.get('FLASK_COVERAGE'):
     COV.start()
 
 from courseme import create_app, db, models
-from flask_script import Manager, Shell
+from flask_script import Manager, Shell, Server
 from flask_migrate import Migrate, MigrateCommand
 
 app = create_app(os.getenv('FLASK_CONFIG') or 'default')
@@ -19,6 +24,8 @@ def make_shell_context():
 
 manager.add_command("shell", Shell(make_context=make_shell_context))
 manager.add_command('db', MigrateCommand)
+# DJG - threaded so that the event stream every signed-in page keeps open does not block the other requests
+manager.add_command('runserver', Server(threaded=True))
 
 # DJG - Run db init, db migrate, db upgrade, test_data when setting up database for first time
 
@@ -43,10 +50,97 @@ def test(coverage=False):
         print('HTML version: file://%s/index.html' % covdir)
         COV.erase()
 
+@manager.command
+def runserver_async(host='127.0.0.1', port=5000):
+    """Serve with gevent, so that pages holding an event stream open do not each tie up a thread."""
+    if not os.environ.get('COURSEME_ASYNC'):
+        import sys
+        os.environ['COURSEME_ASYNC'] = '1'
+        os.execvp(sys.executable, [sys.executable] + sys.argv)
+    from gevent.pywsgi import WSGIServer
+    print('Serving on http://%s:%s' % (host, port))
+    WSGIServer((host, int(port)), app).serve_forever()
+
 @manager.command
 def test_data():
     """Add dummy data for development."""
     import db_data
 
+@manager.command
+def build_recommendations(top_k=10):
+    """Rebuild the related material shown on module pages."""
+    from courseme.main.services import Services
+    written = Services().recommendations.build(top_k=int(top_k))
+    print('%d module neighbours written' % written)
+
+@manager.command
+def find_duplicate_questions():
+    """Recompute question signatures and near-duplicate clusters."""
+    from courseme.main.services import Services
+    clusters = Services().duplicates.build()
+    print('%d clusters of near-duplicate questions' % clusters)
+
+@manager.command
+def rebuild_search_index():
+    """Index every question for full-text search."""
+    print('%d questions indexed' % models.QuestionSearch.Rebuild())
+
+@manager.command
+def send_notification_digests(window=None):
+    """Deliver queued notifications, e.g. from cron when the background worker is turned off."""
+    window = int(window) if window is not None else app.config['COURSEME_DIGEST_WINDOW']
+    print('%d messages delivered' % models.PendingNotification.Flush(window))
+
+@manager.command
+def send_outbox():
+    """Send the queued emails that are due, e.g. from cron when the background worker is turned off."""
+    from courseme.email import outbox
+    print('%d emails sent' % outbox.run())
+
+@manager.command
+def purge_stale_uploads(older_than=None):
+    """Remove lecture uploads that were never finished, e.g. daily from cron."""
+    from courseme.main.services import Services
+    removed = Services().uploads.purge_stale(int(older_than) if older_than else None)
+    print('%d unfinished uploads removed' % removed)
+
+@manager.command
+def repair_unread_counts():
+    """Recount every user's unread messages."""
+    from courseme.main.services import Services
+    print('%d users have unread messages' % Services().messages.repair_unread_counts())
+
+@manager.command
+def import_roster(institution_id, filename, processes=None):
+    """Import a CSV roster of students and tutors into an institution."""
+    import csv
+    import sys
+    from courseme.main.services import Services
+    from courseme.errors import ValidationError
+    institution = models.Institution.query.get(int(institution_id))
+    if institution is None:
+        print('No institution with id %s' % institution_id)
+        return
+    services = Services()
+    with open(filename, 'rb') as f:
+        rows = services.rosters.parse_csv(f)
+    try:
+        # DJG - nothing else runs in this process, so a pool just for the import is safe to fork
+        result = services.rosters.import_roster(institution, rows, institution.administrator,
+                                                processes=int(processes) if processes
+                                                else app.config['COURSEME_HASH_PROCESSES'])
+    except ValidationError, e:
+        for field, error in sorted(e.errors.items()):
+            print('%s: %s' % (field, error))
+        return
+    print('%d users created, %d existing users updated' % (len(result['created']), len(result['updated'])))
+    for email in result['requested']:
+        print('%s belongs to someone outside the institution and was sent a request instead' % email.encode('utf-8'))
+    if result['passwords']:
+        print('Generated passwords:')
+        writer = csv.writer(sys.stdout)
+        for email, password in sorted(result['passwords'].items()):
+            writer.writerow([email.encode('utf-8'), password])
+
 if __name__ == '__main__':
     manager.run()
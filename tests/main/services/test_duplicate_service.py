@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+import unittest
+
+from courseme import create_app, db
+from courseme.main.services import Services
+from courseme.models import User, Subject, Question, QuestionSignature, ROLE_ADMIN
+from courseme.errors import NotAuthorised
+
+TEXTS = [
+    u'A train leaves the station at 9am travelling at 60 miles per hour. When does it arrive 150 miles away?',
+    u'Find the area of a circle with radius 3cm, giving your answer to 1 decimal place.',
+    u'<p>A train leaves the station at 9am travelling at 60 miles per hour. When does it arrive 150 miles away?</p>',
+    u'Name three causes of the First World War.',
+    u'A train leaves the station at 9am, travelling at 60 miles per hour; when does it arrive 150 miles away',
+    u'Find the area of a circle with radius 3cm, giving your answer to 2 decimal places.',
+]
+
+
+class DuplicateServiceTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+
+        self._create_fixtures()
+        self.services = Services()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_build_clusters_near_duplicates(self):
+        self.assertEqual(self.services.duplicates.build(chunk_size=2), 2)
+        clusters = self.services.duplicates.clusters(self.admin)
+        self.assertEqual([[q.id for q in c] for c in clusters],
+                         [[self.questions[0].id, self.questions[2].id, self.questions[4].id],
+                          [self.questions[1].id, self.questions[5].id]])
+
+    def test_new_questions_join_clusters_without_rebuild(self):
+        self.services.duplicates.build()
+        question = Question.CreateQuestion(TEXTS[3] + u' ', None, self.author, self.subject)
+        signature = QuestionSignature.query.get(question.id)
+        self.assertEqual(signature.cluster_id, self.questions[3].id)
+
+    def test_incremental_adds_match_build(self):
+        incremental = dict((s.question_id, s.cluster_id) for s in QuestionSignature.query)
+        self.services.duplicates.build()
+        rebuilt = dict((s.question_id, s.cluster_id) for s in QuestionSignature.query)
+        self.assertEqual(incremental, rebuilt)
+
+    def test_edited_question_leaves_its_cluster(self):
+        # DJG - the first and last questions are only near-duplicates through the middle one
+        text = u'Explain why the sky appears blue during the day but red at sunset, using ideas about scattering.'
+        chain = [Question.CreateQuestion(text + ending, None, self.author, self.subject)
+                 for ending in (u'', u' Show your working.', u' Show your working clearly and fully.')]
+        self.assertEqual(len(set(QuestionSignature.query.get(q.id).cluster_id for q in chain)), 1)
+
+        chain[1].question = u'What is the capital city of Australia, and why was it chosen over Sydney?'
+        db.session.commit()
+        QuestionSignature.Add(chain[1])
+        incremental = dict((s.question_id, s.cluster_id) for s in QuestionSignature.query)
+        self.assertEqual([incremental[q.id] for q in chain], [q.id for q in chain])
+
+        self.services.duplicates.build()
+        rebuilt = dict((s.question_id, s.cluster_id) for s in QuestionSignature.query)
+        self.assertEqual(incremental, rebuilt)
+
+    def test_only_admins_see_clusters(self):
+        self.assertRaises(NotAuthorised, self.services.duplicates.clusters, self.author)
+
+    def _create_fixtures(self):
+        self.subject = Subject(name='Test Subject')
+        self.author = User(name='author', email='author@example.com', subject=self.subject)
+        self.admin = User(name='admin', email='admin@example.com', subject=self.subject, role=ROLE_ADMIN)
+        db.session.add_all([self.subject, self.author, self.admin])
+        db.session.commit()
+        self.questions = [Question.CreateQuestion(text, None, self.author, self.subject) for text in TEXTS]
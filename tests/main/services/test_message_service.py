@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+import unittest
+from datetime import datetime, timedelta
+
+from sqlalchemy import literal
+
+from courseme import create_app, db
+from courseme.main.services import Services
+from courseme.models import User, Message, Group, group_members
+from courseme.errors import ValidationError
+import courseme.util.json as json
+
+
+class InboxTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+
+        self.sender = User(email='sender@example.com', name='sender')
+        self.user = User(email='user@example.com', name='user')
+        db.session.add_all([self.sender, self.user])
+        db.session.commit()
+
+        start = datetime(2014, 1, 1)
+        rows = [dict(from_id=self.sender.id, to_id=self.user.id, subject='message%d' % i,
+                     sent=start + timedelta(hours=i // 2), deleted=None) for i in range(9)]
+        rows[4]['deleted'] = start
+        rows.append(dict(from_id=self.sender.id, to_id=self.user.id, subject='unsent', sent=None, deleted=None))
+        rows.append(dict(from_id=self.user.id, to_id=self.sender.id, subject='elsewhere', sent=start, deleted=None))
+        db.session.execute(Message.__table__.insert(), rows)
+        db.session.commit()
+        self.services = Services()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_pages_cover_live_messages_once_newest_first(self):
+        subjects, before = [], None
+        while True:
+            messages, before = self.services.messages.inbox(self.user, before=before, limit=3)
+            self.assertTrue(len(messages) <= 3)
+            subjects.extend(m.subject for m in messages)
+            if before is None:
+                break
+        self.assertEqual(subjects, [m.subject for m in self.user.live_messages()])
+        self.assertEqual(subjects, ['message8', 'message7', 'message6', 'message5', 'message3', 'message2',
+                                    'message1', 'message0', 'unsent'])
+
+    def test_invalid_cursor(self):
+        self.assertRaises(ValidationError, self.services.messages.inbox, self.user, before='yesterday')
+
+    def test_inbox_endpoint(self):
+        self.app.login_manager.session_protection = None
+        client = self.app.test_client()
+        with client.session_transaction() as session:
+            session['user_id'] = str(self.user.id)
+            session['_fresh'] = True
+
+        first = json.loads(client.get('/inbox?limit=5').data)['data']
+        self.assertEqual([m['subject'] for m in first['messages']],
+                         ['message8', 'message7', 'message6', 'message5', 'message3'])
+        self.assertEqual(first['messages'][0]['from_name'], 'sender')
+        rest = json.loads(client.get('/inbox?limit=5&before=' + first['next']).data)['data']
+        self.assertEqual(len(rest['messages']), 4)
+        self.assertEqual(rest['next'], None)
+
+
+class UnreadCountTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+
+        self.admin = User(email='support@courseme.com', name='support')
+        self.users = [User(email='user%d@example.com' % i, name='user%d' % i) for i in range(3)]
+        db.session.add_all([self.admin] + self.users)
+        db.session.commit()
+        self.services = Services()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_counters_follow_every_way_of_sending(self):
+        self.services.messages.send({'from_id': self.admin.id, 'to_id': self.users[0].id, 'subject': 'hello',
+                                     'recommended_material_id': None, 'assign_objective_id': None,
+                                     'assign_scheme_id': None}, self.admin)
+        Message.AdminMessage(to_id=self.users[0].id, subject='notice')
+        group = Group(name='everyone', creator_id=self.admin.id)
+        db.session.add(group)
+        db.session.commit()
+        db.session.execute(group_members.insert(), [{'group_id': group.id, 'member_id': u.id} for u in self.users])
+        db.session.commit()
+        group.message('broadcast', 'body')
+        Message.AdminMessages(db.session.query(User.id, literal('bulk'), literal('body'))
+                              .filter(User.id.in_([self.users[1].id, self.users[2].id])))
+        db.session.commit()
+
+        self.assertEqual(self._counters(), self._recount())
+        self.assertEqual(self._counters()[self.users[0].id], 3)
+
+    def test_mark_read(self):
+        for i in range(3):
+            Message.AdminMessage(to_id=self.users[0].id, subject='notice%d' % i)
+        ids = [m.id for m in Message.query.order_by(Message.id)]
+
+        self.assertEqual(self.services.messages.mark_read(self.users[0], ids[:2] + [ids[0]]), 2)
+        self.assertEqual(self.services.messages.mark_read(self.users[1], ids), 0)
+        self.assertEqual(User.query.get(self.users[0].id).unread_messages, 1)
+        self.assertEqual(self.services.messages.mark_read(self.users[0]), 1)
+        self.assertEqual(User.query.get(self.users[0].id).unread_messages, 0)
+
+    def test_repair(self):
+        for user in self.users[:2]:
+            Message.AdminMessage(to_id=user.id, subject='notice')
+        db.session.execute(User.__table__.update().values(unread_messages=7))
+        db.session.commit()
+        self.assertEqual(self.services.messages.repair_unread_counts(), 2)
+        self.assertEqual(self._counters(), self._recount())
+
+    def _counters(self):
+        return dict(db.session.query(User.id, User.unread_messages))
+
+    def _recount(self):
+        return dict((u.id, Message.query.filter_by(to_id=u.id, read=None).count()) for u in User.query)
@@ -5,6 +5,8 @@ from courseme import create_app, db
 from courseme.util import merge
 from courseme.main.services import Services
 from courseme.errors import ValidationError
+from courseme.events import broker, user_channel
+from courseme.models import User
 
 class ObjectServiceTestCase(unittest.TestCase):
 
@@ -68,6 +70,21 @@ class ObjectServiceTestCase(unittest.TestCase):
                           self.services.objectives.create,
                           data, self.user)
 
+    def test_assessment_is_published_to_the_student(self):
+        objective = self.services.objectives.create({'name': 'objective-1', 'prerequisites': [],
+                                                     'topic_id': self.topic.id, 'subject_id': self.subject.id},
+                                                    self.user)
+        db.session.add(User(email='support@courseme.com', name='support'))
+        db.session.commit()
+        subscription = broker.subscribe(user_channel(self.user.id))
+        try:
+            state = self.services.objectives.assess(objective.id, self.user.id, self.user.id, self.user)
+            event, data = subscription.get(0)
+        finally:
+            subscription.close()
+        self.assertEqual(event, 'assessment')
+        self.assertEqual(data, merge({'objective_id': objective.id, 'assessor_id': self.user.id}, state))
+
     def _create_fixtures(self):
         # would probably be better that these are created through
         # the service layer as that mimics what the users of the
@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+import random
+import unittest
+
+from courseme import create_app, db
+from courseme.main.services import Services
+from courseme.main.services.paper import CandidatePool
+from courseme.models import User, Subject, Topic, Objective, Question, SchemeOfWork, Institution
+from courseme.errors import ValidationError
+
+
+class CandidatePoolTestCase(unittest.TestCase):
+
+    def test_sample_has_no_repeats(self):
+        pool = CandidatePool([(i, False, 1 + i % 3) for i in range(1000)])
+        rng = random.Random(1)
+        for k in (1, 10, 999, 1000, 1200):
+            sample = pool.sample(False, k, rng)
+            self.assertEqual(len(sample), min(k, 1000))
+            self.assertEqual(len(set(sample)), len(sample))
+
+    def test_single_draw_is_proportional_to_weight(self):
+        weights = [1, 2, 3, 4]
+        pool = CandidatePool([(i, False, w) for i, w in enumerate(weights)] +
+                             [(i, False, 1) for i in range(4, 40)])
+        rng = random.Random(2)
+        draws = 40000
+        counts = [0] * 40
+        for _ in xrange(draws):
+            counts[pool.sample(False, 1, rng)[0]] += 1
+        total = float(sum(weights) + 36)
+        for i, w in enumerate(weights):
+            self.assertAlmostEqual(counts[i] / float(draws), w / total, delta=0.01)
+
+    def test_extension_questions_kept_apart(self):
+        pool = CandidatePool([(1, True, 1), (2, False, 1), (3, None, 1)])
+        self.assertEqual(sorted(pool.sample(True, 5, random.Random())), [1])
+        self.assertEqual(sorted(pool.sample(False, 5, random.Random())), [2, 3])
+        pool = CandidatePool([(1, True, 1), (2, False, 1)], split=False)
+        self.assertEqual(pool.size(False), 2)
+
+
+class PaperServiceTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+
+        self._create_fixtures()
+        self.services = Services()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_paper_only_uses_visible_questions_on_target_objectives(self):
+        target = [self.objectives[0].id, self.objectives[1].id]
+        allowed = set(q.id for q in self.student.visible_questions(subject=False)
+                      if set(o.id for o in q.objectives) & set(target))
+        for paper in self.services.papers.generate_many({'objective_ids': target, 'count': 5}, self.student,
+                                                        papers=50):
+            self.assertEqual(len(paper), 5)
+            self.assertEqual(len(set(paper)), 5)
+            self.assertTrue(set(paper) <= allowed)
+
+    def test_scheme_gives_objectives(self):
+        paper = self.services.papers.generate({'scheme_id': self.scheme.id, 'count': 4}, self.teacher)
+        for question in Question.query.filter(Question.id.in_(paper)):
+            self.assertIn(self.objectives[2], question.objectives)
+
+    def test_extension_mix(self):
+        papers = self.services.papers.generate_many({'count': 8, 'extension': 0.25}, self.teacher, papers=20)
+        extension = set(q.id for q in Question.query.filter_by(extension=True))
+        for paper in papers:
+            self.assertEqual(len(set(paper) & extension), 2)
+            self.assertEqual(len(paper), 8)
+
+    def test_seed_repeats_papers(self):
+        data = {'count': 10, 'seed': '7'}
+        self.assertEqual(self.services.papers.generate_many(data, self.teacher, papers=3),
+                         self.services.papers.generate_many(data, self.teacher, papers=3))
+        self.assertNotEqual(self.services.papers.generate(data, self.teacher),
+                            self.services.papers.generate(dict(data, seed=8), self.teacher))
+
+    def test_year_group_of_papers(self):
+        papers = self.services.papers.generate_many({'count': 20}, self.teacher, papers=500)
+        self.assertEqual(len(papers), 500)
+
+    def test_not_enough_questions(self):
+        self.assertRaises(ValidationError, self.services.papers.generate,
+                          {'objective_ids': [self.objectives[0].id], 'count': 1000}, self.teacher)
+
+    def test_too_many_papers(self):
+        self.assertRaises(ValidationError, self.services.papers.generate_many,
+                          {'count': 1}, self.teacher, papers=501)
+
+    def _create_fixtures(self):
+        rng = random.Random(33)
+        self.subject = Subject(name='Test Subject')
+        db.session.add(self.subject)
+        db.session.commit()
+        topic = Topic(name='topic', subject_id=self.subject.id)
+        db.session.add(topic)
+        db.session.commit()
+        self.objectives = [Objective(name='objective%d' % i, subject_id=self.subject.id, topic_id=topic.id)
+                           for i in range(4)]
+        self.teacher = User(name='teacher', email='teacher@example.com', subject=self.subject)
+        self.student = User(name='student', email='student@example.com', subject=self.subject)
+        db.session.add_all(self.objectives + [self.teacher, self.student])
+        db.session.commit()
+
+        institution = Institution(name='institution', administrator_id=self.teacher.id)
+        self.student.view_institution_only = institution
+        questions = [Question(question='question%d' % i,
+                              subject=self.subject,
+                              author=self.teacher,
+                              extension=i % 4 == 0,
+                              objectives=rng.sample(self.objectives, rng.randint(1, 3))) for i in range(120)]
+        institution.approved_questions.extend(questions[::2])
+        self.scheme = SchemeOfWork(name='scheme', creator_id=self.teacher.id)
+        self.scheme.objectives.append(self.objectives[2])
+        db.session.add_all(questions + [institution, self.scheme])
+        db.session.commit()
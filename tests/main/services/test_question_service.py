@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+import unittest
+
+from sqlalchemy import event
+
+from courseme import create_app, db
+from courseme.main.services import Services
+from courseme.models import User, Subject, Topic, Objective, Question, QuestionSearch
+
+
+class QuestionServiceTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+
+        self._create_fixtures()
+        self.services = Services()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_catalogue_matches_as_dict(self):
+        self.user.select_question(self.questions[1])
+        catalogue = self.services.questions.catalogue(self.questions, self.user)
+        for question, result in zip(self.questions, catalogue):
+            expected = question.as_dict(self.user)
+            self.assertEqual(sorted(result.pop('topics')), sorted(expected.pop('topics')))
+            self.assertEqual(result, expected)
+
+    def test_answers_only_shown_to_author(self):
+        catalogue = self.services.questions.catalogue(self.questions, self.user)
+        self.assertEqual([(r['answer'], r['has_answer']) for r in catalogue],
+                         [(None, 0), ('2', 1), (None, 0), ('4', 1), (None, 0), ('6', 1)])
+        catalogue = self.services.questions.catalogue(self.questions)
+        self.assertEqual(set(r['answer'] for r in catalogue), set([None]))
+
+    def test_questions_are_not_modified(self):
+        self.services.questions.catalogue(self.questions, self.user)
+        self.assertEqual(self.questions[0].objectives, [self.objectives[0]])
+        self.assertTrue(hasattr(self.questions[0], '_sa_instance_state'))
+
+    def test_number_of_queries_does_not_grow_with_questions(self):
+        self.assertEqual(self._count_queries(self.questions[:2]), self._count_queries(self.questions))
+
+    def _count_queries(self, questions):
+        statements = []
+        def count(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+        db.session.expire_all()
+        questions = Question.query.filter(Question.id.in_([q.id for q in questions])).all()
+        event.listen(db.engine, 'before_cursor_execute', count)
+        try:
+            self.services.questions.catalogue(questions, self.user)
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', count)
+        return len(statements)
+
+    def _create_fixtures(self):
+        self.subject = Subject(name='Test Subject')
+        db.session.add(self.subject)
+        db.session.commit()
+        self.topics = [Topic(name='topic%d' % i, subject_id=self.subject.id) for i in range(2)]
+        db.session.add_all(self.topics)
+        db.session.commit()
+        self.objectives = [Objective(name='objective%d' % i, subject_id=self.subject.id, topic_id=self.topics[i % 2].id)
+                           for i in range(3)]
+        self.user = User(name='user', email='user@example.com', subject=self.subject)
+        self.other = User(name='other', email='other@example.com', subject=self.subject)
+        db.session.add_all(self.objectives + [self.user, self.other])
+        db.session.commit()
+        self.questions = [Question(question='question%d' % i,
+                                   answer=str(i + 1),
+                                   subject=self.subject,
+                                   author=self.user if i % 2 else self.other,
+                                   objectives=self.objectives[:i % 3 + 1]) for i in range(6)]
+        db.session.add_all(self.questions)
+        db.session.commit()
+
+
+class QuestionSearchTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+
+        self._create_fixtures()
+        self.services = Services()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_matches_question_objective_and_topic(self):
+        self.assertEqual(self._search(u'triangle'), [self.triangle.id])
+        self.assertEqual(self._search(u'pythagoras'), [self.triangle.id])
+        self.assertEqual(sorted(self._search(u'geometry')), sorted([self.triangle.id, self.circle.id]))
+
+    def test_last_word_matches_prefix(self):
+        self.assertEqual(self._search(u'circ'), [self.circle.id])
+        self.assertEqual(self._search(u'circ area'), [])
+
+    def test_best_match_first(self):
+        self.assertEqual(self._search(u'area'), [self.circle.id, self.square.id])
+
+    def test_only_visible_questions(self):
+        self.student.view_institution_only = self.institution
+        db.session.commit()
+        self.assertEqual(self._search(u'area', self.student), [self.square.id])
+
+    def test_answers_need_licence(self):
+        results = self.services.questions.search(u'triangle', self.student)
+        self.assertEqual(results[0]['answer'], None)
+        results = self.services.questions.search(u'triangle', self.author)
+        self.assertEqual(results[0]['answer'], u'5')
+
+    def test_index_follows_edits_and_deletes(self):
+        self.circle.question = u'What is the circumference of a circle of radius 2?'
+        db.session.commit()
+        QuestionSearch.Index(self.circle)
+        self.assertEqual(self._search(u'circumference'), [self.circle.id])
+        self.assertEqual(self._search(u'area'), [self.square.id])
+
+        QuestionSearch.Remove(self.square.id)
+        self.assertEqual(self._search(u'area'), [])
+
+    def test_rebuild(self):
+        self.assertEqual(QuestionSearch.Rebuild(), 3)
+        self.assertEqual(sorted(self._search(u'geometry')), sorted([self.triangle.id, self.circle.id]))
+
+    def test_search_syntax_is_not_passed_through(self):
+        self.assertEqual(self._search(u'"area" OR NOT (square'), [])
+        self.assertEqual(self.services.questions.search(u' ?! ', self.author), [])
+
+    def _search(self, terms, user=None):
+        return [r['id'] for r in self.services.questions.search(terms, user or self.author)]
+
+    def _create_fixtures(self):
+        from courseme.models import Institution
+        self.subject = Subject(name='Test Subject')
+        db.session.add(self.subject)
+        db.session.commit()
+        topic = Topic(name='Geometry', subject_id=self.subject.id)
+        db.session.add(topic)
+        db.session.commit()
+        pythagoras = Objective(name='Pythagoras theorem', subject_id=self.subject.id, topic_id=topic.id)
+        circles = Objective(name='Circles', subject_id=self.subject.id, topic_id=topic.id)
+        self.author = User(name='author', email='author@example.com', subject=self.subject)
+        self.student = User(name='student', email='student@example.com', subject=self.subject)
+        db.session.add_all([pythagoras, circles, self.author, self.student])
+        db.session.commit()
+
+        self.triangle = Question.CreateQuestion(u'<p>Find the hypotenuse of a right angled triangle with sides 3 and 4.</p>',
+                                                u'5', self.author, self.subject, objectives=[pythagoras])
+        self.circle = Question.CreateQuestion(u'What is the area of a circle with area of radius 2?',
+                                              u'4 pi', self.author, self.subject, objectives=[circles])
+        self.square = Question.CreateQuestion(u'What is the area of a square of side 3?',
+                                              u'9', self.author, self.subject)
+        self.institution = Institution(name='institution', administrator_id=self.author.id)
+        self.institution.approved_questions.append(self.square)
+        db.session.add(self.institution)
+        db.session.commit()
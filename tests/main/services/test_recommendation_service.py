@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+import unittest
+
+from courseme import create_app, db
+from courseme.main.services import Services
+from courseme.models import ModuleNeighbour, UserModule
+
+
+class RecommendationServiceTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+
+        self._create_fixtures()
+        self.services = Services()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_neighbours_ranked_by_co_views(self):
+        self._view(self.users[0], [0, 1])
+        self._view(self.users[1], [0, 1, 2])
+        self._view(self.users[2], [2, 3])
+
+        self.services.recommendations.build(top_k=2, chunk_size=2)
+
+        neighbours = ModuleNeighbour.query.filter_by(module_id=self.modules[0].id) \
+            .order_by(ModuleNeighbour.rank).all()
+        self.assertEqual([n.neighbour_id for n in neighbours],
+                         [self.modules[1].id, self.modules[2].id])
+        self.assertTrue(neighbours[0].score > neighbours[1].score)
+
+    def test_blocks_are_written_as_they_are_computed(self):
+        self._view(self.users[0], [0, 1])
+        self._view(self.users[1], [0, 1, 2])
+        self._view(self.users[2], [2, 3])
+        whole = self.services.recommendations.build(top_k=2)
+        rows = sorted((n.module_id, n.neighbour_id, n.rank) for n in ModuleNeighbour.query)
+
+        self.assertEqual(self.services.recommendations.build(top_k=2, block_size=1), whole)
+        self.assertEqual(sorted((n.module_id, n.neighbour_id, n.rank) for n in ModuleNeighbour.query), rows)
+
+    def test_related_modules_only_include_visible_modules(self):
+        self._view(self.users[0], [0, 1, 2])
+        self._view(self.users[1], [0, 1])
+        self.modules[1].live = False
+        db.session.commit()
+
+        self.services.recommendations.build()
+
+        related = self.services.recommendations.related_modules(self.users[2], self.modules[0])
+        self.assertEqual(related, [self.modules[2]])
+
+    def test_rebuild_replaces_previous_neighbours(self):
+        self._view(self.users[0], [0, 1])
+        self.services.recommendations.build()
+        self.services.recommendations.build()
+        self.assertEqual(ModuleNeighbour.query.count(), 2)
+
+    def _view(self, user, module_indices):
+        for i in module_indices:
+            UserModule.FindOrCreate(user.id, self.modules[i].id)
+
+    def _create_fixtures(self):
+        from courseme.models import User, Subject, Module
+
+        self.subject = Subject(name='Test Subject')
+        self.users = [User(name='user%d' % i,
+                           email='user%d@example.com' % i,
+                           password='secret',
+                           subject=self.subject) for i in range(3)]
+        self.modules = [Module(name='module%d' % i,
+                               author=self.users[0],
+                               subject=self.subject) for i in range(4)]
+        db.session.add(self.subject)
+        db.session.add_all(self.users)
+        db.session.add_all(self.modules)
+        db.session.commit()
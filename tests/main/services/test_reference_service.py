@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+import unittest
+
+from sqlalchemy import event
+
+from courseme import create_app, db
+from courseme.main.services import Services
+from courseme.models import User, Subject, Topic
+
+
+class ReferenceServiceTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        self.maths = Subject(name='Maths')
+        db.session.add_all([self.maths, Topic(name='Fractions', subject=self.maths)])
+        db.session.commit()
+        self.services = Services()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_reads_are_cached(self):
+        self.services.reference.subjects()
+        self.services.reference.topics(self.maths.id)
+        self.services.reference.main_admin_id()
+        self.assertEqual(self._count_statements(lambda: [self.services.reference.subjects(),
+                                                         self.services.reference.topics(self.maths.id),
+                                                         self.services.reference.main_admin_id()]), 0)
+        self.assertEqual([s.name for s in self.services.reference.subjects()], ['Maths'])
+        self.assertEqual(self.services.reference.main_admin_user(), None)
+
+    def test_committed_changes_refresh_the_cache(self):
+        self.assertEqual([t.name for t in self.services.reference.topics(self.maths.id)], ['Fractions'])
+        db.session.add(Topic(name='Decimals', subject=self.maths))
+        db.session.add(Subject(name='Physics'))
+        admin = User(email='support@courseme.com', name='support')
+        db.session.add(admin)
+        db.session.commit()
+        self.assertEqual([t.name for t in self.services.reference.topics(self.maths.id)], ['Fractions', 'Decimals'])
+        self.assertEqual([s.name for s in self.services.reference.subjects()], ['Maths', 'Physics'])
+        self.assertEqual(self.services.reference.main_admin_user(), admin)
+
+        admin.email = 'former@courseme.com'
+        db.session.commit()
+        self.assertEqual(self.services.reference.main_admin_id(), None)
+
+    def test_topic_choices(self):
+        user = User(email='user@example.com', name='user', subject_id=self.maths.id)
+        self.assertEqual(self.services.reference.topic_choices(user),
+                         [("0", ""), (str(self.maths.topics[0].id), 'Fractions')])
+
+    def _count_statements(self, action):
+        statements = []
+
+        def count(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+        event.listen(db.engine, 'before_cursor_execute', count)
+        try:
+            action()
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', count)
+        return len(statements)
@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+import unittest
+from StringIO import StringIO
+
+from sqlalchemy import event
+from werkzeug.security import check_password_hash
+
+from courseme import create_app, db
+from courseme.main.services import Services
+from courseme.models import User, Institution, Message, institution_members
+from courseme.errors import NotAuthorised, ValidationError
+from courseme.util import passwords
+
+ROSTER = """email,username,forename,surname,password,role,tutors
+Ann@School.example,ann,Ann,Smith,,student,tutor@school.example;existing@example.com
+ben@school.example,ann,Ben,Jones,letmein,student,tutor@school.example
+tutor@school.example,mrs t,Teresa,Tutor,,tutor,
+existing@example.com,,,,,student,
+"""
+
+
+class RosterServiceTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+
+        self.admin = User(email='admin@example.com', name='admin')
+        self.existing = User(email='existing@example.com', name='existing')
+        db.session.add_all([self.admin, self.existing])
+        db.session.commit()
+        self.institution = Institution(name='School', administrator_id=self.admin.id)
+        db.session.add(self.institution)
+        db.session.commit()
+        self.services = Services()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_import_creates_and_links_users(self):
+        rows = self.services.rosters.parse_csv(StringIO(ROSTER))
+        result = self.services.rosters.import_roster(self.institution, rows, self.admin, processes=1)
+
+        self.assertEqual(result['created'], ['ann@school.example', 'ben@school.example', 'tutor@school.example'])
+        self.assertEqual(result['updated'], [])
+        self.assertEqual(result['requested'], ['existing@example.com'])
+        self.assertEqual(sorted(result['passwords']), ['ann@school.example', 'tutor@school.example'])
+
+        ann = User.user_by_email('ann@school.example')
+        ben = User.user_by_email('ben@school.example')
+        tutor = User.user_by_email('tutor@school.example')
+        self.assertEqual((ann.name, ben.name), ('ann', 'ann2'))
+        # DJG - str() as hashlib on python 2 will not take the unicode method name read back from the database
+        self.assertTrue(check_password_hash(str(ann.password_hash), result['passwords']['ann@school.example']))
+        self.assertTrue(check_password_hash(str(ben.password_hash), 'letmein'))
+
+        self.assertEqual(sorted(u.email for u in self.institution.students),
+                         ['ann@school.example', 'ben@school.example'])
+        self.assertTrue(tutor.institution_student is None)
+        self.assertTrue(self.institution.is_member(tutor))
+        self.assertEqual(sorted(u.email for u in ann.tutors), ['existing@example.com', 'tutor@school.example'])
+        self.assertEqual([u.email for u in ben.tutors], ['tutor@school.example'])
+
+        summaries = Message.query.filter_by(to_id=self.admin.id).all()
+        self.assertEqual(len(summaries), 1)
+        self.assertTrue('3 students and 1 tutors' in summaries[0].body)
+
+    def test_existing_students_are_updated(self):
+        self.existing.institution_student = self.institution
+        db.session.commit()
+        rows = [{'email': 'existing@example.com', 'tutors': 'admin@example.com'}]
+        result = self.services.rosters.import_roster(self.institution, rows, self.admin, processes=1)
+        self.assertEqual((result['updated'], result['requested']), (['existing@example.com'], []))
+        self.assertEqual([u.email for u in self.existing.tutors], ['admin@example.com'])
+
+    def test_outsiders_are_asked_rather_than_changed(self):
+        outsider = User(email='outsider@example.com', name='outsider')
+        db.session.add(outsider)
+        db.session.commit()
+        rows = [{'email': 'outsider@example.com', 'tutors': 'admin@example.com'},
+                {'email': 'existing@example.com', 'role': 'tutor'}]
+        result = self.services.rosters.import_roster(self.institution, rows, self.admin, processes=1)
+        self.assertEqual(result['requested'], ['outsider@example.com', 'existing@example.com'])
+
+        outsider = User.query.get(outsider.id)
+        self.assertTrue(outsider.institution_student is None)
+        self.assertEqual(outsider.tutors.count(), 0)
+        self.assertFalse(self.institution.is_member(self.existing))
+        messages = Message.query.filter_by(to_id=outsider.id).order_by(Message.id).all()
+        self.assertEqual([(m.from_id, m.request_access) for m in messages],
+                         [(self.admin.id, False), (self.admin.id, True)])
+        self.assertEqual(outsider.unread_messages, 2)
+        self.assertEqual(Message.query.filter_by(to_id=self.existing.id).count(), 1)
+
+    def test_import_hashes_without_forking(self):
+        def fork(*args):
+            raise AssertionError("a request must not start a process pool")
+        original, passwords.multiprocessing.Pool = passwords.multiprocessing.Pool, fork
+        try:
+            result = self.services.rosters.import_roster(
+                self.institution, [{'email': 'student%d@school.example' % i} for i in range(10)], self.admin)
+        finally:
+            passwords.multiprocessing.Pool = original
+        self.assertEqual(len(result['created']), 10)
+
+    def test_import_is_one_transaction(self):
+        commits = []
+
+        def count(session):
+            commits.append(1)
+        event.listen(db.session, 'after_commit', count)
+        try:
+            self.services.rosters.import_roster(self.institution, self.services.rosters.parse_csv(StringIO(ROSTER)),
+                                                self.admin, processes=1)
+        finally:
+            event.remove(db.session, 'after_commit', count)
+        self.assertEqual(len(commits), 1)
+
+    def test_reimport_skips_existing_links(self):
+        rows = self.services.rosters.parse_csv(StringIO(ROSTER))
+        self.services.rosters.import_roster(self.institution, rows, self.admin, processes=1)
+        result = self.services.rosters.import_roster(self.institution, rows, self.admin, processes=1)
+        self.assertEqual(result['created'], [])
+        self.assertEqual(User.user_by_email('ann@school.example').tutors.count(), 2)
+        self.assertEqual(db.session.query(institution_members).count(), 1)
+
+    def test_invalid_rows_are_reported_without_changes(self):
+        rows = [{'email': 'not-an-email'}, {'email': 'a@example.com', 'role': 'parent'},
+                {'email': 'b@example.com', 'tutors': 'nobody@example.com'}]
+        with self.assertRaises(ValidationError) as e:
+            self.services.rosters.import_roster(self.institution, rows, self.admin)
+        self.assertEqual(sorted(e.exception.errors), ['row 1', 'row 2'])
+
+        with self.assertRaises(ValidationError) as e:
+            self.services.rosters.import_roster(self.institution, rows[2:], self.admin)
+        self.assertTrue('tutors' in e.exception.errors)
+        self.assertEqual(User.query.count(), 2)
+
+    def test_only_the_administrator_can_import(self):
+        self.assertRaises(NotAuthorised, self.services.rosters.import_roster,
+                          self.institution, [{'email': 'a@example.com'}], self.existing)
@@ -0,0 +1,181 @@
+# -*- coding: utf-8 -*-
+import hashlib
+import os
+import shutil
+import tempfile
+import unittest
+from datetime import datetime, timedelta
+from StringIO import StringIO
+
+from flask_uploads import configure_uploads
+
+from courseme import create_app, db, lectures
+from courseme.main.services import Services
+from courseme.errors import NotAuthorised, ValidationError
+
+
+class UploadServiceTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.app = create_app('testing')
+        self.folder = tempfile.mkdtemp()
+        self.app.config['UPLOADS_DEFAULT_DEST'] = self.folder
+        self.app.config['COURSEME_UPLOAD_CHUNK_SIZE'] = 4
+        configure_uploads(self.app, lectures)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+
+        self._create_fixtures()
+        self.services = Services()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+        shutil.rmtree(self.folder)
+
+    def test_chunks_are_assembled_and_attached_to_module(self):
+        upload = self._start(module_id=self.module.id)
+        for offset in range(0, len(self.content), 4):
+            chunk = self.content[offset:offset + 4]
+            self.services.uploads.append(upload.token, offset, len(chunk), StringIO(chunk), self.author,
+                                         checksum=hashlib.sha256(chunk).hexdigest())
+
+        upload = self.services.uploads.complete(upload.token, self.author)
+
+        self.assertEqual(upload.material_path, 'lecture.mp4')
+        self.assertEqual(self.module.material_path, 'lecture.mp4')
+        with open(os.path.join(self.folder, 'lectures', 'lecture.mp4'), 'rb') as f:
+            self.assertEqual(f.read(), self.content)
+
+    def test_resume_from_received_offset(self):
+        upload = self._start()
+        self.services.uploads.append(upload.token, 0, 4, StringIO(self.content[:4]), self.author)
+        with self.assertRaises(ValidationError) as context:
+            self.services.uploads.append(upload.token, 8, 2, StringIO(self.content[8:]), self.author)
+        self.assertEqual(context.exception.errors['received'], 4)
+        self.assertEqual(self.services.uploads.status(upload.token, self.author)['received'], 4)
+
+    def test_corrupt_chunk_is_discarded(self):
+        upload = self._start()
+        self.assertRaises(ValidationError, self.services.uploads.append,
+                          upload.token, 0, 4, StringIO(self.content[:4]), self.author, checksum='0' * 64)
+        self.assertEqual(upload.received, 0)
+        self.assertEqual(os.path.getsize(self._partial(upload)), 0)
+
+        upload = self.services.uploads.append(upload.token, 0, 4, StringIO(self.content[:4]), self.author,
+                                              checksum=hashlib.sha256(self.content[:4]).hexdigest())
+        self.assertEqual(upload.received, 4)
+        with open(self._partial(upload), 'rb') as f:
+            self.assertEqual(f.read(), self.content[:4])
+
+    def test_stale_uploads_are_purged(self):
+        stale, fresh = self._start(), self._start()
+        finished = self._start()
+        for offset in range(0, len(self.content), 4):
+            chunk = self.content[offset:offset + 4]
+            self.services.uploads.append(finished.token, offset, len(chunk), StringIO(chunk), self.author)
+        self.services.uploads.complete(finished.token, self.author)
+        for upload in (stale, finished):
+            upload.started = datetime.utcnow() - timedelta(days=30)
+        db.session.commit()
+        stale_path = self._partial(stale)
+
+        self.assertEqual(self.services.uploads.purge_stale(), 1)
+        self.assertFalse(os.path.exists(stale_path))
+        self.assertTrue(os.path.exists(self._partial(fresh)))
+        self.assertEqual(self.services.uploads.by_token(stale.token), None)
+        self.assertTrue(self.services.uploads.by_token(finished.token).completed)
+
+    def test_complete_requires_every_byte(self):
+        upload = self._start()
+        self.services.uploads.append(upload.token, 0, 4, StringIO(self.content[:4]), self.author)
+        self.assertRaises(ValidationError, self.services.uploads.complete, upload.token, self.author)
+
+    def test_name_clash_does_not_overwrite(self):
+        names = []
+        for _ in range(2):
+            upload = self._start()
+            for offset in range(0, len(self.content), 4):
+                chunk = self.content[offset:offset + 4]
+                self.services.uploads.append(upload.token, offset, len(chunk), StringIO(chunk), self.author)
+            names.append(self.services.uploads.complete(upload.token, self.author).material_path)
+        self.assertEqual(len(set(names)), 2)
+
+    def test_only_owner_may_upload(self):
+        upload = self._start()
+        self.assertRaises(NotAuthorised, self.services.uploads.append,
+                          upload.token, 0, 4, StringIO(self.content[:4]), self.other)
+
+    def test_unsupported_file_type(self):
+        self.assertRaises(ValidationError, self.services.uploads.start,
+                          {'filename': 'lecture.exe', 'total_size': 10}, self.author)
+
+    def test_lecture_file_requires_visibility(self):
+        self._upload_to_module()
+        self.assertEqual(self.services.uploads.lecture_file(self.module, self.author),
+                         os.path.join(self.folder, 'lectures', 'lecture.mp4'))
+        self.other.view_institution_only = self.institution
+        self.assertRaises(NotAuthorised, self.services.uploads.lecture_file, self.module, self.other)
+
+    def test_lecture_is_served_by_range(self):
+        self._upload_to_module()
+        client = self._client(self.other)
+
+        url = '/module/{}/lecture'.format(self.module.id)
+        response = client.get(url, headers={'Range': 'bytes=2-5'})
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response.data, self.content[2:6])
+        self.assertEqual(response.headers['Content-Range'], 'bytes 2-5/10')
+        self.assertIn('private', response.headers['Cache-Control'])
+
+        response = client.get(url, headers={'If-None-Match': response.headers['ETag']})
+        self.assertEqual(response.status_code, 304)
+
+    def test_lecture_served_by_front_end(self):
+        self._upload_to_module()
+        self.app.config['COURSEME_LECTURE_ACCEL_PREFIX'] = '/protected-lectures/'
+        client = self._client(self.author)
+
+        response = client.get('/module/{}/lecture'.format(self.module.id))
+        self.assertEqual(response.headers['X-Accel-Redirect'], '/protected-lectures/lecture.mp4')
+        self.assertEqual(response.data, b'')
+
+    def _client(self, user):
+        self.app.login_manager.session_protection = None
+        client = self.app.test_client()
+        with client.session_transaction() as session:
+            session['user_id'] = str(user.id)
+            session['_fresh'] = True
+        return client
+
+    def _upload_to_module(self):
+        upload = self._start(module_id=self.module.id)
+        for offset in range(0, len(self.content), 4):
+            chunk = self.content[offset:offset + 4]
+            self.services.uploads.append(upload.token, offset, len(chunk), StringIO(chunk), self.author)
+        self.services.uploads.complete(upload.token, self.author)
+        self.module.live = True
+        db.session.commit()
+
+    def _start(self, **data):
+        data.update(filename='lecture.mp4', total_size=len(self.content))
+        return self.services.uploads.start(data, self.author)
+
+    def _partial(self, upload):
+        return os.path.join(self.folder, 'lectures', '.partial', upload.token)
+
+    def _create_fixtures(self):
+        from courseme.models import User, Subject, Module, Institution
+
+        self.content = b'0123456789'
+        self.subject = Subject(name='Test Subject')
+        self.author = User(name='author', email='author@example.com', password='secret', subject=self.subject)
+        self.other = User(name='other', email='other@example.com', password='secret', subject=self.subject)
+        self.module = Module(name='module', author=self.author, subject=self.subject)
+        db.session.add_all([self.subject, self.author, self.other, self.module])
+        db.session.commit()
+        self.institution = Institution(name='institution', administrator_id=self.author.id)
+        db.session.add(self.institution)
+        db.session.commit()
@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+import asyncore
+import smtpd
+import socket
+import threading
+import unittest
+from datetime import datetime, timedelta
+
+from courseme import create_app, db
+from courseme.email import send_email, outbox
+from courseme.models import User, OutboxEmail
+
+
+class _RecordingServer(smtpd.SMTPServer):
+    # DJG - a local stand-in for the SMTP server that remembers what it was sent
+
+    def __init__(self, *args):
+        smtpd.SMTPServer.__init__(self, *args)
+        self.received = []
+        self.rejected = set()
+        self.connections = 0
+
+    def handle_accept(self):
+        self.connections += 1
+        smtpd.SMTPServer.handle_accept(self)
+
+    def process_message(self, peer, mailfrom, rcpttos, data):
+        if self.rejected.intersection(rcpttos):
+            return '554 Message rejected'
+        self.received.extend(rcpttos)
+
+
+def _free_port():
+    s = socket.socket()
+    s.bind(('localhost', 0))
+    port = s.getsockname()[1]
+    s.close()
+    return port
+
+
+class OutboxTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        self.user = User(email='teacher@example.com', name='teacher')
+        db.session.add(self.user)
+        db.session.commit()
+
+        self.port = _free_port()
+        state = self.app.extensions['mail']
+        state.suppress, state.server, state.port, state.use_tls = False, 'localhost', self.port, False
+        # DJG - queue emails rather than send them inline, without starting the outbox thread
+        outbox.interval = 60
+        self.server = None
+
+    def tearDown(self):
+        outbox.interval = 0
+        if self.server is not None:
+            self.server.close()
+            self.thread.join(5)
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_send_email_only_queues(self):
+        self.app.config['COURSEME_MAIL_FLUSH_INTERVAL'] = 60
+        email = send_email('student@example.com', 'Invitation email', 'mail/invitation_email', user=self.user)
+        self.assertEqual(email.recipient, 'student@example.com')
+        self.assertEqual(email.subject, '[CourseMe] Invitation email')
+        self.assertEqual(OutboxEmail.query.filter(OutboxEmail.sent == None).count(), 1)
+
+    def test_batch_is_sent_over_pooled_connections(self):
+        self._start_server()
+        for i in range(7):
+            send_email('student%d@example.com' % i, 'Invitation email', 'mail/invitation_email', user=self.user)
+
+        self.assertEqual(outbox.run(), 7)
+        self.assertEqual(sorted(self.server.received), sorted('student%d@example.com' % i for i in range(7)))
+        self.assertTrue(self.server.connections <= self.app.config['COURSEME_MAIL_WORKERS'])
+        self.assertEqual(OutboxEmail.query.filter(OutboxEmail.sent == None).count(), 0)
+        self.assertEqual(outbox.run(), 0)
+
+    def test_failures_are_retried_with_backoff(self):
+        send_email('student@example.com', 'Invitation email', 'mail/invitation_email', user=self.user)
+        self.assertEqual(outbox.run(), 0)
+
+        email = OutboxEmail.query.one()
+        self.assertEqual(email.attempts, 1)
+        self.assertTrue(email.last_error)
+        self.assertTrue(email.next_attempt > datetime.utcnow())
+        self.assertEqual(outbox.run(), 0)
+
+        email.next_attempt = datetime.utcnow()
+        db.session.commit()
+        self._start_server()
+        self.assertEqual(outbox.run(), 1)
+        self.assertEqual(self.server.received, ['student@example.com'])
+
+    def test_rejected_message_does_not_fail_the_rest(self):
+        self._start_server()
+        self.server.rejected.add('student0@example.com')
+        self.app.config['COURSEME_MAIL_WORKERS'] = 1
+        for i in range(3):
+            send_email('student%d@example.com' % i, 'Invitation email', 'mail/invitation_email', user=self.user)
+
+        self.assertEqual(outbox.run(), 2)
+        self.assertEqual(sorted(self.server.received), ['student1@example.com', 'student2@example.com'])
+        rejected = OutboxEmail.query.filter(OutboxEmail.sent == None).one()
+        self.assertEqual((rejected.recipient, rejected.attempts), ('student0@example.com', 1))
+        self.assertTrue('SMTPDataError' in rejected.last_error)
+
+    def test_old_emails_are_purged(self):
+        self._start_server()
+        for i in range(3):
+            send_email('student%d@example.com' % i, 'Invitation email', 'mail/invitation_email', user=self.user)
+        self.assertEqual(outbox.run(), 3)
+        old, recent, abandoned = OutboxEmail.query.order_by(OutboxEmail.id).all()
+        old.sent = datetime.utcnow() - timedelta(days=30)
+        abandoned.sent, abandoned.next_attempt = None, None
+        abandoned.attempts = self.app.config['COURSEME_MAIL_MAX_ATTEMPTS']
+        abandoned.created = datetime.utcnow() - timedelta(days=30)
+        db.session.commit()
+
+        self.assertEqual(outbox.run(), 0)
+        self.assertEqual([email.recipient for email in OutboxEmail.query], ['student1@example.com'])
+
+    def _start_server(self):
+        self.server = _RecordingServer(('localhost', self.port), None)
+        self.thread = threading.Thread(target=asyncore.loop, kwargs={'timeout': 0.1})
+        self.thread.daemon = True
+        self.thread.start()
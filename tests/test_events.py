@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+import unittest
+
+from courseme import create_app, db
+from courseme.events import broker, user_channel, publish_after_commit
+from courseme.main.services import Services
+from courseme.models import User, Group, group_members
+
+
+class EventsTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app.config['COURSEME_EVENTS_HEARTBEAT'] = 0.05
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        self.sender = User(email='sender@example.com', name='sender')
+        self.users = [User(email='user%d@example.com' % i, name='user%d' % i) for i in range(2)]
+        db.session.add_all([self.sender] + self.users)
+        db.session.commit()
+        self.subscriptions = [broker.subscribe(user_channel(u.id)) for u in self.users]
+        self.services = Services()
+
+    def tearDown(self):
+        for subscription in self.subscriptions:
+            subscription.close()
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_published_on_commit_and_dropped_on_rollback(self):
+        publish_after_commit(self.users[0].id, 'message', {'count': 1})
+        self.assertEqual(self.subscriptions[0].get(0), None)
+        db.session.commit()
+        self.assertEqual(self.subscriptions[0].get(0), ('message', {'count': 1}))
+
+        publish_after_commit(self.users[0].id, 'message', {'count': 1})
+        db.session.rollback()
+        db.session.commit()
+        self.assertEqual(self.subscriptions[0].get(0), None)
+
+    def test_sending_messages_publishes_to_recipients(self):
+        self.services.messages.send({'from_id': self.sender.id, 'to_id': self.users[0].id, 'subject': 'hello',
+                                     'recommended_material_id': None, 'assign_objective_id': None,
+                                     'assign_scheme_id': None}, self.sender)
+        self.assertEqual(self.subscriptions[0].get(0), ('message', {'count': 1, 'subject': 'hello'}))
+
+        group = Group(name='everyone', creator_id=self.sender.id)
+        db.session.add(group)
+        db.session.commit()
+        db.session.execute(group_members.insert(), [{'group_id': group.id, 'member_id': u.id} for u in self.users])
+        db.session.commit()
+        group.message('broadcast', 'body')
+        for subscription in self.subscriptions:
+            self.assertEqual(subscription.get(0), ('message', {'count': 1, 'subject': 'broadcast'}))
+            self.assertEqual(subscription.get(0), None)
+
+        self.services.messages.mark_read(self.users[1])
+        self.assertEqual(self.subscriptions[1].get(0), ('read', {'count': 1}))
+
+    def test_event_stream(self):
+        self.app.login_manager.session_protection = None
+        client = self.app.test_client()
+        with client.session_transaction() as session:
+            session['user_id'] = str(self.users[0].id)
+            session['_fresh'] = True
+
+        response = client.get('/events', buffered=False)
+        self.assertEqual(response.mimetype, 'text/event-stream')
+        chunks = iter(response.response)
+        self.assertEqual(next(chunks), 'retry: 5000\n\n')
+        self.assertEqual(next(chunks), ': heartbeat\n\n')
+        broker.publish(user_channel(self.users[0].id), 'message', {'count': 2})
+        self.assertEqual(next(chunks), 'event: message\ndata: {"count":2}\n\n')
+
+        for i in range(broker.queue_size + 1):
+            broker.publish(user_channel(self.users[0].id), 'message', {'count': 1})
+        self.assertEqual(next(chunks), 'event: resync\ndata: {}\n\n')
+        self.assertRaises(StopIteration, next, chunks)
+        self.assertEqual(len(broker), len(self.subscriptions))
@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+import unittest
+
+from sqlalchemy import event
+
+from courseme import create_app, db
+from courseme.models import User, Subject, Module, Group, Message, group_members
+
+
+class GroupMessageTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+
+        self.teacher = User(email='teacher@example.com', name='teacher')
+        self.students = [User(email='student%d@example.com' % i, name='student%d' % i) for i in range(5)]
+        db.session.add_all([self.teacher] + self.students)
+        db.session.commit()
+        self.group = Group(name='Year 9', creator_id=self.teacher.id)
+        db.session.add(self.group)
+        db.session.commit()
+        db.session.execute(group_members.insert(),
+                           [{'group_id': self.group.id, 'member_id': s.id} for s in self.students[:3]])
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_message_reaches_every_member(self):
+        subject = Subject(name='Maths')
+        module = Module(name='Fractions', author=self.teacher, subject=subject)
+        db.session.add(module)
+        db.session.commit()
+
+        self.assertEqual(self.group.message('Homework', 'Watch this', recommended_material=module,
+                                            request_access=True), 3)
+        messages = Message.query.order_by(Message.to_id).all()
+        self.assertEqual([m.to_id for m in messages], [s.id for s in self.students[:3]])
+        for m in messages:
+            self.assertEqual((m.from_id, m.subject, m.body), (self.teacher.id, 'Homework', 'Watch this'))
+            self.assertEqual(m.recommended_material_id, module.id)
+            self.assertTrue(m.request_access)
+            self.assertTrue(m.sent is not None)
+
+    def test_statements_do_not_grow_with_members(self):
+        few = self._count_statements(lambda: self.group.message('One', 'body'))
+        db.session.execute(group_members.insert(),
+                           [{'group_id': self.group.id, 'member_id': s.id} for s in self.students[3:]])
+        db.session.commit()
+        self.assertEqual(self._count_statements(lambda: self.group.message('Two', 'body')), few)
+        self.assertEqual(Message.query.filter_by(subject='Two').count(), 5)
+
+    def _count_statements(self, action):
+        statements = []
+
+        def count(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+        event.listen(db.engine, 'before_cursor_execute', count)
+        try:
+            action()
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', count)
+        return len(statements)
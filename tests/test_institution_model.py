@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+import unittest
+
+from sqlalchemy import event
+
+from courseme import create_app, db
+from courseme.models import User, Subject, Module, Question, Institution, Message, \
+    institution_approved_modules, institution_approved_questions
+
+
+class InstitutionApprovalTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        self._create_fixtures()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_courseme_approval_reaches_every_institution(self):
+        self.schools[0].approve_module(self.module)
+        self.courseme.approve_module(self.module)
+
+        pairs = db.session.query(institution_approved_modules.c.institution_id) \
+            .filter(institution_approved_modules.c.module_id == self.module.id).all()
+        self.assertEqual(sorted(id for (id,) in pairs), sorted(i.id for i in [self.courseme] + self.schools))
+
+        messages = Message.query.filter(Message.recommended_material_id == self.module.id).all()
+        self.assertEqual(sorted(m.to_id for m in messages), sorted(a.id for a in self.administrators[2:]))
+        for message in messages:
+            self.assertEqual(message.from_id, self.support.id)
+            self.assertIn(Institution.query.filter_by(administrator_id=message.to_id).one().name, message.body)
+        self.assertEqual(len(self.module.approving_institutions), len(self.schools) + 1)
+
+    def test_school_approval_stays_in_school(self):
+        self.schools[0].approve_question(self.question)
+        self.assertEqual([i.id for i in self.question.approving_institutions], [self.schools[0].id])
+        self.assertEqual(Message.query.count(), 0)
+
+    def test_approval_without_messages(self):
+        self.courseme.approve_question(self.question, message=False)
+        self.assertEqual(len(self.question.approving_institutions), len(self.schools) + 1)
+        self.assertEqual(Message.query.count(), 0)
+
+    def test_approving_twice_changes_nothing(self):
+        self.courseme.approve_question(self.question)
+        messages = Message.query.count()
+        self.courseme.approve_question(self.question)
+        self.assertEqual(db.session.query(institution_approved_questions).count(), len(self.schools) + 1)
+        self.assertEqual(Message.query.count(), messages)
+
+    def test_statements_do_not_grow_with_institutions(self):
+        few = self._count_statements(lambda: self.courseme.approve_question(self.question))
+        db.session.add_all(Institution(name='late%d' % i, administrator_id=self.support.id) for i in range(20))
+        db.session.commit()
+        other = Question(question='another', subject=self.subject, author=self.support)
+        db.session.add(other)
+        db.session.commit()
+        self.assertEqual(self._count_statements(lambda: self.courseme.approve_question(other)), few)
+
+    def test_new_institution_copies_courseme_approvals(self):
+        self.courseme.approve_module(self.module)
+        self.courseme.approve_question(self.question, message=False)
+        institution = Institution.create('new school', self.administrators[1])
+        self.assertEqual(institution.approved_modules.all(), [self.module])
+        self.assertEqual(institution.approved_questions.all(), [self.question])
+
+    def test_creating_institution_does_not_load_catalogue(self):
+        few = self._count_statements(lambda: Institution.create('first', self.administrators[1]))
+        modules = [Module(name='module%d' % i, author=self.support, subject=self.subject) for i in range(30)]
+        db.session.add_all(modules)
+        db.session.commit()
+        for module in modules:
+            self.courseme.approved_modules.append(module)
+        db.session.commit()
+        self.assertEqual(self._count_statements(lambda: Institution.create('second', self.administrators[2])), few)
+        self.assertEqual(Institution.query.filter_by(name='second').one().approved_modules.count(), 30)
+
+    def test_add_member_approves_authored_material(self):
+        teacher = self.administrators[1]
+        draft = Module(name='draft', author=teacher, subject=self.subject, live=False)
+        live = Module(name='live', author=teacher, subject=self.subject, live=True)
+        question = Question(question='mine', subject=self.subject, author=teacher)
+        db.session.add_all([draft, live, question])
+        db.session.commit()
+        self.schools[1].approve_module(live)
+
+        self.schools[1].add_member(teacher)
+        self.schools[1].add_member(teacher)
+
+        self.assertEqual(self.schools[1].approved_modules.all(), [live])
+        self.assertEqual(self.schools[1].approved_questions.all(), [question])
+        self.assertEqual(self.schools[1].members.all(), [teacher])
+        self.assertEqual(Message.query.filter_by(to_id=teacher.id).count(), 1)
+
+    def test_add_members_in_one_transaction(self):
+        staff = [User(name='staff%d' % i, email='staff%d@example.com' % i) for i in range(10)]
+        db.session.add_all(staff)
+        db.session.commit()
+        db.session.add_all(Question(question='q%d' % i, subject=self.subject, author=user) for i, user in enumerate(staff))
+        db.session.commit()
+
+        commits = []
+        def count(session):
+            commits.append(session)
+        event.listen(db.session, 'after_commit', count)
+        try:
+            self.schools[0].add_members(staff + [staff[0], None])
+        finally:
+            event.remove(db.session, 'after_commit', count)
+
+        self.assertEqual(len(commits), 1)
+        self.assertEqual(self.schools[0].members.count(), 10)
+        self.assertEqual(self.schools[0].approved_questions.count(), 10)
+
+    def test_courseme_members_material_goes_everywhere(self):
+        self.courseme.add_member(self.support)
+        self.assertEqual(len(self.question.approving_institutions), len(self.schools) + 1)
+
+    def test_courseme_members_material_is_announced(self):
+        self.schools[0].approve_module(self.module)
+        self.courseme.add_member(self.support)
+
+        messages = Message.query.filter(Message.recommended_material_id == self.module.id).all()
+        self.assertEqual(sorted(m.to_id for m in messages), sorted(a.id for a in self.administrators[2:]))
+        for message in messages:
+            self.assertEqual(message.subject, "New Maths Lecture approved by CourseMe")
+            self.assertIn(Institution.query.filter_by(administrator_id=message.to_id).one().name, message.body)
+        questions = Message.query.filter(Message.subject == "New Maths question approved by CourseMe").all()
+        self.assertEqual(sorted(m.to_id for m in questions), sorted(a.id for a in self.administrators[1:]))
+
+    def _count_statements(self, action):
+        statements = []
+        def count(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+        event.listen(db.engine, 'before_cursor_execute', count)
+        try:
+            action()
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', count)
+        return len(statements)
+
+    def _create_fixtures(self):
+        self.subject = Subject(name='Maths')
+        self.support = User(name='support', email='support@courseme.com', subject=self.subject)
+        self.administrators = [self.support] + [User(name='admin%d' % i, email='admin%d@example.com' % i)
+                                                for i in range(4)]
+        db.session.add_all([self.subject] + self.administrators)
+        db.session.commit()
+        self.courseme = Institution(name='CourseMe', administrator_id=self.support.id)
+        db.session.add(self.courseme)
+        db.session.commit()
+        self.schools = [Institution(name='school%d' % i, administrator_id=admin.id)
+                        for i, admin in enumerate(self.administrators[1:])]
+        self.module = Module(name='module', author=self.support, subject=self.subject, material_type='Lecture')
+        self.question = Question(question='question', subject=self.subject, author=self.support)
+        db.session.add_all(self.schools + [self.module, self.question])
+        db.session.commit()
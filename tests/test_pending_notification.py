@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+import unittest
+from datetime import datetime, timedelta
+
+from sqlalchemy import literal
+
+from courseme import create_app, db
+from courseme.models import User, Message, PendingNotification, notification_digests
+
+
+class NotificationDigestTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+
+        self.admin = User(email='support@courseme.com', name='support')
+        self.users = [User(email='user%d@example.com' % i, name='user%d' % i) for i in range(3)]
+        db.session.add_all([self.admin] + self.users)
+        db.session.commit()
+        # DJG - queue rather than deliver at once as the testing config does, without starting the thread
+        notification_digests.interval = 60
+
+    def tearDown(self):
+        notification_digests.interval = 0
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_notifications_are_queued(self):
+        Message.AdminMessage(to_id=self.users[0].id, subject='one')
+        Message.AdminMessages(db.session.query(User.id, literal('bulk'), literal('body'))
+                              .filter(User.id != self.admin.id))
+        db.session.commit()
+        self.assertEqual(Message.query.count(), 0)
+        self.assertEqual(PendingNotification.query.count(), 4)
+
+    def test_digest_per_recipient(self):
+        Message.AdminMessage(to_id=self.users[0].id, subject='first', body='body', recommended_material_id=5)
+        Message.AdminMessage(to_id=self.users[0].id, subject='second')
+        Message.AdminMessage(to_id=self.users[1].id, subject='only', recommended_material_id=5)
+        self._age(seconds=120)
+
+        self.assertEqual(PendingNotification.Flush(60), 2)
+        self.assertEqual(PendingNotification.query.count(), 0)
+        digest = Message.query.filter_by(to_id=self.users[0].id).one()
+        self.assertEqual(digest.subject, '2 new notifications from CourseMe')
+        self.assertEqual(digest.body, 'first\nbody\n\nsecond')
+        self.assertEqual(digest.from_id, self.admin.id)
+        single = Message.query.filter_by(to_id=self.users[1].id).one()
+        self.assertEqual((single.subject, single.recommended_material_id), ('only', 5))
+        self.assertEqual(User.query.get(self.users[0].id).unread_messages, 1)
+
+    def test_recent_notifications_wait_for_the_window(self):
+        Message.AdminMessage(to_id=self.users[0].id, subject='old')
+        self._age(seconds=120)
+        Message.AdminMessage(to_id=self.users[0].id, subject='new')
+        Message.AdminMessage(to_id=self.users[1].id, subject='new')
+
+        self.assertEqual(PendingNotification.Flush(60), 1)
+        self.assertEqual([m.subject for m in Message.query], ['2 new notifications from CourseMe'])
+        self.assertEqual(PendingNotification.query.one().to_id, self.users[1].id)
+
+    def test_window_of_zero_delivers_each_notification(self):
+        for subject in ('a', 'b'):
+            Message.AdminMessage(to_id=self.users[0].id, subject=subject)
+        self.assertEqual(PendingNotification.Flush(0), 2)
+        self.assertEqual(sorted(m.subject for m in Message.query), ['a', 'b'])
+
+    def test_without_digests_messages_join_the_callers_transaction(self):
+        notification_digests.interval = 0
+        self.users[0].name = 'renamed'
+        Message.AdminMessages(db.session.query(User.id, literal('bulk'), literal('body'))
+                              .filter(User.id != self.admin.id))
+        db.session.rollback()
+        self.assertEqual(Message.query.count(), 0)
+        self.assertEqual(User.query.get(self.users[0].id).name, 'user0')
+
+        self.users[0].name = 'renamed'
+        Message.AdminMessages(db.session.query(User.id, literal('bulk'), literal('body'))
+                              .filter(User.id != self.admin.id))
+        db.session.commit()
+        self.assertEqual(User.query.get(self.users[0].id).name, 'renamed')
+        self.assertEqual(PendingNotification.query.count(), 0)
+        self.assertEqual(sorted(m.to_id for m in Message.query), sorted(u.id for u in self.users))
+        self.assertEqual(Message.query.first().from_id, self.admin.id)
+        self.assertEqual(User.query.get(self.users[1].id).unread_messages, 1)
+
+    def _age(self, seconds):
+        table = PendingNotification.__table__
+        db.session.execute(table.update().values(created=datetime.utcnow() - timedelta(seconds=seconds)))
+        db.session.commit()
@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+import unittest
+from datetime import datetime, timedelta
+
+from sqlalchemy import event
+
+from courseme import create_app, db
+from courseme.models import User, Subject, Module, UserModule, RecentModule
+
+
+class RecentModulesTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+
+        self.user = User(email='student@example.com', name='student')
+        self.author = User(email='author@example.com', name='author')
+        subject = Subject(name='Maths')
+        db.session.add_all([self.user, self.author, subject])
+        db.session.commit()
+        types = ['Lecture', 'Exercise', 'Lecture', 'Course', 'Lecture', 'Exercise']
+        self.modules = [Module(name='module%d' % i, material_type=t, author_id=self.author.id,
+                               subject_id=subject.id) for i, t in enumerate(types)]
+        self.modules[4].live = False
+        db.session.add_all(self.modules)
+        db.session.commit()
+        # DJG - module i was last viewed i hours after the start, so later modules are more recent
+        self.start = datetime(2014, 1, 1)
+        UserModule.record_views(dict(((self.user.id, m.id), (self.start, self.start + timedelta(hours=i)))
+                                     for i, m in enumerate(self.modules)))
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_newest_live_modules_first(self):
+        self.assertEqual([m.name for m in self.user.recent_modules(3)], ['module5', 'module3', 'module2'])
+        self.assertEqual(self.user.recent_modules(1)[0], RecentModule(self.modules[5].id, 'module5', 'Exercise'))
+        self.assertEqual(len(self.user.recent_modules(10)), 5)
+
+    def test_split_by_material_type(self):
+        recent = self.user.recent_modules_by_type(2)
+        self.assertEqual(list(recent), ['Course', 'Lecture', 'Exercise'])
+        self.assertEqual([m.name for m in recent['Lecture']], ['module2', 'module0'])
+        self.assertEqual([m.name for m in recent['Exercise']], ['module5', 'module1'])
+        self.assertEqual([m.name for m in recent['Course']], ['module3'])
+
+    def test_cached_until_the_user_views_a_module(self):
+        self.user.recent_modules(3)
+        self.assertEqual(self._count_statements(lambda: self.user.recent_modules_by_type(3)), 0)
+
+        UserModule.record_views({(self.user.id, self.modules[0].id): (self.start, self.start + timedelta(days=1))})
+        self.assertEqual(self.user.recent_modules(1)[0].name, 'module0')
+
+        UserModule.FindOrCreate(self.user.id, self.modules[1].id)
+        self.assertEqual(self.user.recent_modules(1)[0].name, 'module1')
+
+    def _count_statements(self, action):
+        statements = []
+
+        def count(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+        event.listen(db.engine, 'before_cursor_execute', count)
+        try:
+            action()
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', count)
+        return len(statements)
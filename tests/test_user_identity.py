@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+import unittest
+from datetime import datetime
+
+from sqlalchemy import event
+
+from courseme import create_app, db
+from courseme.main.services import Services
+from courseme.models import User, Message, UserIdentity, ROLE_ADMIN
+
+
+class UserIdentityTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        user = User(email='user@example.com', name='user')
+        db.session.add(user)
+        db.session.commit()
+        self.id = user.id
+        self.session_id = user.get_id()
+        db.session.remove()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_snapshot_loads_without_a_query(self):
+        self.assertEqual(self._load().email, 'user@example.com')
+        db.session.remove()
+        statements = self._statements(self._load)
+        self.assertEqual(statements, [])
+        user = self._load()
+        self.assertEqual((user.id, user.name, user.role, user.unread_messages), (self.id, 'user', 0, 0))
+        self.assertEqual(len(self._statements(lambda: user.blurb)), 1)
+
+    def test_changes_invalidate_the_snapshot(self):
+        self._load()
+        db.session.remove()
+        user = self._load()
+        user.role = ROLE_ADMIN
+        db.session.commit()
+        db.session.remove()
+        self.assertEqual(self._load().role, ROLE_ADMIN)
+
+    def test_password_change_signs_out_other_sessions(self):
+        user = self._load()
+        user.password = 'new password'
+        db.session.commit()
+        db.session.remove()
+        self.assertEqual(self._load(), None)
+        self.assertEqual(self.app.login_manager.user_callback(User.query.get(self.id).get_id()).id, self.id)
+        self.assertEqual(self.app.login_manager.user_callback(unicode(self.id)).id, self.id)
+
+    def test_unread_count_follows_the_snapshot(self):
+        self._load()
+        db.session.remove()
+        db.session.add(Message(to_id=self.id, subject='hello', body='', sent=datetime.utcnow()))
+        db.session.commit()
+        db.session.remove()
+        self.assertEqual(self._statements(lambda: self.assertEqual(self._load().unread_messages, 1)), [])
+
+        Services().messages.mark_read(self._load())
+        db.session.remove()
+        self.assertEqual(self._statements(lambda: self.assertEqual(self._load().unread_messages, 0)), [])
+
+    def test_page_render_does_not_reload_the_user(self):
+        self.app.login_manager.session_protection = None
+        client = self.app.test_client()
+        with client.session_transaction() as session:
+            session['user_id'] = self.session_id
+            session['_fresh'] = True
+        client.get('/messages')
+
+        statements = self._statements(lambda: self.assertEqual(client.get('/messages').status_code, 200))
+        self.assertEqual([s for s in statements if 'WHERE user.id = ?' in s], [])
+        self.assertEqual(len(self._statements(lambda: client.get('/messages'))), len(statements))
+
+    def test_cache_can_be_turned_off(self):
+        self.app.config['COURSEME_USER_CACHE_TTL'] = 0
+        self._load()
+        db.session.remove()
+        self.assertEqual(len(self._statements(self._load)), 1)
+
+    def _load(self):
+        return self.app.login_manager.user_callback(self.session_id)
+
+    def _statements(self, action):
+        statements = []
+
+        def count(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+        event.listen(db.engine, 'before_cursor_execute', count)
+        try:
+            action()
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', count)
+        return statements
@@ -1,6 +1,8 @@
 import unittest
 import time
-from courseme.models import User
+from datetime import timedelta
+from werkzeug.security import generate_password_hash
+from courseme.models import User, user_last_seen
 from courseme import create_app, db
 
 class UserModelTestCase(unittest.TestCase):
@@ -77,3 +79,45 @@ class UserModelTestCase(unittest.TestCase):
         self.assertTrue(u2.verify_password('dog'))
 
 
+
+    def test_make_unique_usernames(self):
+        db.session.add_all([User(email='bob@server.fake', name='bob'),
+                            User(email='bob2@server.fake', name='bob2'),
+                            User(email='bo_b@server.fake', name='bo_b')])
+        db.session.commit()
+        self.assertEqual(User.make_unique_usernames(['bob', 'alice', 'bob', 'alice', 'bo%']),
+                         ['bob3', 'alice', 'bob4', 'alice2', 'bo%'])
+        self.assertEqual(User.make_unique_username('bob'), 'bob3')
+
+    def test_last_seen_is_written_at_most_once_per_resolution(self):
+        u = User(email='user8@server.fake', name='user')
+        db.session.add(u)
+        db.session.commit()
+        start = u.last_seen + timedelta(hours=1)
+        u.seen(start)
+        u.seen(start + timedelta(seconds=30))
+        self.assertEqual(User.query.get(u.id).last_seen, start)
+
+        user_last_seen.interval = 60
+        try:
+            later = start + timedelta(seconds=self.app.config['COURSEME_LAST_SEEN_RESOLUTION'])
+            u.seen(later)
+            self.assertEqual(u.last_seen, later)
+            self.assertEqual(len(user_last_seen), 1)
+            user_last_seen.flush()
+        finally:
+            user_last_seen.interval = 0
+        db.session.expire_all()
+        self.assertEqual(User.query.get(u.id).last_seen, later)
+
+    def test_login_replaces_hashes_made_with_old_settings(self):
+        u = User(email='user9@server.fake', name='user')
+        u.password_hash = generate_password_hash('cat', 'pbkdf2:sha256:500')
+        db.session.add(u)
+        db.session.commit()
+        self.assertFalse(u.check_login('dog'))
+        self.assertTrue(u.password_hash.startswith('pbkdf2:sha256:500$'))
+        self.assertTrue(u.check_login('cat'))
+        self.assertTrue(u.password_hash.startswith(self.app.config['COURSEME_PASSWORD_METHOD'] + '$'))
+        db.session.commit()
+        self.assertTrue(User.query.get(u.id).check_login('cat'))
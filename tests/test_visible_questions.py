@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+import itertools
+import random
+import unittest
+
+from courseme import create_app, db
+from courseme.models import User, Subject, Topic, Objective, Question, Institution
+
+
+class VisibleQuestionsTestCase(unittest.TestCase):
+    """`User.visible_questions` against a plain Python reading of the rules"""
+
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        self._create_fixtures(random.Random(31))
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_matches_reference_for_every_option(self):
+        for user in self.users:
+            for restricted, authored, subject, answers in itertools.product([True, False], repeat=4):
+                for topic in [None, self.topics[0], self.topics[1]]:
+                    options = dict(restricted=restricted, authored=authored, subject=subject,
+                                   topic=topic, answers=answers)
+                    self.assertEqual(self._ids(user.visible_questions(**options)),
+                                     self._reference(user, **options),
+                                     "%s %r" % (user.name, options))
+
+    def test_matches_previous_compound_query(self):
+        for user in self.users:
+            for restricted, authored, subject in itertools.product([True, False], repeat=3):
+                self.assertEqual(self._ids(user.visible_questions(restricted=restricted, authored=authored,
+                                                                  subject=subject)),
+                                 self._ids(self._compound_query(user, restricted, authored, subject)))
+
+    def test_questions_are_not_repeated(self):
+        for user in self.users:
+            questions = user.visible_questions(subject=False).all()
+            self.assertEqual(len(questions), len(set(questions)))
+
+    def test_can_view_question_matches_visible_questions(self):
+        for user in self.users:
+            visible = set(self._ids(user.visible_questions(subject=False)))
+            for question in self.questions:
+                self.assertEqual(user.can_view_question(question), question.id in visible,
+                                 "%s question%d" % (user.name, question.id))
+
+    def test_restricted_ids_follow_approvals(self):
+        user = [u for u in self.users if u.view_institution_only and u.institution_student and
+                u.institution_student.view_institution_only != u.view_institution_only and
+                u.institution_student.view_institution_only][0]
+        institution = user.view_institution_only
+        before = user.restricted_question_ids()
+        self.assertEqual(sorted(before), self._reference(user, True, False, False, None, False))
+
+        question = [q for q in self.questions if q.id not in before and q.author_id != user.id][0]
+        for approving in (user.institution_student.view_institution_only, institution):
+            approving.approve_question(question, message=False)
+        self.assertTrue(question.id in user.restricted_question_ids())
+        self.assertTrue(user.can_view_question(question))
+
+        institution.approved_questions.remove(question)
+        db.session.commit()
+        self.assertFalse(user.can_view_question(question))
+
+    def _ids(self, query):
+        return sorted(q.id for q in query)
+
+    def _reference(self, user, restricted, authored, subject, topic, answers):
+        institutions = [i for i in [user.view_institution_only,
+                                    user.institution_student and user.institution_student.view_institution_only] if i]
+        ids = []
+        for q in self.questions:
+            passes_restriction = restricted and all(q.id in self.approved[i.id] for i in institutions)
+            if not (passes_restriction or (authored and q.author_id == user.id)):
+                continue
+            if subject and user.subject_id and q.subject_id != user.subject_id:
+                continue
+            if topic and topic.id not in self.question_topics[q.id]:
+                continue
+            if answers and not q.has_answer():
+                continue
+            ids.append(q.id)
+        return sorted(ids)
+
+    def _compound_query(self, user, restricted, authored, subject):
+        # DJG - how visible_questions used to be built, without the topic and answer options which did not work
+        institution_student = user.institution_student
+        if institution_student and institution_student.view_institution_only:
+            query_student = institution_student.view_institution_only.approved_questions
+        else:
+            query_student = Question.query
+        if user.view_institution_only:
+            query_select = user.view_institution_only.approved_questions
+        else:
+            query_select = Question.query
+        query_restricted = query_select.intersect(query_student) if restricted else Question.query.filter(1 == 0)
+        query_authored = user.questions_authored if authored else Question.query.filter(1 == 0)
+        query_subject = user.subject.questions if subject and user.subject else Question.query
+        return query_restricted.union(query_authored).intersect(Question.query, query_subject)
+
+    def _create_fixtures(self, rng):
+        self.subjects = [Subject(name='subject%d' % i) for i in range(2)]
+        db.session.add_all(self.subjects)
+        db.session.commit()
+        self.topics = [Topic(name='topic%d' % i, subject_id=self.subjects[i % 2].id) for i in range(4)]
+        db.session.add_all(self.topics)
+        db.session.commit()
+        objectives = [Objective(name='objective%d' % i, subject_id=self.topics[i % 4].subject_id,
+                                topic_id=self.topics[i % 4].id) for i in range(8)]
+        db.session.add_all(objectives)
+
+        authors = [User(name='author%d' % i, email='author%d@example.com' % i,
+                        subject=self.subjects[i % 2]) for i in range(3)]
+        db.session.add_all(authors)
+        db.session.commit()
+
+        institutions = [Institution(name='institution%d' % i, administrator_id=authors[0].id) for i in range(3)]
+        institutions[2].view_institution_only = institutions[0]
+        db.session.add_all(institutions)
+        db.session.commit()
+
+        self.questions = []
+        for i in range(60):
+            subject = rng.choice(self.subjects)
+            question = Question(question='question%d' % i,
+                                answer=rng.choice([None, '', 'answer']),
+                                subject=subject,
+                                author=rng.choice(authors),
+                                objectives=rng.sample([o for o in objectives if o.subject_id == subject.id],
+                                                      rng.randint(0, 2)))
+            for institution in institutions:
+                if rng.random() < 0.5:
+                    institution.approved_questions.append(question)
+            self.questions.append(question)
+        db.session.add_all(self.questions)
+        db.session.commit()
+        self.approved = dict((i.id, set(q.id for q in i.approved_questions)) for i in institutions)
+        self.question_topics = dict((q.id, set(o.topic_id for o in q.objectives)) for q in self.questions)
+
+        self.users = list(authors)
+        for i, (view_only, student_of) in enumerate(itertools.product([None] + institutions[:2],
+                                                                      [None, institutions[1], institutions[2]])):
+            user = User(name='user%d' % i, email='user%d@example.com' % i,
+                        subject=self.subjects[i % 2] if i % 3 else None)
+            user.view_institution_only = view_only
+            user.institution_student = student_of
+            self.users.append(user)
+        db.session.add_all(self.users)
+        db.session.commit()
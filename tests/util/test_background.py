@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+
+from courseme.util.background import WriteBehindBuffer
+
+
+class WriteBehindBufferTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.flushed = []
+        self.buffer = WriteBehindBuffer(self.flushed.append, 'UNUSED_INTERVAL',
+                                        merge=lambda old, new: (old[0], new[1]))
+        self.buffer.interval = 60
+
+    def test_writes_are_held_until_flush(self):
+        self.buffer.put('a', (1, 1))
+        self.assertEqual(self.flushed, [])
+        self.buffer.flush()
+        self.assertEqual(self.flushed, [{'a': (1, 1)}])
+
+    def test_writes_to_the_same_key_are_merged(self):
+        self.buffer.put('a', (1, 1))
+        self.buffer.put('a', (2, 2))
+        self.buffer.put('b', (3, 3))
+        self.buffer.flush()
+        self.assertEqual(self.flushed, [{'a': (1, 2), 'b': (3, 3)}])
+
+    def test_empty_buffer_does_not_flush(self):
+        self.buffer.flush()
+        self.assertEqual(self.flushed, [])
+
+    def test_failed_flush_is_retried(self):
+        def fail(pending):
+            raise RuntimeError
+        self.buffer.flush_func = fail
+        self.buffer.put('a', (1, 1))
+        self.assertRaises(RuntimeError, self.buffer.flush)
+        self.buffer.put('a', (2, 2))
+        self.buffer.flush_func = self.flushed.append
+        self.buffer.flush()
+        self.assertEqual(self.flushed, [{'a': (1, 2)}])
+
+    def test_zero_interval_writes_through(self):
+        self.buffer.interval = 0
+        self.buffer.put('a', (1, 1))
+        self.assertEqual(self.flushed, [{'a': (1, 1)}])
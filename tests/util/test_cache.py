@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+
+from courseme.util.cache import KeyedCache
+
+
+class KeyedCacheTestCase(unittest.TestCase):
+
+    def test_get_or_load_only_loads_on_a_miss(self):
+        cache = KeyedCache()
+        loads = []
+
+        def load():
+            loads.append(1)
+            return 'value'
+
+        self.assertEqual(cache.get_or_load('a', load), 'value')
+        self.assertEqual(cache.get_or_load('a', load), 'value')
+        self.assertEqual(len(loads), 1)
+
+    def test_invalidate(self):
+        cache = KeyedCache()
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.invalidate('a')
+        self.assertEqual(cache.get('a'), None)
+        self.assertEqual(cache.get('b'), 2)
+
+    def test_load_overlapping_an_invalidation_is_not_kept(self):
+        cache = KeyedCache()
+
+        def stale_load():
+            cache.invalidate('a')
+            return 'stale'
+
+        def stale_clear():
+            cache.clear()
+            return 'stale'
+
+        self.assertEqual(cache.get_or_load('a', stale_load), 'stale')
+        self.assertEqual(cache.get('a'), None)
+        self.assertEqual(cache.get_or_load('a', stale_clear), 'stale')
+        self.assertEqual(cache.get('a'), None)
+        self.assertEqual(cache.get_or_load('a', lambda: 'fresh'), 'fresh')
+        self.assertEqual(cache.get('a'), 'fresh')
+
+    def test_entries_expire(self):
+        cache = KeyedCache(ttl=-1)
+        cache.set('a', 1)
+        self.assertEqual(cache.get('a', 'missing'), 'missing')
+
+    def test_size_is_bounded(self):
+        cache = KeyedCache(max_size=10)
+        for i in range(100):
+            cache.set(i, i)
+        self.assertTrue(len(cache) <= 10)
+        self.assertEqual(cache.get(99), 99)
@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+
+from courseme.util.idset import IdSet
+
+
+class IdSetTestCase(unittest.TestCase):
+
+    def test_membership(self):
+        ids = IdSet([9, 3, 3, 27, 1])
+        self.assertEqual(list(ids), [1, 3, 9, 27])
+        self.assertTrue(3 in ids)
+        self.assertTrue(27 in ids)
+        self.assertFalse(4 in ids)
+        self.assertFalse(100 in ids)
+        self.assertFalse(1 in IdSet())
+
+    def test_intersection(self):
+        self.assertEqual(IdSet([1, 2, 3, 5, 8]).intersection(IdSet([2, 4, 8, 16])), IdSet([2, 8]))
+        self.assertEqual(len(IdSet([1, 2]).intersection(IdSet())), 0)
+
+    def test_filter_keeps_order(self):
+        self.assertEqual(IdSet([2, 4, 6]).filter([6, 5, 4, 1, 2]), [6, 4, 2])
+
@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+
+from courseme.util import minhash
+
+
+class MinHashTestCase(unittest.TestCase):
+
+    def test_normalise_drops_markup_and_punctuation(self):
+        self.assertEqual(minhash.normalise(u'<p>Solve  x^2 = 4,</p> for X!'), u'solve x 2 4 for x')
+
+    def test_identical_text_after_normalising(self):
+        a = minhash.signature(u'Solve x^2 = 4 for x.')
+        b = minhash.signature(u'<b>solve</b> X^2=4  for x')
+        self.assertEqual(minhash.similarity(a, b)[0], 1.0)
+        self.assertEqual(minhash.band_keys(a), minhash.band_keys(b))
+
+    def test_similarity_estimates_jaccard(self):
+        a = u'A train leaves the station at 9am travelling at 60 miles per hour towards the coast.'
+        b = u'A train leaves the station at 10am travelling at 60 miles per hour towards the coast.'
+        sa, sb = minhash.shingles(a), minhash.shingles(b)
+        jaccard = len(sa & sb) / float(len(sa | sb))
+        estimate = minhash.similarity(minhash.signature(a), minhash.signature(b))[0]
+        self.assertAlmostEqual(estimate, jaccard, delta=0.12)
+
+    def test_unrelated_text_shares_no_band(self):
+        a = minhash.signature(u'Find the area of a circle with radius 3cm.')
+        b = minhash.signature(u'Name three causes of the First World War.')
+        self.assertFalse(set(enumerate(minhash.band_keys(a))) & set(enumerate(minhash.band_keys(b))))
+
+    def test_signature_round_trip(self):
+        sig = minhash.signature(u'question')
+        self.assertTrue((minhash.from_bytes(minhash.to_bytes(sig)) == sig).all())
+
+    def test_empty_text_has_no_signature(self):
+        self.assertIsNone(minhash.signature(u'<p> ?! </p>'))
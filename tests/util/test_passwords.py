@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+
+from courseme.util import passwords
+from courseme.util.passwords import PasswordHasher, hash_passwords
+
+
+class PasswordHasherTestCase(unittest.TestCase):
+
+    def test_hash_and_verify_in_worker_processes(self):
+        hasher = PasswordHasher('pbkdf2:sha256:1000', processes=1)
+        try:
+            pwhash = hasher.hash('cat')
+            self.assertTrue(pwhash.startswith('pbkdf2:sha256:1000$'))
+            self.assertTrue(hasher.verify(pwhash, 'cat'))
+            self.assertFalse(hasher.verify(pwhash, 'dog'))
+        finally:
+            hasher.close()
+
+    def test_pool_is_started_before_first_use(self):
+        hasher = PasswordHasher('pbkdf2:sha256:1000', processes=1)
+        try:
+            self.assertTrue(hasher._pool is not None)
+        finally:
+            hasher.close()
+        self.assertTrue(hasher.verify(hasher.hash('cat'), 'cat'))
+
+    def test_bulk_hashing_uses_the_hashers_pool(self):
+        started = []
+        original = passwords.multiprocessing.Pool
+        passwords.multiprocessing.Pool = lambda *args: started.append(args) or original(*args)
+        try:
+            passwords.hasher.configure('pbkdf2:sha256:1000', 8, 1)
+            hashes = hash_passwords(['password%d' % i for i in range(10)])
+            passwords.hasher.configure('pbkdf2:sha256:1000', 8, 0)
+            hashes.extend(hash_passwords(['password%d' % i for i in range(10, 20)]))
+        finally:
+            passwords.multiprocessing.Pool = original
+            passwords.hasher.configure('pbkdf2:sha256:1000', 8, 0)
+        # DJG - only the hasher's own pool was started, the second batch was hashed inline
+        self.assertEqual(len(started), 1)
+        self.assertTrue(all(passwords.hasher.verify(h, 'password%d' % i) for i, h in enumerate(hashes)))
+
+    def test_verifies_hashes_read_back_as_unicode(self):
+        hasher = PasswordHasher('pbkdf2:sha256:1000')
+        self.assertTrue(hasher.verify(unicode(hasher.hash('cat')), 'cat'))
+
+    def test_needs_rehash_when_the_settings_change(self):
+        old = PasswordHasher('pbkdf2:sha256:1000')
+        new = PasswordHasher('pbkdf2:sha256:2000')
+        default = PasswordHasher('pbkdf2:sha256')
+        self.assertFalse(old.needs_rehash(old.hash('cat')))
+        self.assertTrue(new.needs_rehash(old.hash('cat')))
+        self.assertFalse(default.needs_rehash(default.hash('cat')))
+        self.assertTrue(new.verify(old.hash('cat'), 'cat'))
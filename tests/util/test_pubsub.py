@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+
+from courseme.util.pubsub import Broker
+
+
+class BrokerTestCase(unittest.TestCase):
+
+    def test_events_reach_subscribers_of_the_channel(self):
+        broker = Broker()
+        first, second = broker.subscribe('a'), broker.subscribe('a')
+        other = broker.subscribe('b')
+        self.assertEqual(broker.publish('a', 'message', {'count': 1}), 2)
+        self.assertEqual(first.get(0), ('message', {'count': 1}))
+        self.assertEqual(second.get(0), ('message', {'count': 1}))
+        self.assertEqual(other.get(0), None)
+
+    def test_close_stops_delivery(self):
+        broker = Broker()
+        subscription = broker.subscribe('a')
+        self.assertTrue(broker.listening('a'))
+        subscription.close()
+        self.assertFalse(broker.listening('a'))
+        self.assertEqual(len(broker), 0)
+        self.assertEqual(broker.publish('a', 'message'), 0)
+
+    def test_a_full_queue_overflows_without_blocking(self):
+        broker = Broker(queue_size=2)
+        slow = broker.subscribe('a')
+        for i in range(5):
+            broker.publish('a', 'message', i)
+        self.assertTrue(slow.overflowed)
+        self.assertEqual([slow.get(0), slow.get(0), slow.get(0)], [('message', 0), ('message', 1), None])